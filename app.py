@@ -1,19 +1,33 @@
-from fastapi import FastAPI, Response, status, Request, BackgroundTasks
-from fastapi.responses import JSONResponse, HTMLResponse, FileResponse
+from fastapi import FastAPI, Response, status, Request, BackgroundTasks, Depends
+from fastapi.responses import ORJSONResponse, HTMLResponse, FileResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 
 from pydantic import BaseModel, EmailStr, ValidationError
 from typing import List
 
-from modules.specsheet_generator import generate_specsheet_pdf
-from modules.google_sheet_service import append_row
-from modules.woocommerce_service import get_product
+from modules.specsheet_generator import generate_specsheet_pdf, generate_combined_specsheet_pdf, terminate_conversions, remove_output
+from modules.google_sheet_service import append_row, append_rows
+from modules.woocommerce_service import get_product, product_cache
 from modules.salesforce_service import SalesforceWebToLeadService
-from modules.gmail_service import send_single_product_specsheet_email, send_product_enquiry_email, send_request_sample_email, send_account_creation_email
-
+from modules.gmail_service import send_single_product_specsheet_email, send_product_enquiry_email, send_request_sample_email, send_account_creation_email, get_scheduler as get_email_scheduler
+from modules.bulk_export import iter_export_zip, DEFAULT_WORKERS
+from modules import idempotency, outbox, subscribers, tracing
+from modules.admission_control import AdmissionController, AdmissionRejected, RateLimiter, run_admitted, stream_admitted
+from modules.api_keys import ApiKeyAuthMiddleware, ApiKeyRejected, KeyStore, require_scope, route_scopes
+from modules.job_runner import JobRunner
+from modules.shared_state import state_path
+from modules.circuit_breaker import run_with_deadline, stats as breaker_stats
+
+from modules.lazy_imports import warm_up, status as lazy_import_status
+from modules.google_discovery import get_discovery_document
+from modules.email_templates import get_template, load_all as load_email_templates
+from modules.specsheet_templates import templates as specsheet_templates
+
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone, timedelta
 from dotenv import load_dotenv
-import uvicorn, os, json
+import asyncio, shutil, time, uvicorn, os, json, threading
 
 
 load_dotenv()
@@ -24,8 +38,61 @@ CUNSUMER_SECRET = os.getenv("WC_CONSUMER_SECRET")
 
 SALES_EMAIL = "sales@bigtree-group.com"
 API_KEY = os.getenv("API_KEY")
-
-app = FastAPI()
+# Render all cart products into a single PDF (one LibreOffice run, one attachment) instead of one PDF per product
+ENQUIRY_COMBINED_PDF = os.getenv("ENQUIRY_COMBINED_PDF", "false").lower() == "true"
+# Cart items fetched and rendered at a time, so a large cart never holds all its products/documents in memory
+# (with ENQUIRY_COMBINED_PDF, one combined PDF per chunk)
+ENQUIRY_CHUNK_SIZE = max(1, int(os.getenv("ENQUIRY_CHUNK_SIZE", "10")))
+
+# Import the lazily loaded PDF/Google stacks in the background after startup; /bigtree-webhooks-ready reports 503 until done
+WARM_UP_ON_START = os.getenv("WARM_UP_ON_START", "true").lower() == "true"
+warmed_up = threading.Event()
+
+def run_warm_up():
+    timings = warm_up()
+    for name, version in [("gmail", "v1"), ("sheets", "v4")]:
+        get_discovery_document(name, version)
+    load_email_templates()
+    specsheet_templates.ensure(STORE_URL, CUNSUMER_KEY, CUNSUMER_SECRET)
+    print(f"Warm-up complete: {len(timings)} modules in {sum(timings.values()):.2f}s")
+    warmed_up.set()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARM_UP_ON_START:
+        threading.Thread(target=run_warm_up, name="warm-up", daemon=True).start()
+    else:
+        warmed_up.set()
+
+    jobs.resume()
+    jobs.purge()
+    purge_downloads()
+    stop_replayer = threading.Event()
+    if OUTBOX_REPLAY_INTERVAL:
+        threading.Thread(target=run_outbox_replayer, args=(stop_replayer,), name="outbox-replayer", daemon=True).start()
+    if NEWSLETTER_SYNC_INTERVAL:
+        threading.Thread(target=run_subscriber_sync, args=(stop_replayer,), name="subscriber-sync", daemon=True).start()
+    yield
+    # The server has stopped taking requests; let running jobs finish, keep the rest for the next start
+    stop_replayer.set()
+    sync_subscribers()
+    if jobs.shutdown(JOB_DRAIN_SECONDS):
+        terminate_conversions()
+    if hasattr(sf, "flush"):
+        sf.flush()
+    tracing.flush()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# Routes declare the API key scope they need with dependencies=[api_key("<scope>")]. Keys come from API_KEYS_FILE
+# (hot-reloaded), or API_KEY when there is no file. The middleware rejects requests to those paths before their body
+# is read; the dependency checks again, so a path the middleware does not recognize is never left open (see modules/api_keys)
+api_keys = KeyStore(fallback_key=API_KEY)
+API_KEY_SCOPES = {}  # {path: scope}, filled from the routes once they are all defined
+app.add_middleware(ApiKeyAuthMiddleware, store=api_keys, scopes=API_KEY_SCOPES)
+
+def api_key(scope):
+    return require_scope(api_keys, scope)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Or specify your frontend domain
@@ -33,8 +100,192 @@ app.add_middleware(
     allow_methods=["POST", "GET"],
     allow_headers=["*"],  # Or ["Content-Type"]
 )
+# Added last, so it is outermost: the request span also covers rejected keys and CORS preflights
+app.add_middleware(tracing.TracingMiddleware)
+
+# "web_to_lead" (one form POST per lead) or "bulk" (buffered REST sObject Collections, see modules/salesforce_bulk_service)
+SALESFORCE_BACKEND = os.getenv("SALESFORCE_BACKEND", "web_to_lead")
+if SALESFORCE_BACKEND == "bulk":
+    from modules.salesforce_bulk_service import SalesforceBulkLeadService
+    sf = SalesforceBulkLeadService(flush_interval=float(os.getenv("SF_FLUSH_INTERVAL", "5")))
+else:
+    sf = SalesforceWebToLeadService(debug_mode=True, debug_email="mzahi@bigtree-group.com")
+
+
+# Integration calls are recorded in the outbox before being attempted; failures are replayed later
+OUTBOX_REPLAY_INTERVAL = int(os.getenv("OUTBOX_REPLAY_INTERVAL", "300"))  # seconds, 0 disables the background replayer
+
+def deliver_sheet_row(payload):
+    return append_row(payload["sheet_id"], payload["sheet_name"], payload["row"])
+
+def deliver_sheet_rows(payloads):
+    return append_rows(payloads[0]["sheet_id"], payloads[0]["sheet_name"], [payload["row"] for payload in payloads])
+
+def deliver_salesforce_lead(payload):
+    result = getattr(sf, payload["method"])(**payload["kwargs"])
+    if not result.get("success"):
+        print(f"Salesforce {payload['method']} failed: {result}")
+    return result.get("success", False)
+
+def deliver_specsheet_email(payload):
+    file_path = payload["file_path"]
+    if os.path.exists(file_path):
+        return send_single_product_specsheet_email(payload["to"], file_path)
+
+    # Replayed after the PDF was cleaned up: render it again
+    product = get_product(store_url=STORE_URL, consumer_key=CUNSUMER_KEY, consumer_secret=CUNSUMER_SECRET, product_id=payload["product_id"])
+    if not product:
+        return False
+    file_path = generate_specsheet_pdf(product, wc_url=STORE_URL, wc_key=CUNSUMER_KEY, wc_secret=CUNSUMER_SECRET)
+    try:
+        return send_single_product_specsheet_email(payload["to"], file_path)
+    finally:
+        remove_output(file_path)
+
+outbox.register("sheets.append", deliver_sheet_row, batch_handler=deliver_sheet_rows)
+outbox.register("salesforce.lead", deliver_salesforce_lead)
+outbox.register("gmail.specsheet", deliver_specsheet_email)
+
+def record_sheet_row(sheet_name, row):
+    return outbox.deliver("sheets.append", {"sheet_id": SHEET_ID, "sheet_name": sheet_name, "row": row})
+
+def record_lead(method, **kwargs):
+    return outbox.deliver("salesforce.lead", {"method": method, "kwargs": kwargs})
+
+def discard_files(paths):
+    for file_path in paths:
+        try:
+            remove_output(file_path)  # With the render's own directory
+        except Exception as e:
+            print(f"Failed to remove file {file_path}: {e}")
+
+def run_outbox_replayer(stop: threading.Event):
+    while not stop.wait(OUTBOX_REPLAY_INTERVAL):
+        try:
+            stats = outbox.replay()
+            if stats["done"] or stats["failed"]:
+                print(f"Outbox replay: {stats}")
+            jobs.resume()  # Jobs left by a worker that stopped after this one started
+        except Exception as e:
+            print(f"Outbox replay error: {e}")
+
+
+# Background jobs are persisted (STATE_DIR/jobs.db) so a restart drains or resumes them instead of dropping them
+JOB_DRAIN_SECONDS = float(os.getenv("JOB_DRAIN_SECONDS", "90"))  # keep below gunicorn's GRACEFUL_TIMEOUT
+# Time budget shared by the external calls of one job / one specsheet request (each call is also capped by its own timeout)
+JOB_DEADLINE_SECONDS = float(os.getenv("JOB_DEADLINE_SECONDS", "300"))
+SPECSHEET_DEADLINE_SECONDS = float(os.getenv("SPECSHEET_DEADLINE_SECONDS", "60"))
+jobs = JobRunner()
+
+
+# New newsletter subscribers are appended to the sheet in bulk (see modules/subscribers)
+NEWSLETTER_SYNC_INTERVAL = int(os.getenv("NEWSLETTER_SYNC_INTERVAL", "60"))  # seconds, 0 disables the background sync
 
-sf = SalesforceWebToLeadService(debug_mode=True, debug_email="mzahi@bigtree-group.com")
+def sync_subscribers():
+    try:
+        return subscribers.sync(lambda rows: append_rows(SHEET_ID, subscribers.NEWSLETTER_SHEET, rows))
+    except Exception as e:
+        print(f"Subscriber sync error: {e}")
+
+def run_subscriber_sync(stop: threading.Event):
+    while not stop.wait(NEWSLETTER_SYNC_INTERVAL):
+        sync_subscribers()
+
+
+# Admission control: concurrent jobs per endpoint group + how many may wait for a slot
+admission = {
+    "specsheet": AdmissionController("specsheet", int(os.getenv("ADMISSION_SPECSHEET_CONCURRENCY", "2")), int(os.getenv("ADMISSION_SPECSHEET_QUEUE", "10"))),
+    "pdf_jobs": AdmissionController("enquiry", int(os.getenv("ADMISSION_PDF_JOBS_CONCURRENCY", "2")), int(os.getenv("ADMISSION_PDF_JOBS_QUEUE", "50")), retry_after=30),
+    "leads": AdmissionController("contact", int(os.getenv("ADMISSION_LEADS_CONCURRENCY", "4")), int(os.getenv("ADMISSION_LEADS_QUEUE", "200"))),
+    "export": AdmissionController("export", int(os.getenv("ADMISSION_EXPORT_CONCURRENCY", "1")), int(os.getenv("ADMISSION_EXPORT_QUEUE", "0")), retry_after=300),
+}
+
+# Token-bucket rate limit per client IP in front of the POST routes, off by default: the callers are mostly the
+# WordPress server or a proxy, which would share one bucket. Per-key limits are applied by ApiKeyAuthMiddleware
+RATE_LIMIT_IP_PER_MINUTE = int(os.getenv("RATE_LIMIT_IP_PER_MINUTE", "0"))
+ip_rate_limiter = RateLimiter(RATE_LIMIT_IP_PER_MINUTE, int(os.getenv("RATE_LIMIT_IP_BURST", "10"))) if RATE_LIMIT_IP_PER_MINUTE else None
+# Peers whose X-Forwarded-For is believed (comma separated), e.g. the load balancer
+TRUSTED_PROXIES = {address.strip() for address in os.getenv("TRUSTED_PROXIES", "").split(",") if address.strip()}
+
+
+def client_ip(request: Request) -> str:
+    """The caller's address: the last X-Forwarded-For hop not added by a trusted proxy"""
+    peer = request.client.host if request.client else "unknown"
+    if peer not in TRUSTED_PROXIES:
+        return peer
+    hops = [hop.strip() for hop in request.headers.get("X-Forwarded-For", "").split(",") if hop.strip()]
+    while hops and hops[-1] in TRUSTED_PROXIES:
+        hops.pop()
+    return hops[-1] if hops else peer
+
+
+def rejected_response(e: AdmissionRejected):
+    return ORJSONResponse(status_code=e.status_code, content={"status": "fail", "detail": e.detail}, headers={"Retry-After": str(e.retry_after)})
+
+
+@app.middleware("http")
+async def rate_limit(request: Request, call_next):
+    if request.method == "POST" and ip_rate_limiter:
+        retry_after = ip_rate_limiter.check(client_ip(request))
+        if retry_after:
+            return rejected_response(AdmissionRejected(429, "Rate limit exceeded", max(1, round(retry_after))))
+
+    return await call_next(request)
+
+
+@app.exception_handler(ApiKeyRejected)
+async def api_key_rejected_handler(request: Request, e: ApiKeyRejected):
+    headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+    return ORJSONResponse(status_code=e.status_code, content={"status": "fail", "detail": e.detail}, headers=headers)
+
+
+class RequestRejected(Exception):
+    def __init__(self, status_code: int, detail: str):
+        self.status_code = status_code
+        self.detail = detail
+
+@app.exception_handler(RequestRejected)
+async def request_rejected_handler(request: Request, e: RequestRejected):
+    return ORJSONResponse(status_code=e.status_code, content={"status": "fail", "detail": e.detail})
+
+
+def json_body(model, detail="Invalid Data"):
+    """Dependency validating the raw request body straight into model (one parse, no intermediate dict)"""
+    async def parse(request: Request):
+        try:
+            return model.model_validate_json(await request.body())
+        except ValidationError:
+            raise RequestRejected(422, detail)
+    return Depends(parse)
+
+
+async def claim_request(request: Request, validated_data):
+    """Returns (idempotency key, response to send back if this is a duplicate)"""
+    key = idempotency.request_key(request.url.path, request.headers.get("Idempotency-Key"), validated_data)
+    original = await run_in_threadpool(idempotency.claim, key)
+    if original is None:
+        return key, None
+
+    status_code, body = original
+    if body is None:
+        return key, ORJSONResponse(status_code=409, content={"status": "fail", "detail": "Duplicate request is still being processed"}, headers={"Retry-After": "1"})
+    return key, ORJSONResponse(status_code=status_code, content=json.loads(body), headers={"Idempotent-Replayed": "true"})
+
+async def submit_claimed(idempotency_key, kind, controller, validated_data):
+    """Submit the job of a claimed request; the claim is released when the job is not accepted"""
+    try:
+        ticket = admission[controller].admit()
+        job_id = jobs.submit(kind, validated_data, ticket=ticket)
+    except Exception as e:
+        await run_in_threadpool(idempotency.release, idempotency_key)
+        if isinstance(e, AdmissionRejected):
+            return rejected_response(e)
+        raise
+
+    # Duplicates are answered with this same body, so a retried request gets the original job id
+    content = {"status": "success", "message": "Processing your request", "job_id": job_id, "status_url": f"/jobs/{job_id}"}
+    await run_in_threadpool(idempotency.complete, idempotency_key, 200, content)
+    return ORJSONResponse(status_code=200, content=content)
 
 
 
@@ -50,40 +301,19 @@ class ContactRequest(BaseModel):
     message: str | None = None
     src: str | None = None
 
-def process_contact_request(fname, lname, email, phone, company, project, project_location, message, src):
-    try:
-        row = [fname, lname, email, phone, company, project, project_location, message, src, datetime.now(timezone(timedelta(hours=4))).strftime("%Y-%m-%d %H:%M:%S")]
-        append_row(SHEET_ID, "contact", row)
-        sf_result = sf.insert_contact_form(first_name=fname, last_name=lname, email=email, mobile=phone, company=company, country_code=project_location, project=project, general_notes=message)
-
-    except Exception as e:
-        print(f"Error processing contact request for {email}: {e}")
-
-@app.post("/bt-contact-webhook-v2-1")#5. Contact Request -- done -- [contact page]
-async def contact_request_webhook(request: Request, background_tasks: BackgroundTasks):
-    api_key = request.headers.get("X-API-Key")
-    if not api_key or api_key != API_KEY:
-        return JSONResponse(status_code=401, content={"status": "fail", "detail": "Unauthorized"})
-    
-    payload = await request.json()
-    try:
-        validated_data = ContactRequest.model_validate(payload)
-        fname = validated_data.fname
-        lname = validated_data.lname
-        email = validated_data.email
-        phone = validated_data.phone
-        company = validated_data.company
-        project = validated_data.project
-        project_location = validated_data.project_location
-        message = validated_data.message
-        src = validated_data.src
+def process_contact_request(data: ContactRequest):
+    # Errors propagate: the job is recorded as failed (sheet/Salesforce failures are replayed by the outbox instead)
+    row = [data.fname, data.lname, data.email, data.phone, data.company, data.project, data.project_location, data.message, data.src, datetime.now(timezone(timedelta(hours=4))).strftime("%Y-%m-%d %H:%M:%S")]
+    record_sheet_row("contact", row)
+    record_lead("insert_contact_form", first_name=data.fname, last_name=data.lname, email=data.email, mobile=data.phone, company=data.company, country_code=data.project_location, project=data.project, general_notes=data.message)
 
-    except ValidationError as e:
-        return JSONResponse(status_code=422, content={"status": "fail", "detail": "Invalid Data"})
+@app.post("/bt-contact-webhook-v2-1", dependencies=[api_key("leads")])#5. Contact Request -- done -- [contact page]
+async def contact_request_webhook(request: Request, validated_data: ContactRequest = json_body(ContactRequest)):
+    idempotency_key, duplicate = await claim_request(request, validated_data)
+    if duplicate:
+        return duplicate
 
-
-    background_tasks.add_task(process_contact_request, fname, lname, email, phone, company, project, project_location, message, src)
-    return JSONResponse(status_code=200, content={"status": "success", "message": "Processing your request"})
+    return await submit_claimed(idempotency_key, "contact", "leads", validated_data)
 
 
 
@@ -100,19 +330,20 @@ class RequestSample(BaseModel):
     qte: str
     message: str | None = None
 
-def process_request_sample(first_name, last_name, email, phone, company, project, country, quantity, message, product_ids, account_password):
+def process_request_sample(data: RequestSample):
+    email, product_ids = data.email, data.productId
+    # 1. Append to Google Sheet
+    row = [data.fname, data.lname, data.phone, email, data.company, data.project, data.country, data.qte, ", ".join(map(str, product_ids)), data.message, datetime.now(timezone(timedelta(hours=4))).strftime("%Y-%m-%d %H:%M:%S")]
+    record_sheet_row("sample_requests", row)
+
+    # 2. Insert into Salesforce
+    other_product_interest = f"Product IDs: {', '.join([str(pid) for pid in product_ids])}. Message: {data.message}"
+    sf_result = record_lead("insert_sample_request", first_name=data.fname, last_name=data.lname, email=email, company=data.company, mobile=data.phone, project=data.project, country=data.country, quantity=data.qte, other_product_interest=other_product_interest)
+    print("Salesforce lead submitted:", sf_result)
+
+    # 3. Generate PDFs
+    pdf_specsheet_files = []
     try:
-        # 1. Append to Google Sheet
-        row = [first_name, last_name, phone, email, company, project, country, quantity, ", ".join(map(str, product_ids)), message, datetime.now(timezone(timedelta(hours=4))).strftime("%Y-%m-%d %H:%M:%S")]
-        append_row(SHEET_ID, "sample_requests", row)
-        
-        # 2. Insert into Salesforce
-        other_product_interest = f"Product IDs: {', '.join([str(pid) for pid in product_ids])}. Message: {message}"
-        sf_result = sf.insert_sample_request(first_name=first_name, last_name=last_name, email=email, company=company, mobile=phone, project=project, country=country, quantity=quantity, other_product_interest=other_product_interest)
-        print("Salesforce Response:", sf_result)
-
-        # 3. Generate PDFs
-        pdf_specsheet_files = []
         for product_id in product_ids:
             product = get_product(store_url=STORE_URL, consumer_key=CUNSUMER_KEY, consumer_secret=CUNSUMER_SECRET, product_id=product_id)
             if product:
@@ -124,45 +355,20 @@ def process_request_sample(first_name, last_name, email, phone, company, project
         #     send_request_sample_email(email, pdf_specsheet_files, cc=SALES_EMAIL)
 
         # 5. Send account creation email if password provided
-        # if account_password:
-        #     send_account_creation_email(email, account_password)
+        # if data.account_password:
+        #     send_account_creation_email(email, data.account_password)
 
-        # 6. Clean up generated PDF files
-        for file_path in pdf_specsheet_files:
-            try:
-                os.remove(file_path)
-            except Exception as e:
-                print(f"Failed to remove file {file_path}: {e}")
+    finally:
+        # 6. Clean up generated PDF files, also when a step failed
+        discard_files(pdf_specsheet_files)
 
-    except Exception as e:
-        print(f"Error processing sample request for {email}: {e}")
-
-@app.post("/bt-send-request-sample-webhook-v2-1")#4. Request Sample --  -- [single product page] 
-async def request_sample_webhook(request: Request, background_tasks: BackgroundTasks):
-    api_key = request.headers.get("X-API-Key")
-    if not api_key or api_key != API_KEY:
-        return JSONResponse(status_code=401, content={"status": "fail", "detail": "Unauthorized"})
-    
-    payload = await request.json()
-    try:
-        validated_data = RequestSample.model_validate(payload)
-        product_ids = validated_data.productId
-        first_name = validated_data.fname
-        last_name = validated_data.lname
-        email = validated_data.email
-        account_password = validated_data.account_password
-        phone = validated_data.phone
-        company = validated_data.company
-        project = validated_data.project
-        country = validated_data.country
-        quantity = validated_data.qte
-        message = validated_data.message
+@app.post("/bt-send-request-sample-webhook-v2-1", dependencies=[api_key("leads")])#4. Request Sample --  -- [single product page] 
+async def request_sample_webhook(request: Request, validated_data: RequestSample = json_body(RequestSample)):
+    idempotency_key, duplicate = await claim_request(request, validated_data)
+    if duplicate:
+        return duplicate
 
-    except ValidationError as e:
-        return JSONResponse(status_code=422, content={"status": "fail", "detail": "Invalid Data"})
-
-    background_tasks.add_task(process_request_sample, first_name, last_name, email, phone, company, project, country, quantity, message, product_ids, account_password)
-    return JSONResponse(status_code=200, content={"status": "success", "message": "Processing your request"})
+    return await submit_claimed(idempotency_key, "sample", "pdf_jobs", validated_data)
 
 
 
@@ -178,114 +384,140 @@ class ProductEnquiry(BaseModel):
     project: str
     country: str
     message: str | None = None
-    req_sample: str
+    req_sample: str  # Yes/No
     cart_items: List[CartItem]
     account_password: str | None = None
 
-def process_enquiry(name, email, phone, company, project, country, message, req_sample, cart_items, product_ids, account_password):
-    try:
-        # 1. Append to Google Sheet
-        row = [name, email, phone, company, project, country, message, req_sample, ", ".join(map(str, cart_items)), datetime.now(timezone(timedelta(hours=4))).strftime("%Y-%m-%d %H:%M:%S")]
-        append_row(SHEET_ID, "enquiries", row)
-
-        # 2. Insert into Salesforce
-        combined_message = f"Sample Request: {req_sample}. {message}" if message else f"Sample Request: {req_sample}"
-        sf_result = sf.insert_product_inquiry(full_name=name, email=email, phone=phone, company_name=company, project=project, country=country, message=combined_message, products=[str(pid) for pid in product_ids])
+def process_enquiry(data: ProductEnquiry):
+    name, email, cart_items = data.name, data.email, data.cart_items
+    product_ids = [item.id for item in cart_items]
+    # 1. Append to Google Sheet
+    row = [name, email, data.phone, data.company, data.project, data.country, data.message, data.req_sample, ", ".join(map(str, cart_items)), datetime.now(timezone(timedelta(hours=4))).strftime("%Y-%m-%d %H:%M:%S")]
+    record_sheet_row("enquiries", row)
 
-        # 3. Generate PDFs
-        pdf_specsheet_files = []
-        for product_id in product_ids:
-            product = get_product(store_url=STORE_URL, consumer_key=CUNSUMER_KEY, consumer_secret=CUNSUMER_SECRET, product_id=product_id)
-            if product:
-                file_path = generate_specsheet_pdf(product, wc_url=STORE_URL, wc_key=CUNSUMER_KEY, wc_secret=CUNSUMER_SECRET)
-                pdf_specsheet_files.append(file_path)
+    # 2. Insert into Salesforce
+    combined_message = f"Sample Request: {data.req_sample}. {data.message}" if data.message else f"Sample Request: {data.req_sample}"
+    record_lead("insert_product_inquiry", full_name=name, email=email, phone=data.phone, company_name=data.company, project=data.project, country=data.country, message=combined_message, products=[str(pid) for pid in product_ids])
 
-        # 4. Send enquiry email
+    # 3. Generate PDFs, ENQUIRY_CHUNK_SIZE cart items at a time (only the PDF paths are kept)
+    pdf_specsheet_files = []
+    try:
+        chunks = [cart_items[i:i + ENQUIRY_CHUNK_SIZE] for i in range(0, len(cart_items), ENQUIRY_CHUNK_SIZE)]
+        name_slug = "".join(c for c in email if c.isalnum())
+        stamp = int(datetime.now().timestamp())
+        for part, chunk in enumerate(chunks, start=1):
+            if ENQUIRY_COMBINED_PDF:
+                items = []
+                for item in chunk:
+                    product = get_product(store_url=STORE_URL, consumer_key=CUNSUMER_KEY, consumer_secret=CUNSUMER_SECRET, product_id=item.id)
+                    if product:
+                        items.append((product, item.quantity))
+                if items:
+                    title = f"Product Enquiry - {name}" if len(chunks) == 1 else f"Product Enquiry - {name} ({part}/{len(chunks)})"
+                    file_path = generate_combined_specsheet_pdf(items, f"enquiry_{name_slug}_{stamp}_{part}", wc_url=STORE_URL, wc_key=CUNSUMER_KEY, wc_secret=CUNSUMER_SECRET, title=title)
+                    pdf_specsheet_files.append(file_path)
+            else:
+                for item in chunk:
+                    product = get_product(store_url=STORE_URL, consumer_key=CUNSUMER_KEY, consumer_secret=CUNSUMER_SECRET, product_id=item.id)
+                    if product:
+                        file_path = generate_specsheet_pdf(product, wc_url=STORE_URL, wc_key=CUNSUMER_KEY, wc_secret=CUNSUMER_SECRET)
+                        pdf_specsheet_files.append(file_path)
+
+        # 4. Send enquiry email (several emails, or one .zip, past EMAIL_ATTACHMENTS_MAX_BYTES)
         # if pdf_specsheet_files:
         #     send_product_enquiry_email(name, email, pdf_specsheet_files, cc=SALES_EMAIL)
 
         # 5. Send account creation email if password provided
-        # if account_password:
-            # send_account_creation_email(email, account_password)
+        # if data.account_password:
+            # send_account_creation_email(email, data.account_password)
 
-        # 6. Clean up generated PDF files
-        for file_path in pdf_specsheet_files:
-            try:
-                os.remove(file_path)
-            except Exception as e:
-                print(f"Failed to remove file {file_path}: {e}")
+    finally:
+        # 6. Clean up generated PDF files, also when a step failed
+        discard_files(pdf_specsheet_files)
 
-    except Exception as e:
-        print(f"Error processing product enquiry for {email}: {e}")
-
-@app.post("/bt-send-product-enquiry-webhook-v2-1")#3. Product Enquiry -- Done -- [multiple products in cart]
-async def product_enquiry_webhook(request: Request, background_tasks: BackgroundTasks):
-    api_key = request.headers.get("X-API-Key")
-    if not api_key or api_key != API_KEY:
-        return JSONResponse(status_code=401, content={"status": "fail", "detail": "Unauthorized"})
-
-    payload = await request.json()
-    try:
-        validated_data = ProductEnquiry.model_validate(payload)
-        name = validated_data.name
-        email = validated_data.email
-        phone = validated_data.phone
-        company = validated_data.company
-        project = validated_data.project
-        country = validated_data.country
-        message = validated_data.message
-        account_password = validated_data.account_password
-        req_sample = validated_data.req_sample # Yes/No
-        cart_items = validated_data.cart_items
-        product_ids = [item.id for item in cart_items]
+@app.post("/bt-send-product-enquiry-webhook-v2-1", dependencies=[api_key("leads")])#3. Product Enquiry -- Done -- [multiple products in cart]
+async def product_enquiry_webhook(request: Request, validated_data: ProductEnquiry = json_body(ProductEnquiry)):
+    idempotency_key, duplicate = await claim_request(request, validated_data)
+    if duplicate:
+        return duplicate
 
-    except ValidationError as e:
-        return JSONResponse(status_code=422, content={"status": "fail", "detail": "Invalid Data"})
-
-    background_tasks.add_task(process_enquiry, name, email, phone, company, project, country, message, req_sample, cart_items, product_ids, account_password)
-    return JSONResponse(status_code=200, content={"status": "success", "message": "Processing your request"})
+    return await submit_claimed(idempotency_key, "enquiry", "pdf_jobs", validated_data)
 
 
 
 class SpecSheetWebhook(BaseModel):
     product_id: int
     email: EmailStr
+    name: str = ""
 
-def process_specsheet(name, email, product_id, file_path):
+def process_specsheet(data: SpecSheetWebhook, file_path, keep_file=False):
     try:
-        row = [name, email, product_id, datetime.now(timezone(timedelta(hours=4))).strftime("%Y-%m-%d %H:%M:%S")]
-        append_row(SHEET_ID, "specsheets", row)
-        send_single_product_specsheet_email(email, file_path)
+        row = [data.name, data.email, data.product_id, datetime.now(timezone(timedelta(hours=4))).strftime("%Y-%m-%d %H:%M:%S")]
+        record_sheet_row("specsheets", row)
+        outbox.deliver("gmail.specsheet", {"to": data.email, "product_id": data.product_id, "file_path": file_path})
+    finally:
+        if not keep_file:
+            discard_files([file_path])
+
+# Specsheets rendered asynchronously (Prefer: respond-async) are kept for download this long
+SPECSHEET_DOWNLOAD_TTL = int(os.getenv("SPECSHEET_DOWNLOAD_TTL", "3600"))
+
+def purge_downloads(max_age=SPECSHEET_DOWNLOAD_TTL):
+    directory = os.path.dirname(state_path("downloads", "x"))
+    cutoff = time.time() - max_age
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
         try:
-            os.remove(file_path)
+            if os.stat(path).st_mtime < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        except FileNotFoundError:
+            pass
+
+def render_specsheet(data: SpecSheetWebhook):
+    """Async specsheet job: render into STATE_DIR/downloads, then the usual sheet row and email; the file stays for download"""
+    purge_downloads()
+    product = get_product(store_url=STORE_URL, consumer_key=CUNSUMER_KEY, consumer_secret=CUNSUMER_SECRET, product_id=data.product_id)
+    if not product:
+        raise LookupError(f"Product {data.product_id} not found")
 
-        except Exception as e:
-            print(f"Failed to remove file. {e}")
+    output_dir = os.path.dirname(state_path("downloads", "x"))  # The render gets its own directory in there
+    file_path = run_with_deadline(SPECSHEET_DEADLINE_SECONDS, generate_specsheet_pdf, product, wc_url=STORE_URL, wc_key=CUNSUMER_KEY, wc_secret=CUNSUMER_SECRET, output_dir=output_dir)
+    process_specsheet(data, file_path, keep_file=True)
+    return {"file": file_path, "filename": f"BigTree_{product['name']}_specsheet.pdf"}
 
-    except Exception as e:
-        print(f"Error processing specsheet. {e}")
-
-@app.post("/bt-single-product-specsheet-webhook-v2-1")#2. Product Specsheet [single product page] --done--
-async def specsheet_webhook(request: Request, background_tasks: BackgroundTasks):
-    api_key = request.headers.get("X-API-Key")
-    if not api_key or api_key != API_KEY:
-        return JSONResponse(status_code=401, content={"status": "fail", "detail": "Unauthorized"})
-    
-    payload = await request.json()
+def submit_specsheet_follow_up(data: SpecSheetWebhook, file_path):
+    """Queue the sheet row and email for a specsheet already sent; runs after the response, so errors are only logged"""
     try:
-        validated_data = SpecSheetWebhook.model_validate(payload)
-        product_id, email, name = validated_data.product_id, validated_data.email, payload.get("name", "")
+        jobs.submit("specsheet", data, file_path=file_path)
+    except Exception as e:
+        print(f"❌ Specsheet follow-up for product {data.product_id} not queued: {e}")
+        discard_files([file_path])
 
-    except ValidationError as e:
-        return JSONResponse(status_code=422, content={"status": "fail", "detail": "Invalid or missing fields"})
+@app.post("/bt-single-product-specsheet-webhook-v2-1", dependencies=[api_key("specsheet")])#2. Product Specsheet [single product page] --done--
+async def specsheet_webhook(request: Request, background_tasks: BackgroundTasks, validated_data: SpecSheetWebhook = json_body(SpecSheetWebhook, "Invalid or missing fields")):
+    # Usually answered from the product cache; a miss is fetched off the event loop
+    product = await run_in_threadpool(get_product, store_url=STORE_URL, consumer_key=CUNSUMER_KEY, consumer_secret=CUNSUMER_SECRET, product_id=validated_data.product_id)
+    if not product:
+        return ORJSONResponse(status_code=404, content={"status": "fail", "detail": "Product not found"})
 
+    if "respond-async" in request.headers.get("Prefer", ""):
+        # Answered at once; the PDF is rendered by a job and downloaded from /jobs/{id}/download when done
+        try:
+            ticket = admission["specsheet"].admit()
+            job_id = jobs.submit("specsheet_pdf", validated_data, ticket=ticket)
+        except AdmissionRejected as e:
+            return rejected_response(e)
+        headers = {"Location": f"/jobs/{job_id}", "Preference-Applied": "respond-async", "Access-Control-Expose-Headers": "Location"}
+        return ORJSONResponse(status_code=202, content={"status": "accepted", "job_id": job_id, "status_url": f"/jobs/{job_id}"}, headers=headers)
 
-    product = get_product(store_url=STORE_URL, consumer_key=CUNSUMER_KEY, consumer_secret=CUNSUMER_SECRET, product_id=product_id)
-    if not product:
-        return JSONResponse(status_code=404, content={"status": "fail", "detail": "Product not found"})
+    try:
+        ticket = admission["specsheet"].admit()
+    except AdmissionRejected as e:
+        return rejected_response(e)
 
-    file_path = generate_specsheet_pdf(product, wc_url=STORE_URL, wc_key=CUNSUMER_KEY, wc_secret=CUNSUMER_SECRET)
-    background_tasks.add_task(process_specsheet, name, email, product_id, file_path)
+    # Rendered off the event loop, at most ADMISSION_SPECSHEET_CONCURRENCY at a time
+    file_path = await run_in_threadpool(run_admitted, ticket, run_with_deadline, SPECSHEET_DEADLINE_SECONDS, generate_specsheet_pdf, product, wc_url=STORE_URL, wc_key=CUNSUMER_KEY, wc_secret=CUNSUMER_SECRET)
+    background_tasks.add_task(submit_specsheet_follow_up, validated_data, file_path)  # After the file is sent
 
     response = FileResponse(path=file_path, media_type="application/pdf", filename=f"BigTree_{product['name']}_specsheet.pdf")
     response.headers["Access-Control-Expose-Headers"] = "Content-Disposition"
@@ -293,39 +525,129 @@ async def specsheet_webhook(request: Request, background_tasks: BackgroundTasks)
 
 
 
-class NewsletterWebhook(BaseModel):
-    Email: EmailStr
+class BulkSpecsheetExport(BaseModel):
+    category: int | None = None
+    brand: int | None = None
+    product_ids: List[int] | None = None
+    workers: int = DEFAULT_WORKERS
+
+@app.post("/bt-bulk-specsheet-export-v2-1", dependencies=[api_key("export")])#Bulk specsheet export -- [sales team]
+async def bulk_specsheet_export(validated_data: BulkSpecsheetExport = json_body(BulkSpecsheetExport)):
+    targets = [validated_data.category, validated_data.brand, validated_data.product_ids]
+    if sum(1 for target in targets if target) != 1:
+        return ORJSONResponse(status_code=422, content={"status": "fail", "detail": "Provide exactly one of category, brand or product_ids"})
 
-def process_newsletter(name, email):
     try:
-        row = [name, email, datetime.now(timezone(timedelta(hours=4))).strftime("%Y-%m-%d %H:%M:%S")]
-        append_row(SHEET_ID, "subscribers", row)
+        ticket = admission["export"].admit()
+    except AdmissionRejected as e:
+        return rejected_response(e)
 
-    except Exception as e:
-        print(f"Error processing newsletter subscription for {email}: {e}")
+    workers = max(1, min(validated_data.workers, 4))
+    stream = iter_export_zip(STORE_URL, CUNSUMER_KEY, CUNSUMER_SECRET, category=validated_data.category, brand=validated_data.brand, product_ids=validated_data.product_ids, workers=workers)
+    filename = f"BigTree_specsheets_{datetime.now(timezone(timedelta(hours=4))).strftime('%Y%m%d_%H%M%S')}.zip"
+    return StreamingResponse(stream_admitted(ticket, stream), media_type="application/zip", headers={"Content-Disposition": f'attachment; filename="{filename}"', "Access-Control-Expose-Headers": "Content-Disposition"})
+
+
+
+class NewsletterWebhook(BaseModel):
+    Email: EmailStr
+    Name: str = ""
+
+def process_newsletter(data: NewsletterWebhook):
+    # Duplicates stop here; new subscribers reach the sheet with the next bulk sync
+    return subscribers.add(data.Email, data.Name)
 
 @app.post("/bigtree-newsletter-email-webhook-v2-1-webhook")
-async def newsletter_webhook(request: Request, background_tasks: BackgroundTasks):
+async def newsletter_webhook(request: Request):
     form_data = await request.form()
     try:
         validated_data = NewsletterWebhook.model_validate(dict(form_data))
-        email = validated_data.Email
-        name = form_data.get('Name', '')
 
-    except ValidationError as e:
-        return JSONResponse(status_code=422, content={"status": "fail", "detail": "Invalid or missing email field"})
+    except ValidationError:
+        return ORJSONResponse(status_code=422, content={"status": "fail", "detail": "Invalid or missing email field"})
 
-    background_tasks.add_task(process_newsletter, name, email)
+    await run_in_threadpool(process_newsletter, validated_data)
     return Response(status_code=status.HTTP_200_OK)
 
 
 
+jobs.register("contact", process_contact_request, ContactRequest, JOB_DEADLINE_SECONDS, admission=admission["leads"])
+jobs.register("sample", process_request_sample, RequestSample, JOB_DEADLINE_SECONDS, admission=admission["pdf_jobs"])
+jobs.register("enquiry", process_enquiry, ProductEnquiry, JOB_DEADLINE_SECONDS, admission=admission["pdf_jobs"])
+jobs.register("specsheet", process_specsheet, SpecSheetWebhook, JOB_DEADLINE_SECONDS)
+jobs.register("specsheet_pdf", render_specsheet, SpecSheetWebhook, JOB_DEADLINE_SECONDS, admission=admission["specsheet"])
+
+
+# Job status for the webhook responses' job ids. The id is random (128 bits) and is the only credential:
+# the status never includes the submitted data
+JOB_POLL_MAX_WAIT = float(os.getenv("JOB_POLL_MAX_WAIT", "30"))
+
+def job_status(job):
+    content = {"job_id": job["id"], "kind": job["kind"], "status": job["status"], "attempts": job["attempts"], "created": job["created"], "updated": job["updated"]}
+    if job["status"] == "failed":
+        content["detail"] = "Processing failed"
+    result = job["result"] if isinstance(job["result"], dict) else {}
+    if job["status"] == "done" and result.get("file"):
+        content["download_url"] = f"/jobs/{job['id']}/download"
+    return content
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """Job status; with ?wait=<seconds> the answer is held until the job finishes (at most JOB_POLL_MAX_WAIT)"""
+    job = jobs.get(job_id)
+    if job is None:
+        return ORJSONResponse(status_code=404, content={"status": "fail", "detail": "Unknown job"})
+
+    end = time.monotonic() + min(max(wait, 0), JOB_POLL_MAX_WAIT)
+    while job["status"] in ("queued", "running") and time.monotonic() < end:
+        await asyncio.sleep(min(0.5, end - time.monotonic()))
+        job = jobs.get(job_id)
+    return job_status(job)
+
+@app.get("/jobs/{job_id}/download")
+async def download_job_file(job_id: str):
+    job = jobs.get(job_id)
+    result = job["result"] if job and isinstance(job["result"], dict) else {}
+    if job is None or job["status"] == "failed" or (job["status"] == "done" and not result.get("file")):
+        return ORJSONResponse(status_code=404, content={"status": "fail", "detail": "Nothing to download"})
+    if job["status"] != "done":
+        return ORJSONResponse(status_code=409, content={"status": "fail", "detail": f"Job is {job['status']}"}, headers={"Retry-After": "2"})
+    if not os.path.exists(result["file"]):
+        return ORJSONResponse(status_code=410, content={"status": "fail", "detail": "The file has expired"})
+
+    response = FileResponse(path=result["file"], media_type="application/pdf", filename=result.get("filename"))
+    response.headers["Access-Control-Expose-Headers"] = "Content-Disposition"
+    return response
+
+
 @app.get("/unsubscribe/{email_id}")
 async def unsubscribe(email_id: str, request: Request):
-    with open("email_templates/unsubscribe.html", "r") as f:
-        html_content = f.read()
+    await run_in_threadpool(subscribers.unsubscribe, email_id)  # Subscriber id only: an address would let anyone unsubscribe anyone
+    page = get_template("unsubscribe.html")  # Static page, served from memory
+    # Revalidated every time: a cached copy would skip the unsubscribe above
+    headers = {"ETag": page.etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("If-None-Match") == page.etag:
+        return Response(status_code=304, headers=headers)
+
+    return HTMLResponse(content=page.source, status_code=200, headers=headers)
+
 
-    return HTMLResponse(content=html_content, status_code=200)
+@app.get("/bigtree-webhooks-admission-stats", dependencies=[api_key("admin")])
+async def admission_stats():
+    stats = {name: controller.stats() for name, controller in admission.items()}
+    stats["gmail_sender"] = get_email_scheduler().stats()
+    stats["circuit_breakers"] = breaker_stats()
+    stats["product_cache"] = product_cache.stats()
+    stats["subscribers"] = subscribers.stats()
+    stats["job_memory"] = jobs.memory_stats()
+    return stats
+
+
+@app.get("/bigtree-webhooks-ready")
+async def readiness_check():
+    if not warmed_up.is_set():
+        return ORJSONResponse(status_code=503, content={"status": "warming_up", "modules": lazy_import_status()})
+    return {"status": "ready"}
 
 
 @app.get("/bigtree-webhooks-health-check")
@@ -333,7 +655,19 @@ async def health_check():
     return {"app": "BT Webhooks", "version": "1.1.2", "status": "running"}
 
 
+API_KEY_SCOPES.update(route_scopes(app.routes))
+
+
 if __name__ == "__main__":
+    import argparse, sys
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")), help="More than 1 launches gunicorn with gunicorn.conf.py")
+    args = parser.parse_args()
+
+    if args.workers > 1: # Prod, multi-worker
+        os.environ["WEB_CONCURRENCY"] = str(args.workers)
+        os.execvp(sys.executable, [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"])
+
     # uvicorn.run("app:app", host="127.0.0.1", port=8001, reload=True) # Dev
     uvicorn.run(app, host="0.0.0.0", port=8001) # Prod
 
@@ -0,0 +1,113 @@
+"""
+Image pipeline benchmark: the legacy full-resolution JPEG q95 step against
+modules/image_pipeline, per fixture image size.
+
+For each variant it reports the image processing time, the embedded JPEG size,
+the rendered docx size and (when LibreOffice is installed) the PDF size and
+conversion time.
+
+    python -m benchmarks.bench_images
+    python -m benchmarks.bench_images --fixture fine_art --iterations 5 --no-pdf
+    python -m benchmarks.bench_images --dpi 150 --quality 80
+"""
+import argparse, contextlib, io, os, shutil, statistics, sys, tempfile, time
+from PIL import Image
+
+from benchmarks.bench_specsheet import load_fixtures
+from modules.image_pipeline import get_pyvips, prepare_image
+from modules.specsheet_generator import build_context, load_template, convert_docx_to_pdf, get_soffice_path
+
+import docxtpl
+from docx.shared import Inches
+
+
+def legacy_prepare_image(image_bytes):
+    """The pre-pipeline step: full resolution, JPEG quality 95, height set only for display"""
+    img = Image.open(io.BytesIO(image_bytes))
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    height_px = min(img.size[1], 342.42519685)
+    stream = io.BytesIO()
+    img.save(stream, format='JPEG', quality=95)
+    stream.seek(0)
+    return stream, height_px / 96
+
+
+def make_photo_bytes(width, height):
+    """Synthetic photo-like JPEG (gradient + noise, compresses like a real product shot)"""
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40)
+    img = Image.merge("RGB", (gradient, noise, Image.blend(gradient, noise, 0.5)))
+    stream = io.BytesIO()
+    img.save(stream, format="JPEG", quality=92)
+    return stream.getvalue()
+
+
+def run_variant(fixture, image_bytes, prepare, workdir, with_pdf):
+    result = {}
+    quiet = io.StringIO()
+    with contextlib.redirect_stdout(quiet):
+        start = time.perf_counter()
+        stream, height_inches = prepare(image_bytes)
+        result["image_ms"] = (time.perf_counter() - start) * 1000
+        result["jpeg_kb"] = stream.getbuffer().nbytes / 1024
+
+        doc = load_template(fixture["template"])
+        image = docxtpl.InlineImage(doc, stream, height=Inches(height_inches))
+        doc.render(build_context(fixture["product"], image))
+        output_docx = os.path.join(workdir, f"{fixture['product']['id']}_specsheet.docx")
+        doc.save(output_docx)
+        result["docx_kb"] = os.path.getsize(output_docx) / 1024
+
+        if with_pdf:
+            start = time.perf_counter()
+            output_pdf = convert_docx_to_pdf(output_docx, workdir)
+            result["pdf_ms"] = (time.perf_counter() - start) * 1000
+            result["pdf_kb"] = os.path.getsize(output_pdf) / 1024
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the legacy image step with the image pipeline")
+    parser.add_argument("--fixture", action="append", help="Fixture name to run (repeatable, default: all)")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--dpi", type=int, help="Override SPECSHEET_IMAGE_DPI")
+    parser.add_argument("--quality", type=int, help="Override SPECSHEET_IMAGE_QUALITY")
+    parser.add_argument("--no-pdf", action="store_true", help="Skip the LibreOffice conversion")
+    args = parser.parse_args(argv)
+
+    options = {key: value for key, value in (("dpi", args.dpi), ("quality", args.quality)) if value}
+    variants = {
+        "legacy": legacy_prepare_image,
+        "pillow": lambda data: prepare_image(data, backend="pillow", **options),
+    }
+    if get_pyvips():
+        variants["vips"] = lambda data: prepare_image(data, backend="vips", **options)
+
+    with_pdf = not args.no_pdf and shutil.which(get_soffice_path()) is not None
+    if not args.no_pdf and not with_pdf:
+        print("LibreOffice not found, skipping the pdf columns")
+
+    columns = ["image_ms", "jpeg_kb", "docx_kb"] + (["pdf_ms", "pdf_kb"] if with_pdf else [])
+    header = f"{'fixture':<20}{'size':>11}  {'variant':<8}" + "".join(f"{column:>11}" for column in columns)
+    print(header)
+    print("-" * len(header))
+
+    workdir = tempfile.mkdtemp(prefix="image-bench-")
+    try:
+        for name, fixture in load_fixtures(args.fixture).items():
+            width, height = fixture["image_size"]
+            image_bytes = make_photo_bytes(width, height)
+            for variant, prepare in variants.items():
+                runs = [run_variant(fixture, image_bytes, prepare, workdir, with_pdf) for _ in range(args.iterations)]
+                row = f"{name:<20}{f'{width}x{height}':>11}  {variant:<8}"
+                row += "".join(f"{statistics.median(run[column] for run in runs):>11.1f}" for column in columns)
+                print(row)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
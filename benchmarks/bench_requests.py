@@ -0,0 +1,121 @@
+"""
+Per-request overhead of the webhook routes: parsing, validation, API key check
+and JSON response, without the background work.
+
+Two throwaway routes are mounted on a bare FastAPI app and called in-process
+through ASGI (no network, no test client):
+
+    legacy  await request.json() + Model.model_validate, field-by-field copy,
+            `!=` key comparison, JSONResponse
+    fast    ApiKeyAuthMiddleware + json_body (model_validate_json on the raw
+            body), ORJSONResponse, as used by app.py
+
+    python -m benchmarks.bench_requests
+    python -m benchmarks.bench_requests --requests 20000
+"""
+import argparse, asyncio, json, statistics, sys, time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import ValidationError
+
+import app as webhooks
+from modules.api_keys import ApiKeyAuthMiddleware, KeyStore
+
+
+API_KEY = "bench-key"
+
+PAYLOADS = {
+    "contact": (webhooks.ContactRequest, {
+        "fname": "Jane", "lname": "Doe", "email": "jane.doe@example.com", "phone": "+971500000000", "company": "Studio",
+        "project": "Hotel lobby", "project_location": "AE", "message": "Looking for samples " * 10, "src": "website",
+    }),
+    "enquiry": (webhooks.ProductEnquiry, {
+        "name": "Jane Doe", "email": "jane.doe@example.com", "phone": "+971500000000", "company": "Studio", "project": "Hotel lobby",
+        "country": "AE", "message": "Please send specs " * 10, "req_sample": "Yes",
+        "cart_items": [{"id": 1000 + i, "quantity": i + 1} for i in range(25)],
+    }),
+}
+
+
+def build_bench_app():
+    bench = FastAPI()
+    store = KeyStore(path="/nonexistent/api_keys.json", fallback_key=API_KEY)
+    for key in store.keys.values():
+        key.bucket = None  # Measure the accepted path, not 429s
+    bench.add_middleware(ApiKeyAuthMiddleware, store=store, scopes={f"/fast/{name}": "leads" for name in PAYLOADS})
+
+    for name, (model, _) in PAYLOADS.items():
+        async def legacy(request: Request, model=model):
+            api_key = request.headers.get("X-API-Key")
+            if not api_key or api_key != API_KEY:
+                return JSONResponse(status_code=401, content={"status": "fail", "detail": "Unauthorized"})
+            payload = await request.json()
+            try:
+                model.model_validate(payload)
+            except ValidationError:
+                return JSONResponse(status_code=422, content={"status": "fail", "detail": "Invalid Data"})
+            return JSONResponse(status_code=200, content={"status": "success", "message": "Processing your request"})
+
+        async def fast(validated_data=webhooks.json_body(model)):
+            return ORJSONResponse(status_code=200, content={"status": "success", "message": "Processing your request"})
+
+        bench.add_api_route(f"/legacy/{name}", legacy, methods=["POST"])
+        bench.add_api_route(f"/fast/{name}", fast, methods=["POST"])
+    return bench
+
+
+async def call(asgi_app, path, body):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"x-api-key", API_KEY.encode()), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 8001),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    status = []
+
+    async def receive():
+        return messages.pop() if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await asgi_app(scope, receive, send)
+    return status[0]
+
+
+async def run(requests, rounds):
+    bench = build_bench_app()
+    samples = {}
+    for name, (_, payload) in PAYLOADS.items():
+        body = json.dumps(payload).encode()
+        # Variants alternate inside each round so machine noise hits both alike
+        for _ in range(rounds):
+            for variant in ("legacy", "fast"):
+                path = f"/{variant}/{name}"
+                start = time.perf_counter()
+                for _ in range(requests):
+                    status = await call(bench, path, body)
+                samples.setdefault((name, variant), []).append((time.perf_counter() - start) / requests * 1e6)
+                assert status == 200, f"{path} answered {status}"
+    return {key: statistics.median(values) for key, values in samples.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark per-request parsing/validation overhead")
+    parser.add_argument("--requests", type=int, default=5000, help="Requests per round")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args.requests, args.rounds))
+    print(f"\n{'payload':<10}{'legacy µs/req':>16}{'fast µs/req':>14}{'change':>10}")
+    for name in PAYLOADS:
+        legacy, fast = results[(name, "legacy")], results[(name, "fast")]
+        print(f"{name:<10}{legacy:>16.1f}{fast:>14.1f}{(fast / legacy - 1) * 100:>9.0f}%")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
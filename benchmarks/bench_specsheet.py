@@ -0,0 +1,334 @@
+"""
+Micro-benchmarks for the specsheet rendering pipeline.
+
+Every stage of modules/specsheet_generator is timed in isolation against the
+product fixtures in benchmarks/fixtures (one per template category):
+
+    strip_html  -> strip_html_tags on description / short_description / HTML meta fields (uncached)
+    context     -> build_context
+    load        -> DocxTemplate load
+    image       -> process_image (synthetic image of the recorded size, no network)
+    render      -> DocxTemplate.render
+    save        -> DocxTemplate.save
+    pdf         -> LibreOffice conversion (skipped when LibreOffice is not installed)
+
+Usage (from the project root):
+
+    python -m benchmarks.bench_specsheet
+    python -m benchmarks.bench_specsheet --fixture fabric --iterations 10
+    python -m benchmarks.bench_specsheet --profile cprofile --profile-dir files/temp/profiles
+    python -m benchmarks.bench_specsheet --save-baseline benchmarks/baseline.json
+    python -m benchmarks.bench_specsheet --baseline benchmarks/baseline.json --max-regression 0.25
+
+With --baseline the script exits with status 1 when any stage is slower than
+the baseline by more than --max-regression, which makes it usable as a gate
+whenever a template or the generator changes.
+
+The committed fixtures are synthetic ("synthetic": true): hand-written products
+shaped like WooCommerce responses, one per template, with example.com links and
+no network image. They keep the benchmark runnable anywhere, but they are close
+to each other and do not reflect real catalogue data, so absolute timings and
+the baseline are only comparable run to run. Replace them with real products
+with --record <product_id> ... (requires the WC_* variables in .env) before
+drawing conclusions about production; recorded fixtures hold the product data
+as published in the store.
+"""
+import argparse, contextlib, glob, io, json, os, shutil, statistics, sys, tempfile, time, tracemalloc
+from PIL import Image
+
+from modules.specsheet_generator import (
+    strip_html_tags, build_context, load_template, process_image, convert_docx_to_pdf, get_soffice_path
+)
+
+
+# Time the conversion itself, not the lru_cache in front of it
+strip_html_tags = strip_html_tags.__wrapped__
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+STAGES = ["strip_html", "context", "load", "image", "render", "save", "pdf"]
+HTML_META_KEYS = ["project", "color_fastness", "flame_retardant", "maintenance_&_care"]
+
+# Stages faster than this are too noisy to gate on
+NOISE_FLOOR_MS = 2.0
+
+
+def load_fixtures(names=None):
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, "*.json"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if names and name not in names:
+            continue
+        with open(path, "r") as f:
+            fixtures[name] = json.load(f)
+    return fixtures
+
+
+def make_image_bytes(width, height):
+    """Synthetic JPEG with the dimensions of the recorded product image"""
+    img = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    stream = io.BytesIO()
+    img.save(stream, format="JPEG", quality=90)
+    return stream.getvalue()
+
+
+def run_stages(fixture, image_bytes, workdir, with_pdf):
+    """Run every stage once; returns {stage: seconds} and the produced files"""
+    product = fixture["product"]
+    timings = {}
+    quiet = io.StringIO()
+
+    with contextlib.redirect_stdout(quiet):
+        start = time.perf_counter()
+        strip_html_tags(product.get("description", ""))
+        strip_html_tags(product.get("short_description", ""))
+        for item in product.get("meta_data", []):
+            if item.get("key") in HTML_META_KEYS:
+                strip_html_tags(item.get("value", ""))
+        timings["strip_html"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        build_context(product, "")
+        timings["context"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        doc = load_template(fixture["template"])
+        timings["load"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        image_placeholder = process_image(doc, image_bytes)
+        timings["image"] = time.perf_counter() - start
+
+        context = build_context(product, image_placeholder)
+        start = time.perf_counter()
+        doc.render(context)
+        timings["render"] = time.perf_counter() - start
+
+        output_docx = os.path.join(workdir, f"{product['id']}_specsheet.docx")
+        start = time.perf_counter()
+        doc.save(output_docx)
+        timings["save"] = time.perf_counter() - start
+
+        files = {"docx": os.path.getsize(output_docx)}
+        if with_pdf:
+            start = time.perf_counter()
+            output_pdf = convert_docx_to_pdf(output_docx, workdir)
+            timings["pdf"] = time.perf_counter() - start
+            files["pdf"] = os.path.getsize(output_pdf)
+
+    return timings, files
+
+
+def measure_peak_memory(fixture, image_bytes, workdir):
+    """Peak Python heap per stage (Pillow pixel buffers and LibreOffice are not seen by tracemalloc)"""
+    product = fixture["product"]
+    peaks = {}
+    quiet = io.StringIO()
+
+    def traced(stage, fn):
+        tracemalloc.start()
+        try:
+            return fn()
+        finally:
+            peaks[stage] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    with contextlib.redirect_stdout(quiet):
+        traced("strip_html", lambda: strip_html_tags(product.get("description", "")))
+        traced("context", lambda: build_context(product, ""))
+        doc = traced("load", lambda: load_template(fixture["template"]))
+        image_placeholder = traced("image", lambda: process_image(doc, image_bytes))
+        context = build_context(product, image_placeholder)
+        traced("render", lambda: doc.render(context))
+        traced("save", lambda: doc.save(os.path.join(workdir, "memory_specsheet.docx")))
+
+    return peaks
+
+
+def profile_pipeline(name, fixture, image_bytes, workdir, profiler, profile_dir, with_pdf):
+    os.makedirs(profile_dir, exist_ok=True)
+
+    if profiler == "cprofile":
+        import cProfile
+        prof = cProfile.Profile()
+        prof.enable()
+        run_stages(fixture, image_bytes, workdir, with_pdf)
+        prof.disable()
+        out = os.path.join(profile_dir, f"{name}.prof")
+        prof.dump_stats(out)
+
+    else:
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("pyinstrument is not installed (pip install pyinstrument)")
+            return None
+        prof = Profiler()
+        prof.start()
+        run_stages(fixture, image_bytes, workdir, with_pdf)
+        prof.stop()
+        out = os.path.join(profile_dir, f"{name}.html")
+        with open(out, "w") as f:
+            f.write(prof.output_html())
+
+    return out
+
+
+def benchmark(fixtures, iterations, with_pdf, with_memory, profiler=None, profile_dir=None):
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="specsheet-bench-")
+    try:
+        for name, fixture in fixtures.items():
+            image_bytes = make_image_bytes(*fixture["image_size"])
+            samples = {stage: [] for stage in STAGES}
+            files = {}
+
+            for _ in range(iterations):
+                timings, files = run_stages(fixture, image_bytes, workdir, with_pdf)
+                for stage, seconds in timings.items():
+                    samples[stage].append(seconds * 1000)
+
+            results[name] = {
+                "template": fixture["template"],
+                "median_ms": {stage: statistics.median(values) for stage, values in samples.items() if values},
+                "max_ms": {stage: max(values) for stage, values in samples.items() if values},
+                "output_bytes": files,
+            }
+            if with_memory:
+                results[name]["peak_kb"] = {stage: peak / 1024 for stage, peak in measure_peak_memory(fixture, image_bytes, workdir).items()}
+            if profiler:
+                results[name]["profile"] = profile_pipeline(name, fixture, image_bytes, workdir, profiler, profile_dir, with_pdf)
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
+
+
+def print_report(results):
+    header = f"{'fixture':<20}" + "".join(f"{stage:>12}" for stage in STAGES) + f"{'docx KB':>10}{'pdf KB':>10}"
+    print("\nMedian time per stage (ms)")
+    print(header)
+    print("-" * len(header))
+    for name, result in results.items():
+        row = f"{name:<20}"
+        for stage in STAGES:
+            value = result["median_ms"].get(stage)
+            row += f"{value:>12.2f}" if value is not None else f"{'-':>12}"
+        sizes = result["output_bytes"]
+        row += f"{sizes.get('docx', 0) / 1024:>10.1f}"
+        row += f"{sizes['pdf'] / 1024:>10.1f}" if "pdf" in sizes else f"{'-':>10}"
+        print(row)
+
+    if any("peak_kb" in result for result in results.values()):
+        print("\nPeak Python memory per stage (KB)")
+        print(f"{'fixture':<20}" + "".join(f"{stage:>12}" for stage in STAGES[:-1]))
+        for name, result in results.items():
+            peaks = result.get("peak_kb", {})
+            print(f"{name:<20}" + "".join(f"{peaks.get(stage, 0):>12.1f}" for stage in STAGES[:-1]))
+
+    for name, result in results.items():
+        if result.get("profile"):
+            print(f"Profile for {name}: {result['profile']}")
+
+
+def check_regressions(results, baseline, max_regression):
+    """Compare medians against a saved baseline; returns a list of failures"""
+    failures = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for stage, value in result["median_ms"].items():
+            base_value = base["median_ms"].get(stage)
+            if base_value is None or max(value, base_value) < NOISE_FLOOR_MS:
+                continue
+            if value > base_value * (1 + max_regression):
+                failures.append(f"{name}.{stage}: {value:.2f} ms vs baseline {base_value:.2f} ms (+{(value / base_value - 1) * 100:.0f}%)")
+
+        for kind, size in result["output_bytes"].items():
+            base_size = base.get("output_bytes", {}).get(kind)
+            if base_size and size > base_size * (1 + max_regression):
+                failures.append(f"{name}.{kind}_size: {size} bytes vs baseline {base_size} bytes")
+
+    return failures
+
+
+def record_fixtures(product_ids):
+    """Fetch live products and store them as fixtures (template resolved via the API)"""
+    from dotenv import load_dotenv
+    from modules.woocommerce_service import get_product
+    from modules.specsheet_generator import get_template_by_category
+
+    load_dotenv()
+    store_url, key, secret = os.getenv("WC_STORE_URL"), os.getenv("WC_CONSUMER_KEY"), os.getenv("WC_CONSUMER_SECRET")
+    for product_id in product_ids:
+        product = get_product(store_url=store_url, consumer_key=key, consumer_secret=secret, product_id=product_id)
+        if not product:
+            print(f"Product {product_id} not found, skipping")
+            continue
+        template = get_template_by_category(product, store_url, key, secret)
+        category = os.path.splitext(os.path.basename(template))[0].split("__")[-1].lower()
+        fixture = {"template": template, "root_category": None, "image_size": [2000, 2000], "product": product}
+        path = os.path.join(FIXTURES_DIR, f"{category}.json")
+        with open(path, "w") as f:
+            json.dump(fixture, f, indent=2, ensure_ascii=False)
+        print(f"Recorded product {product_id} → {path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the specsheet rendering pipeline stage by stage")
+    parser.add_argument("--fixture", action="append", help="Fixture name to run (repeatable, default: all)")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--no-pdf", action="store_true", help="Skip the LibreOffice conversion stage")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc peak memory pass")
+    parser.add_argument("--profile", choices=["cprofile", "pyinstrument"], help="Profile one full pipeline run per fixture")
+    parser.add_argument("--profile-dir", default="files/temp/profiles")
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--save-baseline", help="Write the results as the new baseline")
+    parser.add_argument("--baseline", help="Compare against this baseline and fail on regressions")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="Allowed slowdown ratio (default 0.25 = 25%%)")
+    parser.add_argument("--record", type=int, nargs="+", metavar="PRODUCT_ID", help="Record live products as fixtures")
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record_fixtures(args.record)
+        return 0
+
+    with_pdf = not args.no_pdf and shutil.which(get_soffice_path()) is not None
+    if not args.no_pdf and not with_pdf:
+        print("LibreOffice not found, skipping the pdf stage")
+
+    fixtures = load_fixtures(args.fixture)
+    if not fixtures:
+        print("No fixtures found")
+        return 1
+
+    synthetic = sorted(name for name, fixture in fixtures.items() if fixture.get("synthetic"))
+    if synthetic:
+        print(f"Synthetic fixtures (not recorded from the store): {', '.join(synthetic)}")
+
+    results = benchmark(fixtures, args.iterations, with_pdf, not args.no_memory, args.profile, args.profile_dir)
+    print_report(results)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {path}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        failures = check_regressions(results, baseline, args.max_regression)
+        if failures:
+            print("\n❌ Performance regressions detected:")
+            for failure in failures:
+                print(f"  {failure}")
+            return 1
+        print("\n✓ No regressions against baseline")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+strip_html_tags: parity check and timing against the previous implementation.
+
+The parity check feeds both functions random documents assembled from the
+markup WooCommerce descriptions contain (<p>, <br>, inline tags, &nbsp; &amp;
+&lt; &gt;, literal and escaped newlines, runs of spaces) and fails on the first
+differing output. The generated documents never spell an entity out after
+"&amp;" and contain no other entities, because the old output differs on
+purpose there; those cases are checked against INTENDED_DIFFERENCES instead:
+    - entities other than the four above are now decoded (the old function left them as-is)
+    - text is decoded once: "&amp;lt;" becomes "&lt;" (the old function's chained
+      replaces decoded it twice, to "<")
+
+    python -m benchmarks.bench_strip_html
+    python -m benchmarks.bench_strip_html --cases 100000 --seed 7
+"""
+import argparse, random, re, statistics, sys, time
+
+from benchmarks.bench_specsheet import load_fixtures, HTML_META_KEYS
+from modules.specsheet_generator import strip_html_tags
+
+
+def legacy_strip_html_tags(text):
+    """strip_html_tags as it was before the entity table and the cache"""
+    if not text:
+        return ''
+    clean = re.sub(r'<br\s*/?>', '\n', text)
+    clean = re.sub(r'</p>\s*<p>', '\n\n', clean)
+    clean = re.sub(r'<[^>]+>', '', clean)
+    clean = clean.replace('&nbsp;', ' ')
+    clean = clean.replace('&amp;', '&')
+    clean = clean.replace('&lt;', '<')
+    clean = clean.replace('&gt;', '>')
+    clean = clean.replace('\\r\\n', '\n')
+    clean = clean.replace('\r\n', '\n')
+    clean = clean.replace('\\n', '\n')
+    clean = re.sub(r' +', ' ', clean)
+    clean = re.sub(r'\n{3,}', '\n\n', clean)
+    clean = re.sub(r'\n\s*\n', '\n\n', clean)
+    lines = clean.split('\n')
+    lines = [line.strip() for line in lines]
+    cleaned_lines = []
+    prev_empty = False
+    for line in lines:
+        if not line:
+            if not prev_empty and cleaned_lines:
+                cleaned_lines.append(line)
+            prev_empty = True
+        else:
+            cleaned_lines.append(line)
+            prev_empty = False
+    return '\n'.join(cleaned_lines).strip()
+
+
+TOKENS = [
+    "Velvet", "fabric", "100%", "cotton", "Ø45cm", "Martindale:", "30,000", "rubs", "(EN 1021-1)", "-", ".", ",",
+    " ", "  ", "   ", "\t", "\n", "\n\n", "\r\n", "\\n", "\\r\\n",
+    "<p>", "</p>", "<br>", "<br/>", "<br />", "<BR>", "<strong>", "</strong>", "<em>", "</em>",
+    '<span style="color: #333;">', "</span>", "<ul>", "<li>", "</li>", "</ul>", '<a href="https://bigtree-group.com">', "</a>",
+    "&nbsp;", "&amp;", "&lt;", "&gt;",
+]
+
+
+# (input, old output, new output)
+INTENDED_DIFFERENCES = [
+    ("Oak &amp;lt;stained&amp;gt;", "Oak <stained>", "Oak &lt;stained&gt;"),
+    ("Café &eacute; &#8211; &#x2014;", "Café &eacute; &#8211; &#x2014;", "Café é – —"),
+]
+
+
+def random_document(rng):
+    return "".join(rng.choice(TOKENS) for _ in range(rng.randint(0, 60)))
+
+
+def check_parity(cases, seed):
+    for document, old, new in INTENDED_DIFFERENCES:
+        expected_old, actual = legacy_strip_html_tags(document), strip_html_tags.__wrapped__(document)
+        if (expected_old, actual) != (old, new):
+            print(f"❌ Intended difference changed\n  input:    {document!r}\n  legacy:   {expected_old!r} (expected {old!r})\n  new:      {actual!r} (expected {new!r})")
+            return False
+    print(f"✓ {len(INTENDED_DIFFERENCES)} intended differences from the legacy output")
+
+    rng = random.Random(seed)
+    for i in range(cases):
+        document = random_document(rng)
+        expected, actual = legacy_strip_html_tags(document), strip_html_tags.__wrapped__(document)
+        if expected != actual:
+            print(f"❌ Case {i} differs\n  input:    {document!r}\n  legacy:   {expected!r}\n  new:      {actual!r}")
+            return False
+    print(f"✓ {cases} random documents: identical output")
+    return True
+
+
+def fixture_texts():
+    texts = []
+    for fixture in load_fixtures().values():
+        product = fixture["product"]
+        texts += [product.get("description", ""), product.get("short_description", "")]
+        texts += [item.get("value", "") for item in product.get("meta_data", []) if item.get("key") in HTML_META_KEYS]
+    return [text for text in texts if isinstance(text, str)]
+
+
+def time_calls(fn, texts, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        for text in texts:
+            fn(text)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parity check and timing for strip_html_tags")
+    parser.add_argument("--cases", type=int, default=20000, help="Random documents for the parity check")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    if not check_parity(args.cases, args.seed):
+        return 1
+
+    texts = fixture_texts()
+    long_text = "".join(texts) * 20  # a long description
+    for name, sample in [("fixture fields", texts), ("long description", [long_text])]:
+        legacy = time_calls(legacy_strip_html_tags, sample, args.iterations)
+        uncached = time_calls(strip_html_tags.__wrapped__, sample, args.iterations)
+        cached = time_calls(strip_html_tags, sample, args.iterations)
+        print(f"{name:<18} ({sum(map(len, sample)):>7} chars)  legacy {legacy:8.3f} ms   uncached {uncached:8.3f} ms   cached {cached:8.3f} ms")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,39 @@
+"""
+Production launcher: N uvicorn workers under gunicorn.
+
+    gunicorn -c gunicorn.conf.py app:app        (or: python app.py --workers 4)
+
+The app and its heavy dependencies are imported once in the master before the
+workers are forked, so the workers share those pages copy-on-write.
+
+Graceful restart (workers finish their in-flight requests first):
+    kill -HUP <master pid>      restart workers with the same code
+    kill -USR2 <master pid>     start a new master with the new code, then
+    kill -QUIT <old master pid> once the new workers are up
+"""
+import multiprocessing, os
+
+
+bind = os.getenv("BIND", "0.0.0.0:8001")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn_worker.UvicornWorker"  # uvicorn.workers is deprecated
+preload_app = True
+
+# Specsheet renders hold a request open for the whole LibreOffice run
+timeout = int(os.getenv("WORKER_TIMEOUT", "180"))
+# On shutdown background jobs get JOB_DRAIN_SECONDS (app.py) to finish; keep this above it
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "120"))
+keepalive = 5
+
+# Recycle workers now and then to release fragmented memory (PIL, lxml)
+max_requests = int(os.getenv("MAX_REQUESTS", "2000"))
+max_requests_jitter = 200
+
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    # Import the lazily loaded heavy libraries in the master so forked workers share them
+    import app
+    app.run_warm_up()
@@ -0,0 +1,167 @@
+"""
+Admission control and rate limiting for the expensive webhook endpoints.
+
+AdmissionController caps how many jobs of one kind run at once (each running
+specsheet render forks a LibreOffice process) and how many may wait for a
+slot. A request is admitted up front, before any work is queued, so a burst is
+answered with 503 + Retry-After instead of piling up background jobs:
+
+    ticket = controller.admit()          # raises AdmissionRejected when the queue is full
+    background_tasks.add_task(run_admitted, ticket, process_enquiry, ...)
+
+    def run_admitted(ticket, job, *args):
+        with ticket:                     # blocks until a slot is free, records the wait
+            job(*args)
+
+RateLimiter is a keyed token bucket, used per API key and per client IP in
+front of the routes.
+"""
+import threading, time
+from collections import OrderedDict
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """A reserved place in a controller; entering it waits for a running slot"""
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.admitted_at = time.monotonic()
+        self.running = False
+        self.closed = False
+
+    def __enter__(self):
+        self.controller._slots.acquire()
+        self.running = True
+        self.controller._started(time.monotonic() - self.admitted_at)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __del__(self):
+        # Safety net for tickets whose job or stream never ran (e.g. client went away)
+        self.close()
+
+    def close(self):
+        """Release the slot (or the queue place if the job never started)"""
+        if self.closed:
+            return
+        self.closed = True
+        if self.running:
+            self.controller._slots.release()
+        self.controller._finished(self.running)
+
+
+class AdmissionController:
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, retry_after: int = 5):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._admitted = 0  # running + waiting
+        self._running = 0
+        self._rejected = 0
+        self._completed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def admit(self) -> Ticket:
+        with self._lock:
+            if self._admitted >= self.max_concurrent + self.max_queue:
+                self._rejected += 1
+                raise AdmissionRejected(503, f"Too many {self.name} requests in progress, please retry later", self.retry_after)
+            self._admitted += 1
+        return Ticket(self)
+
+    def _started(self, waited: float):
+        with self._lock:
+            self._running += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+
+    def _finished(self, was_running: bool):
+        with self._lock:
+            self._admitted -= 1
+            if was_running:
+                self._running -= 1
+                self._completed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            started = self._completed + self._running
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "waiting": self._admitted - self._running,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "avg_queue_wait_ms": round(self._wait_total / started * 1000, 1) if started else 0.0,
+                "max_queue_wait_ms": round(self._wait_max * 1000, 1),
+            }
+
+
+def run_admitted(ticket: Ticket, job, *args, **kwargs):
+    """Run a background job once its ticket gets a slot"""
+    with ticket:
+        return job(*args, **kwargs)
+
+
+def stream_admitted(ticket: Ticket, stream):
+    """Hold the ticket for as long as a streaming response is being produced"""
+    with ticket:
+        yield from stream
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate  # tokens per second
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Consume one token; returns 0 when allowed, otherwise seconds until the next token"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token bucket per key (API key, client IP...), keeping at most max_keys buckets"""
+
+    def __init__(self, per_minute: int, burst: int, max_keys: int = 10000):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, key: str) -> float:
+        """Returns 0 when the request is allowed, otherwise the Retry-After delay in seconds"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.take()
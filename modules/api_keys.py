@@ -0,0 +1,231 @@
+"""
+API keys: several active keys, each with scopes and its own rate limit,
+hot-reloaded from API_KEYS_FILE, checked by a pure ASGI middleware before the
+request body is read.
+
+API_KEYS_FILE (JSON) lists the keys; store the sha256 of a key rather than the
+key itself where possible:
+
+    {"keys": [
+        {"name": "website", "sha256": "9f86d0...", "scopes": ["leads", "specsheet"], "per_minute": 600, "burst": 100},
+        {"name": "sales-tools", "key": "plain-text-key", "scopes": ["*"]}
+    ]}
+
+The file is re-read when its mtime changes (checked at most every
+API_KEYS_RELOAD_SECONDS), so keys are rotated by adding the new key, moving
+clients over and deleting the old one, without a restart. Without the file
+the single API_KEY environment variable is accepted with every scope.
+
+    python -m modules.api_keys generate website --scopes leads specsheet
+    python -m modules.api_keys hash <key>
+"""
+import argparse, hashlib, json, os, secrets, sys, threading, time
+
+from modules.admission_control import TokenBucket
+
+
+API_KEYS_FILE = os.getenv("API_KEYS_FILE", "files/api_keys.json")
+API_KEYS_RELOAD_SECONDS = float(os.getenv("API_KEYS_RELOAD_SECONDS", "2"))
+DEFAULT_PER_MINUTE = int(os.getenv("RATE_LIMIT_KEY_PER_MINUTE", "600"))
+DEFAULT_BURST = int(os.getenv("RATE_LIMIT_KEY_BURST", "100"))
+
+
+def hash_key(key: str) -> str:
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class ApiKey:
+    def __init__(self, name, digest, scopes, per_minute, burst):
+        self.name = name
+        self.digest = digest
+        self.scopes = set(scopes)
+        self.bucket = TokenBucket(per_minute / 60, burst) if per_minute else None
+
+    def allows(self, scope: str) -> bool:
+        return "*" in self.scopes or scope in self.scopes
+
+
+class KeyStore:
+    def __init__(self, path=API_KEYS_FILE, fallback_key=None):
+        self.path = path
+        self.fallback_key = fallback_key
+        self.keys = {}  # sha256 -> ApiKey
+        self.mtime = -1  # Not loaded yet; None once loaded without a file
+        self.checked = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def _load_file(self):
+        with open(self.path, "r") as f:
+            entries = json.load(f)["keys"]
+        keys = {}
+        for entry in entries:
+            digest = entry.get("sha256") or hash_key(entry["key"])
+            keys[digest] = ApiKey(entry["name"], digest, entry.get("scopes", ["*"]), entry.get("per_minute", DEFAULT_PER_MINUTE), entry.get("burst", DEFAULT_BURST))
+        return keys
+
+    def reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+
+        if mtime == self.mtime:
+            return
+        if mtime is None:
+            keys = {}
+            if self.fallback_key:
+                digest = hash_key(self.fallback_key)
+                keys[digest] = ApiKey("default", digest, ["*"], DEFAULT_PER_MINUTE, DEFAULT_BURST)
+        else:
+            try:
+                keys = self._load_file()
+            except Exception as e:
+                print(f"⚠️ Could not load {self.path}, keeping the previous keys: {e}")
+                return
+            print(f"✓ Loaded {len(keys)} API keys from {self.path}")
+
+        # Keep rate-limit state for keys that did not change
+        for digest, key in keys.items():
+            old = self.keys.get(digest)
+            if old and old.bucket and key.bucket and (old.bucket.rate, old.bucket.burst) == (key.bucket.rate, key.bucket.burst):
+                key.bucket = old.bucket
+        self.keys, self.mtime = keys, mtime
+
+    def lookup(self, presented: str):
+        """The ApiKey matching the presented key, or None"""
+        now = time.monotonic()
+        if now - self.checked > API_KEYS_RELOAD_SECONDS:
+            with self._lock:
+                if now - self.checked > API_KEYS_RELOAD_SECONDS:
+                    self.checked = now
+                    self.reload()
+
+        # Looked up by digest: the comparison never touches the raw key, so timing reveals nothing about it
+        return self.keys.get(hash_key(presented))
+
+    def authenticate(self, presented, required: str) -> ApiKey:
+        """The key presented for a route needing `required`; raises ApiKeyRejected (401 / 403 / 429)"""
+        key = self.lookup(presented) if presented else None
+        if key is None:
+            raise ApiKeyRejected(401, "Unauthorized")
+        if not key.allows(required):
+            raise ApiKeyRejected(403, "API key not allowed for this endpoint")
+        wait = key.bucket.take() if key.bucket else 0
+        if wait:
+            raise ApiKeyRejected(429, "Rate limit exceeded", retry_after=max(1, round(wait)))
+        return key
+
+
+class ApiKeyRejected(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after=None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+def require_scope(store: KeyStore, required: str):
+    """
+    Route dependency declaring the scope a route needs. It is the authoritative
+    check: requests the middleware already authenticated pass straight through,
+    any other request (a path the middleware did not recognize) is checked here,
+    so a protected route is never reachable without a key.
+    """
+    from fastapi import Depends, Request
+
+    async def check(request: Request):
+        state = request.scope.setdefault("state", {})
+        if state.get("api_key_scope") != required:
+            state["api_key"] = store.authenticate(request.headers.get("x-api-key"), required).name
+            state["api_key_scope"] = required
+        return state["api_key"]
+
+    check.api_key_scope = required
+    return Depends(check)
+
+
+def route_scopes(routes) -> dict:
+    """{path: scope} of the routes declared with require_scope, for ApiKeyAuthMiddleware"""
+    scopes = {}
+    for route in routes:
+        for dependency in getattr(route, "dependencies", []):
+            required = getattr(dependency.dependency, "api_key_scope", None)
+            if required:
+                scopes[route.path] = required
+    return scopes
+
+
+def route_path(scope) -> str:
+    """The request path as the router matches it: scope["path"] without the root_path prefix (--root-path / Mount)"""
+    path, root_path = scope["path"], scope.get("root_path", "")
+    if root_path and path.startswith(root_path) and path[len(root_path):len(root_path) + 1] in ("/", ""):
+        return path[len(root_path):]
+    return path
+
+
+class ApiKeyAuthMiddleware:
+    """
+    Pure ASGI middleware: for the paths in `scopes` ({path: scope}, matched
+    without the root path) the request needs an X-API-Key with that scope and
+    within the key's rate limit. It is answered with 401 / 403 / 429 from the
+    headers alone, before the body is read or any route code runs. Other paths
+    pass through untouched; the routes' require_scope dependency still checks
+    them. The key's name is stored in scope["state"]["api_key"].
+    """
+
+    def __init__(self, app, store: KeyStore, scopes: dict):
+        self.app = app
+        self.store = store
+        self.scopes = scopes
+
+    async def __call__(self, scope, receive, send):
+        required = self.scopes.get(route_path(scope)) if scope["type"] == "http" and scope.get("method") != "OPTIONS" else None
+        if required is None:
+            return await self.app(scope, receive, send)
+
+        presented = next((value for name, value in scope["headers"] if name == b"x-api-key"), None)
+        try:
+            key = self.store.authenticate(presented.decode("latin-1") if presented else None, required)
+        except ApiKeyRejected as e:
+            return await self._reject(send, e.status_code, e.detail, retry_after=e.retry_after)
+
+        state = scope.setdefault("state", {})
+        state["api_key"], state["api_key_scope"] = key.name, required
+        await self.app(scope, receive, send)
+
+    async def _reject(self, send, status_code, detail, retry_after=None):
+        body = json.dumps({"status": "fail", "detail": detail}).encode()
+        headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        if retry_after:
+            headers.append((b"retry-after", str(retry_after).encode()))
+        await send({"type": "http.response.start", "status": status_code, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create API keys for API_KEYS_FILE")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    generate_cmd = sub.add_parser("generate", help="Create a key and print its file entry")
+    generate_cmd.add_argument("name")
+    generate_cmd.add_argument("--scopes", nargs="+", default=["*"])
+    generate_cmd.add_argument("--per-minute", type=int, default=DEFAULT_PER_MINUTE)
+    generate_cmd.add_argument("--burst", type=int, default=DEFAULT_BURST)
+
+    hash_cmd = sub.add_parser("hash", help="Print the sha256 of an existing key")
+    hash_cmd.add_argument("key")
+
+    args = parser.parse_args(argv)
+    if args.command == "generate":
+        key = secrets.token_urlsafe(32)
+        entry = {"name": args.name, "sha256": hash_key(key), "scopes": args.scopes, "per_minute": args.per_minute, "burst": args.burst}
+        print(f"Key (give this to the client, it is not stored): {key}")
+        print(f"Entry for {API_KEYS_FILE}:\n{json.dumps(entry)}")
+    else:
+        print(hash_key(args.key))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Pre-encoded (base64) copies of email attachments.
+
+An attachment is memory-mapped and encoded in fixed-size chunks straight into
+STATE_DIR/attachments/<key>.b64, already wrapped in 76-character MIME lines,
+so building a message never holds more than one chunk of it in memory. The key
+covers path, size and mtime: resending the same specsheet reuses the blob, a
+regenerated file gets a new one. Blobs unused for ATTACHMENT_CACHE_MAX_AGE
+seconds are pruned.
+"""
+import base64, hashlib, mmap, os, threading, time
+
+from modules.shared_state import state_path
+
+
+ATTACHMENT_CACHE_MAX_AGE = int(os.getenv("ATTACHMENT_CACHE_MAX_AGE", "86400"))
+# 57 input bytes encode to exactly one 76-character line
+ENCODE_CHUNK = 57 * 16384
+PRUNE_EVERY = 50
+
+_writes = 0
+
+
+def cache_key(path: str) -> str:
+    stat = os.stat(path)
+    return hashlib.sha1(f"{os.path.realpath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+
+
+def encoded_attachment(path: str) -> str:
+    """Path of the base64 blob for the file at path, encoding it on first use"""
+    global _writes
+    blob_path = state_path("attachments", f"{cache_key(path)}.b64")
+    if os.path.exists(blob_path):
+        os.utime(blob_path)
+        return blob_path
+
+    tmp_path = f"{blob_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(path, "rb") as source, open(tmp_path, "wb") as blob:
+        if os.fstat(source.fileno()).st_size:
+            with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for start in range(0, len(mapped), ENCODE_CHUNK):
+                    blob.write(base64.encodebytes(mapped[start:start + ENCODE_CHUNK]))
+    os.replace(tmp_path, blob_path)
+
+    _writes += 1
+    if _writes % PRUNE_EVERY == 0:
+        prune()
+    return blob_path
+
+
+def prune(max_age: int = ATTACHMENT_CACHE_MAX_AGE) -> int:
+    """Delete blobs not used for max_age seconds; returns how many"""
+    directory = os.path.dirname(state_path("attachments", "x"))
+    cutoff = time.time() - max_age
+    removed = 0
+    for filename in os.listdir(directory):
+        path = os.path.join(directory, filename)
+        try:
+            if os.stat(path).st_mtime < cutoff:
+                os.remove(path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
@@ -0,0 +1,255 @@
+"""
+Bulk specsheet export: render every product of a category, a brand or a list
+of ids into a single ZIP of PDFs.
+
+Products are streamed from WooCommerce one page at a time and rendered by a
+small pool of workers, each with its own LibreOffice profile. Conversions take
+a slot from export_conversion_slots, a pool separate from the one of live
+specsheet requests: at most MAX_CONCURRENT_EXPORT_CONVERSIONS convert at once
+across all running exports, more workers only overlap rendering (product data,
+images, docx) with conversion. Only a bounded window of renders is in flight and every
+PDF is deleted as soon as it has been copied into the archive, so memory and
+temp disk usage stay flat regardless of catalog size.
+
+The archive is either streamed (iter_export_zip, used by the webhook) or written
+to disk (export_to_file, used by the CLI). Disk exports are resumable: every
+CHECKPOINT_EVERY products are written to their own part archive in
+<output>.parts/, which is closed (and so complete) before its product ids are
+checkpointed. A crash loses at most the part being written; --resume skips
+the checkpointed products, and the parts are assembled into the output once
+every product is done.
+
+Usage:
+    python -m modules.bulk_export --category 42 --output exports/fabric.zip
+    python -m modules.bulk_export --brand 7 --workers 4 --output exports/brand.zip --resume
+    python -m modules.bulk_export --ids 101 102 103 --output exports/selection.zip
+"""
+import argparse, json, os, re, shutil, tempfile, threading, zipfile
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from modules.specsheet_generator import generate_specsheet_pdf, remove_output, export_conversion_slots
+from modules.woocommerce_service import WooCommerceProductAPI
+
+
+EXPORT_TEMP_DIR = "files/temp/exports"
+DEFAULT_WORKERS = 2
+CHECKPOINT_EVERY = 50
+
+
+class _StreamBuffer:
+    """Write-only, unseekable sink for ZipFile; the caller drains it between entries"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def archive_name(product):
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", product.get("name", "")).strip("_") or "product"
+    return f"{product['id']}_BigTree_{slug}_specsheet.pdf"
+
+
+def _render_products(products, store_url, consumer_key, consumer_secret, workers, skip_ids=()):
+    """
+    Render products with a pool of workers and yield (product, pdf_path) as they
+    finish. At most 2 * workers renders are pending at any time; failed products
+    are yielded with pdf_path None.
+    """
+    workdir = tempfile.mkdtemp(prefix="export-", dir=_ensure_dir(EXPORT_TEMP_DIR))
+    local = threading.local()
+
+    def render(product):
+        if not hasattr(local, "profile_dir"):
+            local.profile_dir = tempfile.mkdtemp(prefix="lo-profile-", dir=workdir)
+        try:
+            return generate_specsheet_pdf(product, wc_url=store_url, wc_key=consumer_key, wc_secret=consumer_secret, output_dir=workdir, profile_dir=local.profile_dir, slots=export_conversion_slots)
+        except Exception as e:
+            print(f"Error rendering specsheet for product {product.get('id')}: {e}")
+            return None
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="specsheet-export") as executor:
+            pending = {}
+            for product in products:
+                if product["id"] in skip_ids:
+                    continue
+                pending[executor.submit(render, product)] = product
+                if len(pending) >= workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield pending.pop(future), future.result()
+
+            for future in list(pending):
+                yield pending.pop(future), future.result()
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _ensure_dir(path):
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _add_to_archive(zf, product, pdf_path):
+    zf.write(pdf_path, arcname=archive_name(product))
+    try:
+        remove_output(pdf_path)
+    except Exception as e:
+        print(f"Failed to remove file {pdf_path}: {e}")
+
+
+def iter_export_zip(store_url, consumer_key, consumer_secret, category=None, brand=None, product_ids=None, workers=DEFAULT_WORKERS):
+    """Yield the ZIP archive as byte chunks, one entry at a time (for StreamingResponse)"""
+    wc_api = WooCommerceProductAPI(store_url, consumer_key, consumer_secret)
+    products = wc_api.iter_products(category=category, brand=brand, product_ids=product_ids)
+    sink = _StreamBuffer()
+    failed = []
+
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as zf:
+        for product, pdf_path in _render_products(products, store_url, consumer_key, consumer_secret, workers):
+            if pdf_path:
+                _add_to_archive(zf, product, pdf_path)
+            else:
+                failed.append(product["id"])
+            data = sink.drain()
+            if data:
+                yield data
+
+        if failed:
+            zf.writestr("failed_products.txt", "\n".join(str(pid) for pid in failed))
+
+    yield sink.drain()
+
+
+def _copy_entries(source_path, zf_out):
+    with zipfile.ZipFile(source_path, "r") as zf_in:
+        for info in zf_in.infolist():
+            with zf_in.open(info) as source, zf_out.open(info.filename, "w") as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+
+
+def export_to_file(output_path, store_url, consumer_key, consumer_secret, category=None, brand=None, product_ids=None, workers=DEFAULT_WORKERS, resume=False):
+    """
+    Write the export to output_path. Products are written to part archives in
+    <output_path>.parts/ and checkpointed to <output_path>.progress.json after
+    each part; with resume=True the checkpointed products are skipped (failed
+    ones are retried, also after a completed export).
+    """
+    progress_path = f"{output_path}.progress.json"
+    parts_dir = f"{output_path}.parts"
+    progress = {"done": [], "failed": [], "parts": []}
+
+    if resume and os.path.exists(progress_path):
+        with open(progress_path, "r") as f:
+            progress = json.load(f)
+        progress.setdefault("parts", [])
+        if progress.pop("complete", False):
+            # Retrying the failures of a finished export: its archive becomes the first part
+            if not zipfile.is_zipfile(output_path):
+                progress = {"done": [], "failed": [], "parts": []}
+            else:
+                os.replace(output_path, os.path.join(_ensure_dir(parts_dir), "part-0000.zip"))
+                progress["parts"] = ["part-0000.zip"]
+        # Previously failed products are retried
+        progress["failed"] = []
+        print(f"Resuming export: {len(progress['done'])} products already exported")
+    elif resume:
+        print("Nothing to resume (no progress file), starting a new export")
+
+    if not resume or not progress["done"]:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+        progress = {"done": [], "failed": [], "parts": []}
+    _ensure_dir(parts_dir)
+    # Parts written after the last checkpoint (or cut off by a crash) are not trusted
+    for name in os.listdir(parts_dir):
+        if name not in progress["parts"]:
+            os.remove(os.path.join(parts_dir, name))
+
+    def checkpoint():
+        with open(f"{progress_path}.tmp", "w") as f:
+            json.dump(progress, f)
+        os.replace(f"{progress_path}.tmp", progress_path)
+
+    wc_api = WooCommerceProductAPI(store_url, consumer_key, consumer_secret)
+    products = wc_api.iter_products(category=category, brand=brand, product_ids=product_ids)
+    skip_ids = set(progress["done"])
+
+    part = {"zf": None, "name": None, "done": [], "failed": []}
+
+    def close_part():
+        # Closed (central directory written) and renamed before its products are checkpointed
+        if part["zf"] is not None:
+            part["zf"].close()
+            os.replace(os.path.join(parts_dir, part["name"] + ".tmp"), os.path.join(parts_dir, part["name"]))
+            progress["parts"].append(part["name"])
+        progress["done"].extend(part["done"])
+        progress["failed"].extend(part["failed"])
+        checkpoint()
+        part.update(zf=None, name=None, done=[], failed=[])
+
+    for product, pdf_path in _render_products(products, store_url, consumer_key, consumer_secret, workers, skip_ids=skip_ids):
+        if pdf_path:
+            if part["zf"] is None:
+                part["name"] = f"part-{len(progress['parts']) + 1:04d}.zip"
+                part["zf"] = zipfile.ZipFile(os.path.join(parts_dir, part["name"] + ".tmp"), "w", compression=zipfile.ZIP_STORED)
+            _add_to_archive(part["zf"], product, pdf_path)
+            part["done"].append(product["id"])
+        else:
+            part["failed"].append(product["id"])
+
+        if len(part["done"]) + len(part["failed"]) >= CHECKPOINT_EVERY:
+            close_part()
+            print(f"Checkpoint: {len(progress['done'])} exported, {len(progress['failed'])} failed")
+    close_part()
+
+    # Every product is done: assemble the parts into the output
+    _ensure_dir(os.path.dirname(os.path.abspath(output_path)))
+    with zipfile.ZipFile(f"{output_path}.tmp", "w", compression=zipfile.ZIP_STORED) as zf:
+        for name in progress["parts"]:
+            _copy_entries(os.path.join(parts_dir, name), zf)
+    os.replace(f"{output_path}.tmp", output_path)
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    progress["parts"] = []
+    progress["complete"] = True
+    checkpoint()
+    progress.pop("complete")
+
+    print(f"✅ Export complete: {len(progress['done'])} specsheets in {output_path}, {len(progress['failed'])} failed")
+    return progress
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Export specsheet PDFs for a category, brand or list of products into a ZIP")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--category", type=int, help="WooCommerce category id")
+    target.add_argument("--brand", type=int, help="WooCommerce brand id")
+    target.add_argument("--ids", type=int, nargs="+", help="Explicit product ids")
+    parser.add_argument("--output", required=True, help="Path of the ZIP archive to write")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Parallel renders (conversions are capped by MAX_CONCURRENT_EXPORT_CONVERSIONS)")
+    parser.add_argument("--resume", action="store_true", help="Continue a previous export of the same archive")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    progress = export_to_file(
+        args.output, os.getenv("WC_STORE_URL"), os.getenv("WC_CONSUMER_KEY"), os.getenv("WC_CONSUMER_SECRET"),
+        category=args.category, brand=args.brand, product_ids=args.ids, workers=args.workers, resume=args.resume
+    )
+    return 1 if progress["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,207 @@
+"""
+Circuit breakers and deadline budgets for the external dependencies
+(WooCommerce, product images, Salesforce, Google).
+
+A breaker counts consecutive failures of one dependency across all worker
+processes (STATE_DIR/breakers.db). After BREAKER_FAILURES failures it opens:
+calls fail at once with CircuitOpen for BREAKER_RESET_SECONDS, then a single
+caller is let through as a probe (half-open). The probe's success closes the
+breaker, its failure opens it again.
+
+    with breaker("woocommerce").guard() as call:
+        response = session.get(url, timeout=timeout_for(WC_TIMEOUT))
+        if response.status_code >= 500:
+            call.failed()
+
+A deadline is the time left for the whole request or job. Each step asks
+timeout_for(its own cap) for its timeout, so a slow step uses up at most its
+cap of the budget, and once the budget is spent the remaining calls fail fast
+with DeadlineExceeded instead of waiting out their full timeouts. Deadlines
+nest (the inner one never extends the outer one) and follow the context, so
+they apply to the thread, or task, that set them:
+
+    with deadline(120):
+        process_enquiry(data)
+"""
+import contextvars, os, re, threading, time
+from contextlib import contextmanager
+
+from modules.shared_state import connect
+
+
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is unavailable (circuit open, retry in {retry_after:.0f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+# ----------------------------------------------------------------------
+# Deadlines
+# ----------------------------------------------------------------------
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds: float):
+    """Limit everything inside the block to `seconds` (or less, if an outer deadline ends sooner)"""
+    end = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(min(end, outer) if outer else end)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def run_with_deadline(seconds: float, fn, *args, **kwargs):
+    with deadline(seconds):
+        return fn(*args, **kwargs)
+
+
+def remaining():
+    """Seconds left in the current deadline, or None without one"""
+    end = _deadline.get()
+    return None if end is None else end - time.monotonic()
+
+
+def timeout_for(cap: float) -> float:
+    """Timeout for the next call: its own cap, bounded by the current deadline"""
+    left = remaining()
+    if left is None:
+        return cap
+    if left <= 0:
+        raise DeadlineExceeded("Deadline exceeded before the call was made")
+    return min(cap, left)
+
+
+# ----------------------------------------------------------------------
+# Circuit breakers
+# ----------------------------------------------------------------------
+
+def _db():
+    conn = connect("breakers")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS breakers (
+            name TEXT PRIMARY KEY,
+            state TEXT NOT NULL DEFAULT 'closed',
+            failures INTEGER NOT NULL DEFAULT 0,
+            opened_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT
+        )
+    """)
+    return conn
+
+
+class _Call:
+    def __init__(self):
+        self.ok = True
+        self.error = None
+
+    def failed(self, error: str = "failure reported by caller"):
+        """Count this call as a failure without raising (e.g. an HTTP 5xx response)"""
+        self.ok = False
+        self.error = error
+
+
+class CircuitBreaker:
+
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failures
+        self.reset_seconds = reset_seconds
+        self._healthy = True  # Last known state in this process: skip the write on success while closed
+        _db().execute("INSERT OR IGNORE INTO breakers (name) VALUES (?)", (name,))
+
+    def before(self):
+        """Raise CircuitOpen unless a call may go through now (as a probe when half-open)"""
+        conn = _db()
+        row = conn.execute("SELECT state, failures, opened_at FROM breakers WHERE name = ?", (self.name,)).fetchone()
+        self._healthy = row["state"] == "closed" and not row["failures"]
+        if row["state"] == "closed":
+            return
+
+        now = time.time()
+        wait = row["opened_at"] + self.reset_seconds - now
+        if wait > 0:
+            raise CircuitOpen(self.name, wait)
+
+        # Open long enough (or a previous probe never reported back): one caller becomes the probe
+        cursor = conn.execute(
+            "UPDATE breakers SET state = 'half_open', opened_at = ? WHERE name = ? AND state = ? AND opened_at = ?",
+            (now, self.name, row["state"], row["opened_at"])
+        )
+        if cursor.rowcount != 1:
+            raise CircuitOpen(self.name, self.reset_seconds)
+        print(f"Circuit {self.name}: half-open, probing")
+
+    def record(self, ok: bool, error: str = None):
+        conn = _db()
+        if ok:
+            if not self._healthy:
+                cursor = conn.execute("UPDATE breakers SET state = 'closed', failures = 0, last_error = NULL WHERE name = ? AND (state != 'closed' OR failures > 0)", (self.name,))
+                if cursor.rowcount:
+                    print(f"✓ Circuit {self.name}: closed")
+                self._healthy = True
+            return
+
+        self._healthy = False
+        conn.execute("UPDATE breakers SET failures = failures + 1, last_error = ? WHERE name = ?", (error, self.name))
+        cursor = conn.execute(
+            "UPDATE breakers SET state = 'open', opened_at = ? WHERE name = ? AND (state = 'half_open' OR (state = 'closed' AND failures >= ?))",
+            (time.time(), self.name, self.failure_threshold)
+        )
+        if cursor.rowcount:
+            print(f"❌ Circuit {self.name}: open for {self.reset_seconds:.0f}s after: {error}")
+
+    @contextmanager
+    def guard(self):
+        """Check the breaker, run the block and record its outcome; exceptions count as failures"""
+        self.before()
+        call = _Call()
+        try:
+            yield call
+        except DeadlineExceeded:
+            raise  # Our budget ran out, not the dependency's fault
+        except Exception as e:
+            # Query strings may carry credentials (WooCommerce OAuth over http)
+            self.record(False, re.sub(r"\?[^\s'\")]*", "", f"{type(e).__name__}: {e}")[:500])
+            raise
+        self.record(call.ok, call.error)
+
+    def stats(self) -> dict:
+        row = _db().execute("SELECT state, failures, opened_at, last_error FROM breakers WHERE name = ?", (self.name,)).fetchone()
+        return {"state": row["state"], "failures": row["failures"], "opened_at": row["opened_at"] or None, "last_error": row["last_error"]}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(name: str) -> CircuitBreaker:
+    """The process-wide breaker for a dependency; thresholds from BREAKER_<NAME>_FAILURES / _RESET_SECONDS"""
+    found = _breakers.get(name)
+    if found is None:
+        with _breakers_lock:
+            found = _breakers.get(name)
+            if found is None:
+                prefix = f"BREAKER_{name.upper()}"
+                found = _breakers[name] = CircuitBreaker(
+                    name,
+                    int(os.getenv(f"{prefix}_FAILURES", BREAKER_FAILURES)),
+                    float(os.getenv(f"{prefix}_RESET_SECONDS", BREAKER_RESET_SECONDS)),
+                )
+    return found
+
+
+def stats() -> dict:
+    return {name: found.stats() for name, found in list(_breakers.items())}
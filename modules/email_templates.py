@@ -0,0 +1,69 @@
+"""
+Registry of the HTML templates in email_templates/.
+
+Every template is read and compiled once into literal chunks and {{ variable }}
+slots; render() just joins them, escaping each value for HTML. Set
+EMAIL_TEMPLATES_RELOAD=true in development to pick up edited files without a
+restart (checked by mtime on every lookup).
+
+    render_template("account_creation.html", email=email, password=password)
+"""
+import hashlib, html, os, re, threading
+
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "email_templates")
+RELOAD = os.getenv("EMAIL_TEMPLATES_RELOAD", "false").lower() == "true"
+
+PLACEHOLDER = re.compile(r"{{\s*(\w+)\s*}}")
+
+_templates = {}
+_lock = threading.Lock()
+
+
+class Template:
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self.mtime = os.stat(path).st_mtime
+        with open(path, "r") as f:
+            self.source = f.read()
+        self.etag = '"' + hashlib.sha1(self.source.encode()).hexdigest() + '"'
+        # Alternating literal text and variable names: [text, var, text, var, ..., text]
+        self.parts = PLACEHOLDER.split(self.source)
+        self.variables = set(self.parts[1::2])
+
+    def render(self, **context) -> str:
+        missing = self.variables - context.keys()
+        if missing:
+            raise KeyError(f"Template {self.name} needs {sorted(missing)}")
+        parts = list(self.parts)
+        for i in range(1, len(parts), 2):
+            parts[i] = html.escape(str(context[parts[i]]))
+        return "".join(parts)
+
+
+def load_all():
+    """Compile every template in TEMPLATE_DIR"""
+    with _lock:
+        for filename in os.listdir(TEMPLATE_DIR):
+            if filename.endswith(".html"):
+                _templates[filename] = Template(filename, os.path.join(TEMPLATE_DIR, filename))
+    return dict(_templates)
+
+
+def get_template(name: str) -> Template:
+    if not _templates:
+        load_all()
+    template = _templates.get(name)
+    if template is None:
+        raise FileNotFoundError(f"No email template named {name} in {TEMPLATE_DIR}")
+
+    if RELOAD and os.stat(template.path).st_mtime != template.mtime:
+        print(f"Email template {name} changed, reloading")
+        with _lock:
+            template = _templates[name] = Template(name, template.path)
+    return template
+
+
+def render_template(name: str, **context) -> str:
+    return get_template(name).render(**context)
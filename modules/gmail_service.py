@@ -1,13 +1,24 @@
 
-import base64, os, mimetypes
+import base64, os, mimetypes, queue, random, re, shutil, tempfile, threading, time, uuid, zipfile
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
-from email import encoders
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
+
+from modules.lazy_imports import lazy_import
+from modules.google_discovery import build_service, GOOGLE_TIMEOUT
+from modules.circuit_breaker import breaker, CircuitOpen
+from modules.tracing import span
+from modules.email_templates import get_template, render_template
+from modules.attachment_cache import encoded_attachment
+from modules.shared_state import state_path
+
+
+# Google client libraries, imported on first use
+oauth_flow = lazy_import("google_auth_oauthlib.flow")
+google_requests = lazy_import("google.auth.transport.requests")
+oauth_credentials = lazy_import("google.oauth2.credentials")
+google_errors = lazy_import("googleapiclient.errors")
+google_http = lazy_import("googleapiclient.http")
 
 
 main_creds = "main-credentials.json"
@@ -16,31 +27,49 @@ token_file = "token.json"
 SCOPES = ["https://www.googleapis.com/auth/gmail.send", "https://www.googleapis.com/auth/spreadsheets"]
 FROM = "BigTree Group <web@bigtree-group.com>"
 
+# Send scheduler: messages per second (per worker process) and messages per batch request
+GMAIL_SEND_PER_SECOND = float(os.getenv("GMAIL_SEND_PER_SECOND", "2"))
+GMAIL_BATCH_SIZE = int(os.getenv("GMAIL_BATCH_SIZE", "10"))
+GMAIL_MAX_ATTEMPTS = 5
+GMAIL_SEND_TIMEOUT = 600  # seconds a caller waits for its message
+UPLOAD_CHUNK = 1024 * 1024  # resumable upload chunk, a multiple of 256 KB
+
+# Attachments above EMAIL_ATTACHMENTS_MAX_BYTES (raw; base64 adds a third, Gmail's limit is 25 MB encoded) are
+# sent as several emails ("split"), or as one .zip when the archive fits ("zip", else split)
+EMAIL_ATTACHMENTS_MAX_BYTES = int(os.getenv("EMAIL_ATTACHMENTS_MAX_BYTES", str(18 * 1024 * 1024)))
+EMAIL_ATTACHMENTS_OVERFLOW = os.getenv("EMAIL_ATTACHMENTS_OVERFLOW", "split").lower()
+
+ATTACHMENT_PLACEHOLDER = re.compile(rb"@@attachment-[0-9a-f]{32}@@")
+
 def load_email_template(template_name):
-    template_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "email_templates", template_name)
-    with open(template_path, "r") as file:
-        return file.read()
+    return get_template(template_name).source
 
 def get_gmail_service():
     creds = None
     if os.path.exists(token_file):
-        creds = Credentials.from_authorized_user_file(token_file, SCOPES)
+        creds = oauth_credentials.Credentials.from_authorized_user_file(token_file, SCOPES)
 
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+            creds.refresh(google_requests.Request())
         else:
-            flow = InstalledAppFlow.from_client_secrets_file(main_creds, SCOPES)
+            flow = oauth_flow.InstalledAppFlow.from_client_secrets_file(main_creds, SCOPES)
             creds = flow.run_local_server(port=0)
 
         with open(token_file, "w") as token:
             token.write(creds.to_json())
 
-    return build("gmail", "v1", credentials=creds)
+    return build_service("gmail", "v1", credentials=creds, timeout=GOOGLE_TIMEOUT)
 
 
 
 def create_message(to, subject, html_body, pdf_files=None, attachments=False, cc=None):
+    """
+    Small messages come back as {"raw": ...}. Messages with attachments are
+    written to a temporary .eml file instead, {"media_path": ...}, and uploaded
+    as message/rfc822: the attachments are streamed in from their cached
+    base64 blobs, so no full copy of a PDF is ever held in memory.
+    """
     message = MIMEMultipart("mixed")
     message["to"] = to
     message["from"] = FROM
@@ -54,78 +83,350 @@ def create_message(to, subject, html_body, pdf_files=None, attachments=False, cc
     html_part = MIMEText(html_body, "html")
     related.attach(html_part)
 
-    # Attach each PDF file if attachments are enabled
-    if attachments and pdf_files:
-        for file_path in pdf_files:
-            content_type, _ = mimetypes.guess_type(file_path)
-            if content_type is None:
-                content_type = "application/octet-stream"
-            main_type, sub_type = content_type.split("/", 1)
+    if not (attachments and pdf_files):
+        return {"raw": base64.urlsafe_b64encode(message.as_bytes()).decode()}
+
+    # Each attachment part holds a placeholder, replaced by its blob while writing the file
+    blobs = {}
+    for file_path in pdf_files:
+        content_type, _ = mimetypes.guess_type(file_path)
+        if content_type is None:
+            content_type = "application/octet-stream"
+        main_type, sub_type = content_type.split("/", 1)
+
+        placeholder = f"@@attachment-{uuid.uuid4().hex}@@"
+        blobs[placeholder.encode()] = encoded_attachment(file_path)
+        part = MIMEBase(main_type, sub_type)
+        part.set_payload(placeholder)
+        part["Content-Transfer-Encoding"] = "base64"
+        part.add_header("Content-Disposition", "attachment", filename=os.path.basename(file_path))
+        message.attach(part)
+
+    skeleton = message.as_bytes()
+    fd, media_path = tempfile.mkstemp(suffix=".eml", dir=os.path.dirname(state_path("outgoing", "x")))
+    with os.fdopen(fd, "wb") as out:
+        position = 0
+        for match in ATTACHMENT_PLACEHOLDER.finditer(skeleton):
+            out.write(skeleton[position:match.start()])
+            with open(blobs[match.group()], "rb") as blob:
+                shutil.copyfileobj(blob, out, UPLOAD_CHUNK)
+            position = match.end()
+        out.write(skeleton[position:])
+
+    return {"media_path": media_path}
+
+
+# ------- Send Scheduler ------- #
+class OutgoingMessage:
+    """
+    One queued email; status goes queued -> sending -> sent | failed (or back
+    to queued for a retry). A caller that stops waiting cancels it while it is
+    still queued, so a later retry of the caller's own never duplicates it.
+    """
+
+    def __init__(self, body, label):
+        self.body = body
+        self.label = label
+        self.status = "queued"
+        self.message_id = None
+        self.error = None
+        self.attempts = 0
+        self.not_before = 0.0
+        self._done = threading.Event()
+        self._state = threading.Lock()
+
+    def claim(self) -> bool:
+        """Scheduler side: take the message for sending, unless it was cancelled"""
+        with self._state:
+            if self.status != "queued":
+                return False
+            self.status = "sending"
+            return True
+
+    def requeue(self):
+        with self._state:
+            self.status = "queued"
+
+    def cancel(self) -> bool:
+        """Withdraw the message if it has not been taken for sending yet"""
+        with self._state:
+            if self.status != "queued":
+                return False
+            self.status = "cancelled"
+        self.finish("cancelled")
+        return True
 
-            with open(file_path, "rb") as fp:
-                part = MIMEBase(main_type, sub_type)
-                part.set_payload(fp.read())
-                encoders.encode_base64(part)
-                part.add_header("Content-Disposition", "attachment", filename=os.path.basename(file_path))
-                message.attach(part)
+    def finish(self, status, message_id=None, error=None):
+        self.status, self.message_id, self.error = status, message_id, error
+        if "media_path" in self.body:
+            try:
+                os.remove(self.body["media_path"])
+            except FileNotFoundError:
+                pass
+        self._done.set()
+
+    def request(self, service):
+        if "media_path" in self.body:
+            media = google_http.MediaFileUpload(self.body["media_path"], mimetype="message/rfc822", chunksize=UPLOAD_CHUNK, resumable=True)
+            return service.users().messages().send(userId="me", media_body=media)
+        return service.users().messages().send(userId="me", body=self.body)
+
+    def wait(self, timeout=GMAIL_SEND_TIMEOUT) -> bool:
+        if not self._done.wait(timeout):
+            if self.cancel():
+                print(f"⚠️ Email cancelled ({self.label}): not sent within {timeout:.0f}s")
+                return False
+            self._done.wait(GOOGLE_TIMEOUT * 3)  # Being sent right now: that attempt decides
+        return self.status == "sent"
+
+
+def is_rate_limited(error) -> bool:
+    """429, or 403 with rateLimitExceeded / userRateLimitExceeded"""
+    status = getattr(getattr(error, "resp", None), "status", None)
+    content = getattr(error, "content", b"") or b""
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", "replace")
+    return status == 429 or (status == 403 and "ateLimitExceeded" in content)
+
+
+class SendScheduler:
+    """
+    Queues outgoing messages and sends them from a single worker thread, which
+    keeps one Gmail service (and its HTTP connection) for all sends. Messages
+    are paced by a token bucket and grouped into batch requests of up to
+    batch_size. When Gmail answers 429 / rateLimitExceeded the whole scheduler
+    backs off exponentially and the affected messages are retried.
+    """
+
+    def __init__(self, per_second=GMAIL_SEND_PER_SECOND, batch_size=GMAIL_BATCH_SIZE):
+        from modules.admission_control import TokenBucket
+
+        self.bucket = TokenBucket(per_second, max(1, batch_size))
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.service = None
+        self.paused_until = 0.0
+        self.backoff = 1.0
+        self.counts = {"sent": 0, "failed": 0, "rate_limited": 0, "cancelled": 0}
+        threading.Thread(target=self._run, name="gmail-sender", daemon=True).start()
+
+    def send(self, body, label="email") -> OutgoingMessage:
+        message = OutgoingMessage(body, label)
+        self.queue.put(message)
+        return message
+
+    def stats(self):
+        return {"queued": self.queue.qsize(), "paused_for": max(0.0, round(self.paused_until - time.monotonic(), 1)), **self.counts}
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+        # Messages still backing off go back to the queue, cancelled ones are dropped
+        now = time.monotonic()
+        ready = []
+        for message in batch:
+            if message.status == "cancelled":
+                self.counts["cancelled"] += 1
+            elif message.not_before > now:
+                self.queue.put(message)
+            else:
+                ready.append(message)
+        if not ready and any(message.not_before > now for message in batch):
+            time.sleep(min(min(message.not_before for message in batch) - now, 0.5))
+        return ready
+
+    def _pace(self, count):
+        delay = self.paused_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        for _ in range(count):
+            wait = self.bucket.take()
+            while wait:
+                time.sleep(wait)
+                wait = self.bucket.take()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            self._pace(len(batch))
+            # Claimed only now: a caller that gave up during the pause has withdrawn its message
+            claimed = [message for message in batch if message.claim()]
+            self.counts["cancelled"] += len(batch) - len(claimed)
+            batch = claimed
+            if not batch:
+                continue
+            try:
+                with breaker("gmail").guard():
+                    if self.service is None:
+                        self.service = get_gmail_service()
+                    self._send_batch(batch)
+            except CircuitOpen as e:
+                # Gmail is down: hold the queue until the breaker lets a probe through
+                self.paused_until = time.monotonic() + e.retry_after
+                for message in batch:
+                    message.requeue()
+                    self.queue.put(message)
+            except Exception as e:
+                # Whole request failed (network, auth, upload): rebuild the service and retry
+                self.service = None
+                for message in batch:
+                    if message.status == "sending":  # Not already answered before the failure
+                        message.attempts += 1
+                        self._retry_or_fail(message, e)
+
+    def _send_batch(self, batch):
+        # Uploads cannot go in a batch request; they are sent one by one
+        single = [message for message in batch if "media_path" in message.body]
+        batched = [message for message in batch if "media_path" not in message.body]
+        if len(batched) == 1:
+            single += batched
+            batched = []
+
+        for message in single:
+            try:
+                response = message.request(self.service).execute()
+                self._handle_result(message, response, None)
+            except google_errors.HttpError as e:
+                self._handle_result(message, None, e)
+
+        if batched:
+            by_id = {str(i): message for i, message in enumerate(batched)}
+            request = self.service.new_batch_http_request(callback=lambda request_id, response, error: self._handle_result(by_id[request_id], response, error))
+            for request_id, message in by_id.items():
+                request.add(message.request(self.service), request_id=request_id)
+            request.execute()
+
+    def _handle_result(self, message, response, error):
+        message.attempts += 1
+        if error is None:
+            self.backoff = 1.0
+            self.counts["sent"] += 1
+            message.finish("sent", message_id=response.get("id"))
+            print(f"✓ Email sent ({message.label}): {message.message_id}")
+        elif is_rate_limited(error):
+            self.counts["rate_limited"] += 1
+            self.paused_until = time.monotonic() + self.backoff
+            self.backoff = min(self.backoff * 2, 64.0)
+            self._retry_or_fail(message, error)
+        elif getattr(getattr(error, "resp", None), "status", 0) >= 500:
+            self._retry_or_fail(message, error)  # Transient Gmail backend error
+        else:
+            self._fail(message, error)
+
+    def _retry_or_fail(self, message, error):
+        if message.attempts >= GMAIL_MAX_ATTEMPTS:
+            return self._fail(message, error)
+        message.not_before = time.monotonic() + min(2 ** message.attempts, 64) + random.random()
+        message.requeue()
+        self.queue.put(message)
+
+    def _fail(self, message, error):
+        self.counts["failed"] += 1
+        message.finish("failed", error=str(error))
+        print(f"❌ Email failed ({message.label}) after {message.attempts} attempts: {error}")
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> SendScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = SendScheduler()
+        return _scheduler
+
+
+def send_message(body_message, label="email") -> bool:
+    """Queue a message on the scheduler and wait for its delivery status"""
+    with span("gmail.send", label=label, upload="media_path" in body_message) as sending:
+        message = get_scheduler().send(body_message, label)
+        sent = message.wait()
+        sending.set(status=message.status, attempts=message.attempts)
+        return sent
+
+
+def group_attachments(paths, max_bytes=EMAIL_ATTACHMENTS_MAX_BYTES):
+    """Split files, in order, into groups of at most max_bytes (a larger file goes alone)"""
+    groups, size = [], 0
+    for path in paths:
+        file_size = os.path.getsize(path)
+        if not groups or size + file_size > max_bytes:
+            groups.append([])
+            size = 0
+        groups[-1].append(path)
+        size += file_size
+    return groups
+
+
+def zip_attachments(paths, name="specsheets.zip"):
+    """Write the files into one archive in STATE_DIR/outgoing, streamed from disk; returns its path"""
+    directory = tempfile.mkdtemp(dir=os.path.dirname(state_path("outgoing", "x")))
+    archive = os.path.join(directory, name)
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+        for path in paths:
+            zf.write(path, os.path.basename(path))
+    return archive
+
+
+def send_with_attachments(to, subject, html_body, pdf_files, label, cc=None) -> bool:
+    """
+    Send pdf_files within EMAIL_ATTACHMENTS_MAX_BYTES per message: as they are
+    when they fit, otherwise zipped or split into numbered emails ("Subject (2/3)").
+    Returns True when every email was sent.
+    """
+    groups = group_attachments(pdf_files)
+    archive = None
+    if len(groups) > 1 and EMAIL_ATTACHMENTS_OVERFLOW == "zip":
+        archive = zip_attachments(pdf_files)
+        if os.path.getsize(archive) <= EMAIL_ATTACHMENTS_MAX_BYTES:
+            groups = [[archive]]
+        else:
+            print(f"⚠️ {label}: archive still over {EMAIL_ATTACHMENTS_MAX_BYTES // (1024 * 1024)} MB, splitting instead")
+    if len(groups) > 1:
+        print(f"{label}: {len(pdf_files)} attachments split into {len(groups)} emails")
 
-    return {"raw": base64.urlsafe_b64encode(message.as_bytes()).decode()}
+    try:
+        sent = True
+        for number, group in enumerate(groups or [[]], start=1):
+            part_subject = subject if len(groups) <= 1 else f"{subject} ({number}/{len(groups)})"
+            body_message = create_message(to, part_subject, html_body, group, attachments=True, cc=cc)
+            sent = send_message(body_message, label) and sent
+        return sent
+    finally:
+        if archive:
+            shutil.rmtree(os.path.dirname(archive), ignore_errors=True)
 
 
 # ------- Send Emails ------- #
 def send_product_enquiry_email(full_name, email, pdf_files, cc):
-    service = get_gmail_service()
-    html_body = load_email_template("product_enquiry.html").replace("{{full_name}}", full_name)
-    
-    body_message = create_message(email, "Product Enquiry", html_body, pdf_files, attachments=True, cc=cc)
-    try:
-        message = service.users().messages().send(userId="me", body=body_message).execute()
-        return True
-
-    except Exception as e:
-        print(f"An error occurred in [send product enquiry email]: {e}")
-        return False
+    html_body = render_template("product_enquiry.html", full_name=full_name)
+    return send_with_attachments(email, "Product Enquiry", html_body, pdf_files, "product enquiry", cc=cc)
 
 
 def send_account_creation_email(email, password, cc=None):
-    service = get_gmail_service()
-    html_body = load_email_template("account_creation.html").replace("{{email}}", email).replace("{{password}}", password)
+    html_body = render_template("account_creation.html", email=email, password=password)
     body_message = create_message(email, "Your New Account Details", html_body, attachments=False, cc=cc)
     
-    try:
-        message = service.users().messages().send(userId="me", body=body_message).execute()
-        return True
-
-    except Exception as e:
-        print(f"An error occurred in [send_account creation email]: {e}")
-        return False
+    return send_message(body_message, "account creation")
 
 
 
 def send_single_product_specsheet_email(to, file_path, cc=None):
-    service = get_gmail_service()
-    html_body = load_email_template("single_product_Specsheet.html")
+    html_body = render_template("single_product_Specsheet.html")
     body_message = create_message(to, "Product Specsheet", html_body, [file_path], attachments=True, cc=cc)
-    try:
-        message = service.users().messages().send(userId="me", body=body_message).execute()
-        return True
-
-    except Exception as e:
-        print(f"An error occurred in [send_single_ product_ specsheet_email]: {e}")
-        return False
+    return send_message(body_message, "product specsheet")
 
 
 
 def send_request_sample_email(email, pdf_files, cc=None):
-    service = get_gmail_service()
-    request_sample_html = load_email_template("request_sample.html")
-    body_message = create_message(email, "Request Sample", request_sample_html, pdf_files, attachments=True, cc=cc)
-    
-    try:
-        message = service.users().messages().send(userId="me", body=body_message).execute()
-        return True
-
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return False
+    request_sample_html = render_template("request_sample.html")
+    return send_with_attachments(email, "Request Sample", request_sample_html, pdf_files, "request sample", cc=cc)
 
@@ -0,0 +1,67 @@
+"""
+Google API clients built from static discovery documents.
+
+build("gmail", "v1") re-reads and re-parses a large discovery document on every
+call (and may fetch it over the network). build_service() parses each document
+once per process and constructs clients with build_from_document, so creating
+a client is near-instant and never needs the network.
+
+Documents are looked up in this order:
+    1. DISCOVERY_DIR/<name>.<version>.json   (shipped with / cached by this service)
+    2. the copy bundled with google-api-python-client
+    3. the discovery service over HTTP, saved to DISCOVERY_DIR for next time
+"""
+import json, os, threading
+from functools import lru_cache
+
+from modules.lazy_imports import lazy_import
+
+
+discovery = lazy_import("googleapiclient.discovery")
+discovery_cache = lazy_import("googleapiclient.discovery_cache")
+google_auth_httplib2 = lazy_import("google_auth_httplib2")
+httplib2 = lazy_import("httplib2")
+requests = lazy_import("requests")
+
+DISCOVERY_DIR = os.getenv("GOOGLE_DISCOVERY_DIR", "files/discovery")
+DISCOVERY_URL = "https://{api}.googleapis.com/$discovery/rest?version={apiVersion}"
+GOOGLE_TIMEOUT = float(os.getenv("GOOGLE_TIMEOUT", "20"))  # socket timeout of Google API calls, further bounded by the job deadline
+
+# build_from_document fixes up method descriptions in place the first time;
+# serialize builds so threads never see a half-updated document
+_build_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_discovery_document(name: str, version: str) -> dict:
+    """Parsed discovery document, loaded once per process"""
+    local_path = os.path.join(DISCOVERY_DIR, f"{name}.{version}.json")
+    if os.path.exists(local_path):
+        with open(local_path, "r") as f:
+            return json.load(f)
+
+    content = discovery_cache.get_static_doc(name, version)
+    if content:
+        return json.loads(content)
+
+    print(f"No static discovery document for {name} {version}, fetching it once")
+    response = requests.get(DISCOVERY_URL.format(api=name, apiVersion=version), timeout=15)
+    response.raise_for_status()
+    os.makedirs(DISCOVERY_DIR, exist_ok=True)
+    with open(local_path, "w") as f:
+        f.write(response.text)
+    return response.json()
+
+
+def build_service(name: str, version: str, credentials, timeout: float = None):
+    """
+    Drop-in replacement for googleapiclient.discovery.build(name, version, credentials=...);
+    `timeout` is the socket timeout of the client's requests (the library default is 60s).
+    """
+    document = get_discovery_document(name, version)
+    if timeout:
+        kwargs = {"http": google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http(timeout=timeout))}
+    else:
+        kwargs = {"credentials": credentials}
+    with _build_lock:
+        return discovery.build_from_document(document, **kwargs)
@@ -1,9 +1,16 @@
 import os
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from google.auth.transport.requests import Request
-from googleapiclient.errors import HttpError
+
+from modules.lazy_imports import lazy_import
+from modules.google_discovery import build_service, GOOGLE_TIMEOUT
+from modules.circuit_breaker import breaker, timeout_for
+from modules.tracing import span
+
+
+# Google client libraries, imported on first use
+oauth_flow = lazy_import("google_auth_oauthlib.flow")
+google_errors = lazy_import("googleapiclient.errors")
+google_requests = lazy_import("google.auth.transport.requests")
+oauth_credentials = lazy_import("google.oauth2.credentials")
 
 
 
@@ -11,26 +18,26 @@ SCOPES = ["https://www.googleapis.com/auth/gmail.send", "https://www.googleapis.
 CLIENT_SECRETS_FILE = "main-credentials.json"
 TOKEN_FILE = "token.json"
 
-def init_sheets_service():# Helper function
+def init_sheets_service(timeout=None):# Helper function
     try:
         creds = None
 
         if os.path.exists(TOKEN_FILE):
-            creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
+            creds = oauth_credentials.Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
 
         # If no valid credentials, start OAuth flow
         if not creds or not creds.valid:
             if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
+                creds.refresh(google_requests.Request())
             else:
-                flow = InstalledAppFlow.from_client_secrets_file(CLIENT_SECRETS_FILE, SCOPES)
+                flow = oauth_flow.InstalledAppFlow.from_client_secrets_file(CLIENT_SECRETS_FILE, SCOPES)
                 creds = flow.run_local_server(port=0)
 
             # Save the credentials for next run
             with open(TOKEN_FILE, "w") as token:
                 token.write(creds.to_json())
 
-        service = build("sheets", "v4", credentials=creds)
+        service = build_service("sheets", "v4", credentials=creds, timeout=timeout)
         return service
 
     except Exception as e:
@@ -39,36 +46,54 @@ def init_sheets_service():# Helper function
 
 
 def append_row(sheet_id: str, sheet_name: str, row_data: list) -> bool:
+    if not isinstance(row_data, list):
+        print("A value error occurred: row_data must be a list")
+        return False
+    return append_rows(sheet_id, sheet_name, [row_data])
+
+
+def append_rows(sheet_id: str, sheet_name: str, rows: list) -> bool:
+    """Append several rows with a single API call"""
     try:
-        if not isinstance(row_data, list):
-            raise ValueError("row_data must be a list")
+        if not isinstance(rows, list) or not all(isinstance(row, list) for row in rows):
+            raise ValueError("rows must be a list of lists")
 
-        service = init_sheets_service()
+        service = init_sheets_service(timeout_for(GOOGLE_TIMEOUT))
         if not service:
             print("Sheet service not available.")
             return False
 
         range_name = f"{sheet_name}!A1"
-        value_range_body = {"values": [row_data]}
-
-        result = (
-            service.spreadsheets()
-            .values()
-            .append(
-                spreadsheetId=sheet_id,
-                range=range_name,
-                valueInputOption="RAW",
-                insertDataOption="INSERT_ROWS",
-                body=value_range_body
-            ).execute()
-        )
+        value_range_body = {"values": rows}
+
+        error = None
+        with span("sheets.append", sheet=sheet_name, rows=len(rows)), breaker("google_sheets").guard() as call:
+            try:
+                result = (
+                    service.spreadsheets()
+                    .values()
+                    .append(
+                        spreadsheetId=sheet_id,
+                        range=range_name,
+                        valueInputOption="RAW",
+                        insertDataOption="INSERT_ROWS",
+                        body=value_range_body
+                    ).execute()
+                )
+            except google_errors.HttpError as e:
+                # Only outages and throttling count against the breaker, not bad requests
+                error = e
+                if e.resp.status >= 500 or e.resp.status == 429:
+                    call.failed(f"HTTP {e.resp.status}")
+        if error:
+            raise error
 
         # updated_rows = result.get("updates", {}).get("updatedRows", 0)
         # print(f"{updated_rows} rows appended.")
         
         return True
 
-    except HttpError as e:
+    except google_errors.HttpError as e:
         print(f"An HTTP error occurred: {e}")
         return False
 
@@ -79,4 +104,3 @@ def append_row(sheet_id: str, sheet_name: str, row_data: list) -> bool:
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
         return False
-
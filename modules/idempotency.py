@@ -0,0 +1,100 @@
+"""
+Duplicate suppression for the webhook POST routes.
+
+Form plugins retry on timeout and users double-click submit; each duplicate
+would otherwise append another Sheets row, create another Salesforce lead and
+render another PDF. A request is identified by its Idempotency-Key header or,
+failing that, by a hash of the validated payload; the first request claims the
+key and stores its response, duplicates inside the TTL get that response back
+without any work being redone. A claim that never gets its response (the
+worker died in between) is dropped after IDEMPOTENCY_PENDING_SECONDS, so the
+request can be retried.
+
+The store is a bounded SQLite table under STATE_DIR, shared by all workers.
+"""
+import hashlib, json, os, time
+
+from modules.shared_state import connect
+
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "50000"))
+IDEMPOTENCY_PENDING_SECONDS = int(os.getenv("IDEMPOTENCY_PENDING_SECONDS", "60"))
+PRUNE_EVERY = 200
+
+_claims = 0
+_schema_ready = False
+
+
+def _db():
+    global _schema_ready
+    conn = connect("idempotency")
+    if not _schema_ready:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                status_code INTEGER,
+                body TEXT,
+                created REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+        _schema_ready = True
+    return conn
+
+
+def request_key(route: str, header_key: str | None, validated_data) -> str:
+    """Key from the Idempotency-Key header, or a content hash of the validated pydantic model"""
+    if header_key:
+        return f"{route}:key:{header_key.strip()[:200]}"
+    digest = hashlib.sha256(validated_data.model_dump_json().encode()).hexdigest()
+    return f"{route}:sha256:{digest}"
+
+
+def claim(key: str):
+    """
+    Claim a key for a new request. Returns None when the caller should process
+    the request, otherwise the stored (status_code, body) of the original; body
+    is None while the original is still being handled.
+    """
+    global _claims
+    conn = _db()
+    now = time.time()
+    conn.execute(
+        "DELETE FROM responses WHERE key = ? AND (created < ? OR (body IS NULL AND created < ?))",
+        (key, now - IDEMPOTENCY_TTL_SECONDS, now - IDEMPOTENCY_PENDING_SECONDS)
+    )
+    cursor = conn.execute("INSERT OR IGNORE INTO responses (key, created) VALUES (?, ?)", (key, now))
+
+    _claims += 1
+    if _claims % PRUNE_EVERY == 0:
+        prune()
+
+    if cursor.rowcount == 1:
+        return None
+    row = conn.execute("SELECT status_code, body FROM responses WHERE key = ?", (key,)).fetchone()
+    if row is None:  # Evicted in between, treat as new
+        return claim(key)
+    return row["status_code"], row["body"]
+
+
+def complete(key: str, status_code: int, content: dict):
+    """Store the response returned for a claimed key"""
+    _db().execute("UPDATE responses SET status_code = ?, body = ? WHERE key = ?", (status_code, json.dumps(content), key))
+
+
+def release(key: str):
+    """Forget a claim whose request was not accepted, so a retry is processed normally"""
+    _db().execute("DELETE FROM responses WHERE key = ?", (key,))
+
+
+def prune():
+    """Drop expired entries, then the oldest ones beyond IDEMPOTENCY_MAX_ENTRIES"""
+    conn = _db()
+    now = time.time()
+    conn.execute("DELETE FROM responses WHERE created < ? OR (body IS NULL AND created < ?)", (now - IDEMPOTENCY_TTL_SECONDS, now - IDEMPOTENCY_PENDING_SECONDS))
+    conn.execute("""
+        DELETE FROM responses WHERE key IN (
+            SELECT key FROM responses ORDER BY created DESC LIMIT -1 OFFSET ?
+        )
+    """, (IDEMPOTENCY_MAX_ENTRIES,))
@@ -0,0 +1,117 @@
+"""
+Product image preparation for the specsheet templates.
+
+The template image box is MAX_DISPLAY_HEIGHT_PX tall at 96 DPI. Images are
+downscaled to that box at SPECSHEET_IMAGE_DPI (so a 4000px photo is embedded at
+~700px, not at full size) and re-encoded as JPEG with the configured quality
+and progressive encoding. JPEG sources are decoded at reduced size with
+Pillow's draft mode, which skips most of the decode work for large photos.
+
+Pillow decodes the whole image before resizing it, so an image that would
+still be over SPECSHEET_IMAGE_MAX_PIXELS after draft mode (a huge PNG or TIFF)
+is refused with ImageTooLarge instead of being decoded. libvips shrinks while
+decoding and is not limited.
+
+Backends (SPECSHEET_IMAGE_BACKEND):
+    pillow  always available (Pillow-SIMD is a drop-in replacement and just works)
+    vips    pyvips thumbnail_buffer, when pyvips and libvips are installed
+    auto    vips if importable, otherwise pillow (default)
+"""
+import os
+from io import BytesIO
+
+from modules.lazy_imports import lazy_import
+
+
+Image = lazy_import("PIL.Image")
+
+MAX_DISPLAY_HEIGHT_PX = 342.42519685  # template image box, in 96 DPI pixels
+SCREEN_DPI = 96
+
+SPECSHEET_IMAGE_DPI = int(os.getenv("SPECSHEET_IMAGE_DPI", "200"))
+SPECSHEET_IMAGE_QUALITY = int(os.getenv("SPECSHEET_IMAGE_QUALITY", "85"))
+SPECSHEET_IMAGE_PROGRESSIVE = os.getenv("SPECSHEET_IMAGE_PROGRESSIVE", "true").lower() == "true"
+SPECSHEET_IMAGE_BACKEND = os.getenv("SPECSHEET_IMAGE_BACKEND", "auto")
+SPECSHEET_IMAGE_MAX_PIXELS = int(os.getenv("SPECSHEET_IMAGE_MAX_PIXELS", "40000000"))  # ~160 MB decoded as RGBA
+
+_pyvips = None
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def get_pyvips():
+    """pyvips module, or None when it (or libvips) is not installed"""
+    global _pyvips
+    if _pyvips is None:
+        try:
+            import pyvips
+            _pyvips = pyvips
+        except (ImportError, OSError):
+            _pyvips = False
+    return _pyvips or None
+
+
+def target_size(width, height, max_height_px=MAX_DISPLAY_HEIGHT_PX, dpi=SPECSHEET_IMAGE_DPI):
+    """
+    Returns ((pixel width, pixel height), display height in inches). Display
+    height is capped to the box; pixels are what that height needs at dpi.
+    """
+    display_height_px = min(height, max_height_px)
+    pixel_height = min(height, round(display_height_px / SCREEN_DPI * dpi))
+    pixel_width = max(1, round(width * pixel_height / height))
+    return (pixel_width, pixel_height), display_height_px / SCREEN_DPI
+
+
+def _prepare_pillow(image_bytes, size, quality, progressive, dpi, max_pixels=SPECSHEET_IMAGE_MAX_PIXELS):
+    img = Image.open(BytesIO(image_bytes))
+    print(f"Image dimensions: {img.size[0]}x{img.size[1]} pixels, mode {img.mode}")
+
+    # JPEG: let the decoder scale down by 1/2, 1/4 or 1/8 while decoding
+    img.draft("RGB", size)
+    if img.size[0] * img.size[1] > max_pixels:
+        raise ImageTooLarge(f"{img.size[0]}x{img.size[1]} {img.format} would be decoded at full size (over {max_pixels} pixels)")
+
+    if img.mode not in ('RGB', 'L'):
+        print(f"Converting image from {img.mode} to RGB")
+        img = img.convert('RGB')
+
+    if img.size != size:
+        img = img.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+    output = BytesIO()
+    img.save(output, format='JPEG', quality=quality, optimize=True, progressive=progressive, dpi=(dpi, dpi))
+    return output
+
+
+def _prepare_vips(pyvips, image_bytes, size, quality, progressive, dpi):
+    img = pyvips.Image.thumbnail_buffer(image_bytes, size[0], height=size[1], size="down")
+    if img.hasalpha():
+        img = img.flatten(background=[255, 255, 255])
+    if img.interpretation not in ("srgb", "b-w"):
+        img = img.colourspace("srgb")
+    resolution = dpi / 25.4  # vips resolution is pixels per millimetre
+    img = img.copy(xres=resolution, yres=resolution)
+    return BytesIO(img.jpegsave_buffer(Q=quality, interlace=progressive, optimize_coding=True, strip=True))
+
+
+def prepare_image(image_bytes, max_height_px=MAX_DISPLAY_HEIGHT_PX, dpi=SPECSHEET_IMAGE_DPI, quality=SPECSHEET_IMAGE_QUALITY,
+                  progressive=SPECSHEET_IMAGE_PROGRESSIVE, backend=SPECSHEET_IMAGE_BACKEND):
+    """Returns (JPEG stream, display height in inches) for raw image bytes"""
+    with Image.open(BytesIO(image_bytes)) as probe:  # Header only, no decode
+        width, height = probe.size
+    size, height_inches = target_size(width, height, max_height_px, dpi)
+
+    pyvips = get_pyvips() if backend in ("auto", "vips") else None
+    if backend == "vips" and pyvips is None:
+        print("⚠️ pyvips is not available, using Pillow")
+
+    if pyvips is not None:
+        stream = _prepare_vips(pyvips, image_bytes, size, quality, progressive, dpi)
+    else:
+        stream = _prepare_pillow(image_bytes, size, quality, progressive, dpi)
+
+    print(f"Image resampled: {width}x{height} → {size[0]}x{size[1]} px, {height_inches:.2f} in tall, {stream.getbuffer().nbytes / 1024:.0f} KB")
+    stream.seek(0)
+    return stream, height_inches
@@ -0,0 +1,331 @@
+"""
+Persistent background jobs with graceful shutdown.
+
+BackgroundTasks live only in memory: a restart during a deploy drops whatever
+enquiry or sample request was still being processed. JobRunner records every
+job in STATE_DIR/jobs.db before running it in a thread, so on shutdown it can
+
+    - stop accepting new jobs (submit() raises AdmissionRejected 503),
+    - let running jobs finish until a deadline,
+    - leave jobs that have not started (or did not finish) in the table,
+
+and the next process picks them up again with resume(). Jobs are therefore
+run at least once; the integration calls they make go through the outbox.
+Resumed jobs are admitted through the admission controller their kind was
+registered with (those it rejects are left for the next pass), and a job
+that has already been started JOB_MAX_ATTEMPTS times is marked failed
+instead of being run again.
+
+The worker's peak RSS while a job runs is sampled every
+JOB_MEMORY_SAMPLE_SECONDS and stored with the job (peak_rss, rss_growth);
+growth over JOB_MEMORY_WARN_MB is logged. Jobs running at the same time share
+the process, so their figures overlap.
+
+    jobs = JobRunner()
+    jobs.register("contact", process_contact_request, ContactRequest, admission=admission["leads"])
+    job_id = jobs.submit("contact", validated_data, ticket=ticket)
+    jobs.get(job_id)   # {"status": "queued" | "running" | "done" | "failed", "result": ..., ...}
+
+What a handler returns (JSON-serializable, e.g. {"file": path}) is kept as the
+job's result.
+"""
+import json, os, socket, sqlite3, sys, threading, time, uuid
+
+from modules.admission_control import AdmissionRejected
+from modules.circuit_breaker import deadline
+from modules import tracing
+from modules.shared_state import connect, file_lock
+
+
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "7"))
+JOB_MEMORY_SAMPLE_SECONDS = float(os.getenv("JOB_MEMORY_SAMPLE_SECONDS", "0.25"))
+JOB_MEMORY_WARN_MB = int(os.getenv("JOB_MEMORY_WARN_MB", "256"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _db():
+    conn = connect("jobs")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            owner TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            result TEXT,
+            peak_rss INTEGER,
+            rss_growth INTEGER,
+            created REAL NOT NULL,
+            updated REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+    global _migrated
+    if not _migrated:
+        for column, kind in (("result", "TEXT"), ("peak_rss", "INTEGER"), ("rss_growth", "INTEGER")):
+            try:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")  # tables created before the column existed
+            except sqlite3.OperationalError:
+                pass
+        _migrated = True
+    return conn
+
+
+_migrated = False
+
+
+def rss_bytes() -> int:
+    """Resident memory of this process (the lifetime peak where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemoryWatch:
+    """Peak RSS per running job, sampled by one thread while any job is being watched"""
+
+    def __init__(self, interval=JOB_MEMORY_SAMPLE_SECONDS):
+        self.interval = interval
+        self.watched = {}  # job id -> (rss at start, peak rss)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, job_id):
+        rss = rss_bytes()
+        with self._lock:
+            self.watched[job_id] = (rss, rss)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="job-memory", daemon=True)
+                self._thread.start()
+
+    def stop(self, job_id):
+        """(rss at start, peak rss) of the job"""
+        rss = rss_bytes()
+        with self._lock:
+            start, peak = self.watched.pop(job_id)
+        return start, max(peak, rss)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            rss = rss_bytes()
+            with self._lock:
+                if not self.watched:
+                    self._thread = None
+                    return
+                for job_id, (start, peak) in self.watched.items():
+                    if rss > peak:
+                        self.watched[job_id] = (start, rss)
+
+
+def _owner_alive(owner: str) -> bool:
+    """Whether the process that owns a job is still running (on this host)"""
+    host, _, pid = (owner or "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+class JobRunner:
+
+    def __init__(self):
+        self._handlers = {}
+        self._admission = {}
+        self._active = set()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self.accepting = True
+        self.stopping = threading.Event()
+        self.abandoned = threading.Event()  # Drain deadline passed: jobs failing from here on are left to be resumed
+        self.memory = MemoryWatch()
+
+    def register(self, kind: str, handler, model=None, deadline_seconds=None, admission=None):
+        """
+        handler(data, **extra) -> result; data is rebuilt from its JSON with model.model_validate
+        when given. With deadline_seconds the external calls the job makes share that
+        budget (see modules/circuit_breaker). Resumed jobs are admitted through the
+        admission controller, like the requests that submit them.
+        """
+        self._handlers[kind] = (handler, model, deadline_seconds)
+        self._admission[kind] = admission
+
+    def submit(self, kind: str, data, ticket=None, **extra) -> str:
+        """Persist the job and start it; the admission ticket (if any) is held while it runs"""
+        if not self.accepting:
+            if ticket:
+                ticket.close()
+            raise AdmissionRejected(503, "Server is restarting, please retry shortly", 30)
+
+        payload = {"data": data.model_dump(mode="json") if hasattr(data, "model_dump") else data, "extra": extra}
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        try:
+            _db().execute(
+                "INSERT INTO jobs (id, kind, payload, owner, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), OWNER, now, now)
+            )
+        except Exception:
+            if ticket:
+                ticket.close()
+            raise
+        self._start(job_id, kind, payload, ticket, tracing.current())
+        return job_id
+
+    def _start(self, job_id, kind, payload, ticket, parent_span=None):
+        thread = threading.Thread(target=self._run, args=(job_id, kind, payload, ticket, parent_span), name=f"job-{kind}-{job_id[:8]}", daemon=True)
+        with self._lock:
+            self._active.add(job_id)
+        thread.start()
+
+    def _run(self, job_id, kind, payload, ticket, parent_span=None):
+        with tracing.span(f"job.{kind}", parent=parent_span, job_id=job_id) as job_span:
+            self._run_traced(job_id, kind, payload, ticket, job_span)
+
+    def _run_traced(self, job_id, kind, payload, ticket, job_span):
+        conn = _db()
+        try:
+            if ticket:
+                waiting = time.monotonic()
+                ticket.__enter__()  # Wait for a running slot
+                job_span.set(slot_wait_ms=round((time.monotonic() - waiting) * 1000, 1))
+            if self.stopping.is_set():
+                return  # Not started: stays queued for the next process
+
+            handler, model, deadline_seconds = self._handlers[kind]
+            data = model.model_validate(payload["data"]) if model else payload["data"]
+            conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, updated = ? WHERE id = ?", (time.time(), job_id))
+            self.memory.start(job_id)
+            try:
+                if deadline_seconds:
+                    with deadline(deadline_seconds):
+                        result = handler(data, **payload["extra"])
+                else:
+                    result = handler(data, **payload["extra"])
+                status, error = "done", None
+            except Exception as e:
+                print(f"❌ Job {kind} {job_id} failed: {e}")
+                status, error, result = "failed", f"{type(e).__name__}: {e}"[:2000], None
+            finally:
+                start_rss, peak_rss = self.memory.stop(job_id)
+
+            growth = peak_rss - start_rss
+            job_span.set(peak_rss_mb=round(peak_rss / 1048576, 1), rss_growth_mb=round(growth / 1048576, 1))
+            if growth > JOB_MEMORY_WARN_MB * 1048576:
+                print(f"⚠️ Job {kind} {job_id} grew the worker by {growth // 1048576} MB (peak RSS {peak_rss // 1048576} MB)")
+            if status == "failed" and self.abandoned.is_set():
+                print(f"Job {kind} {job_id} was cut off by the shutdown, left for the next start")
+                return  # Likely interrupted (e.g. its conversion was terminated): run again on the next start
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, result = ?, peak_rss = ?, rss_growth = ?, updated = ? WHERE id = ?",
+                (status, error, json.dumps(result, default=str) if result is not None else None, peak_rss, growth, time.time(), job_id)
+            )
+
+        finally:
+            if ticket:
+                ticket.close()
+            with self._lock:
+                self._active.discard(job_id)
+                self._idle.notify_all()
+
+    def resume(self) -> int:
+        """
+        Start the unfinished jobs of processes that are gone; returns how many. Jobs the
+        admission controller of their kind rejects stay with their old owner for the next pass.
+        """
+        if not self.accepting:
+            return 0
+        claimed = []
+        with file_lock("jobs-resume"):
+            conn = _db()
+            rows = conn.execute("SELECT id, kind, payload, owner, attempts FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+            for row in rows:
+                if row["owner"] == OWNER or _owner_alive(row["owner"]):
+                    continue
+                if row["attempts"] >= JOB_MAX_ATTEMPTS:
+                    print(f"❌ Job {row['kind']} {row['id']} failed: interrupted {row['attempts']} times")
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', error = ?, owner = ?, updated = ? WHERE id = ?",
+                        (f"Interrupted after {row['attempts']} attempts", OWNER, time.time(), row["id"])
+                    )
+                    continue
+                if row["kind"] not in self._handlers:
+                    print(f"⚠️ No handler for resumed job {row['kind']} {row['id']}")
+                    continue
+                controller = self._admission.get(row["kind"])
+                try:
+                    ticket = controller.admit() if controller else None
+                except AdmissionRejected:
+                    continue
+                conn.execute("UPDATE jobs SET status = 'queued', owner = ?, updated = ? WHERE id = ?", (OWNER, time.time(), row["id"]))
+                claimed.append((row, ticket))
+
+        for row, ticket in claimed:
+            self._start(row["id"], row["kind"], json.loads(row["payload"]), ticket)
+        if claimed:
+            print(f"✓ Resumed {len(claimed)} unfinished jobs")
+        return len(claimed)
+
+    def shutdown(self, deadline: float) -> int:
+        """
+        Stop accepting jobs and wait up to `deadline` seconds for running ones.
+        Jobs still waiting for a slot are not started. Returns how many jobs
+        were left unfinished (they resume on the next start).
+        """
+        self.accepting = False
+        self.stopping.set()
+        end = time.monotonic() + deadline
+        with self._lock:
+            while self._active and time.monotonic() < end:
+                self._idle.wait(end - time.monotonic())
+            left = len(self._active)
+        if left:
+            self.abandoned.set()
+        print(f"Job runner stopped, {left} unfinished jobs persisted for the next start" if left else "✓ Job runner drained")
+        return left
+
+    def get(self, job_id: str):
+        """The job's status, error and result (not its payload), or None when unknown or purged"""
+        row = _db().execute(
+            "SELECT id, kind, status, attempts, error, result, created, updated FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(row["result"]) if row["result"] else None
+        return job
+
+    def active(self) -> int:
+        with self._lock:
+            return len(self._active)
+
+    def memory_stats(self, hours: int = 24) -> dict:
+        """Peak RSS and growth per job kind over the last `hours`, in MB"""
+        rows = _db().execute(
+            "SELECT kind, COUNT(*) AS jobs, MAX(peak_rss) AS peak, AVG(rss_growth) AS avg_growth, MAX(rss_growth) AS max_growth "
+            "FROM jobs WHERE peak_rss IS NOT NULL AND updated > ? GROUP BY kind",
+            (time.time() - hours * 3600,)
+        ).fetchall()
+        return {row["kind"]: {
+            "jobs": row["jobs"],
+            "peak_rss_mb": round(row["peak"] / 1048576, 1),
+            "avg_growth_mb": round(row["avg_growth"] / 1048576, 1),
+            "max_growth_mb": round(row["max_growth"] / 1048576, 1),
+        } for row in rows}
+
+    def purge(self, days: int = JOB_RETENTION_DAYS) -> int:
+        cursor = _db().execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?", (time.time() - days * 86400,))
+        return cursor.rowcount
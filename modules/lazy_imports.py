@@ -0,0 +1,70 @@
+"""
+Lazy loading for the heavy third-party dependencies.
+
+    docxtpl = lazy_import("docxtpl")
+    ...
+    doc = docxtpl.DocxTemplate(path)    # docxtpl is imported here, on first use
+
+Importing a module that only declares lazy dependencies is nearly free, so the
+newsletter/contact endpoints never pay for the PDF or Google stacks. warm_up()
+imports everything that has been declared, e.g. at readiness time or in the
+gunicorn master before forking workers.
+"""
+import importlib, threading, time
+
+
+_registry = {}
+_lock = threading.RLock()
+
+
+class LazyModule:
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self.load_seconds = None
+
+    def _load(self):
+        if self._module is None:
+            with _lock:
+                if self._module is None:
+                    start = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    self.load_seconds = time.perf_counter() - start
+                    self._module = module
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    """Return a proxy that imports the module on first attribute access"""
+    with _lock:
+        if name not in _registry:
+            _registry[name] = LazyModule(name)
+        return _registry[name]
+
+
+def warm_up() -> dict:
+    """Import every declared lazy module; returns {module: seconds spent importing}"""
+    timings = {}
+    for name, module in list(_registry.items()):
+        try:
+            module._load()
+            timings[name] = module.load_seconds or 0.0
+        except Exception as e:
+            print(f"Warm-up failed for {name}: {e}")
+    return timings
+
+
+def status() -> dict:
+    return {name: module.loaded for name, module in _registry.items()}
@@ -0,0 +1,270 @@
+"""
+Persistent outbox for integration calls (Google Sheets, Salesforce, Gmail).
+
+Every call is recorded before it is attempted and marked done once it
+succeeded, so nothing is lost during a Google or Salesforce outage:
+
+    outbox.register("sheets.append", handler, batch_handler=...)
+    outbox.deliver("sheets.append", {"sheet_id": ..., "sheet_name": ..., "row": [...]})
+
+A handler receives the payload and returns True on success (a False return or
+an exception marks the entry failed). Failed entries are retried with
+exponential backoff by replay(), which drains the backlog in batches, grouped
+through the kind's batch_handler when one exists, and rate limited.
+
+Usage (handlers are registered by app.py, which the CLI imports):
+    python -m modules.outbox list --status failed
+    python -m modules.outbox show 42
+    python -m modules.outbox retry 42 43
+    python -m modules.outbox replay --batch-size 50 --rate 5
+    python -m modules.outbox purge --days 30
+"""
+import argparse, json, os, sys, time
+
+from modules.shared_state import connect, file_lock
+from modules.tracing import span
+
+
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 3600
+# A "pending" entry older than this was interrupted (crash, restart) and is retried
+STALE_PENDING_SECONDS = 900
+
+_handlers = {}
+
+
+def _db():
+    conn = connect("outbox")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created REAL NOT NULL,
+            updated REAL NOT NULL,
+            next_attempt REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status, next_attempt)")
+    return conn
+
+
+def register(kind: str, handler, batch_handler=None):
+    """
+    handler(payload) -> bool. batch_handler(payloads) -> bool, optional, used by
+    replay() for entries of the same kind and batch_key(payload).
+    """
+    _handlers[kind] = {"handler": handler, "batch_handler": batch_handler}
+
+
+def record(kind: str, payload: dict) -> int:
+    now = time.time()
+    cursor = _db().execute(
+        "INSERT INTO outbox (kind, payload, created, updated, next_attempt) VALUES (?, ?, ?, ?, ?)",
+        (kind, json.dumps(payload), now, now, now)
+    )
+    return cursor.lastrowid
+
+
+def mark_done(entry_ids):
+    conn = _db()
+    now = time.time()
+    conn.executemany("UPDATE outbox SET status = 'done', attempts = attempts + 1, last_error = NULL, updated = ? WHERE id = ?", [(now, entry_id) for entry_id in entry_ids])
+
+
+def mark_failed(entry_ids, error: str):
+    conn = _db()
+    now = time.time()
+    for entry_id in entry_ids:
+        row = conn.execute("SELECT attempts FROM outbox WHERE id = ?", (entry_id,)).fetchone()
+        attempts = (row["attempts"] if row else 0) + 1
+        delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+        status = "dead" if attempts >= OUTBOX_MAX_ATTEMPTS else "failed"
+        conn.execute(
+            "UPDATE outbox SET status = ?, attempts = ?, last_error = ?, updated = ?, next_attempt = ? WHERE id = ?",
+            (status, attempts, error[:2000], now, now + delay, entry_id)
+        )
+
+
+def _attempt(kind, entry_ids, payloads):
+    registered = _handlers.get(kind)
+    if not registered:
+        mark_failed(entry_ids, f"No handler registered for {kind}")
+        return False
+
+    try:
+        if len(payloads) > 1 and registered["batch_handler"]:
+            success = registered["batch_handler"](payloads)
+        else:
+            success = all([registered["handler"](payload) for payload in payloads])
+        error = None if success else "Handler reported failure"
+
+    except Exception as e:
+        success, error = False, f"{type(e).__name__}: {e}"
+
+    if success:
+        mark_done(entry_ids)
+    else:
+        print(f"Outbox {kind} {entry_ids} failed: {error}")
+        mark_failed(entry_ids, error)
+    return success
+
+
+def deliver(kind: str, payload: dict) -> bool:
+    """Record the call, attempt it right away, and keep it for replay if it fails"""
+    with span("outbox.deliver", kind=kind) as delivering:
+        entry_id = record(kind, payload)
+        success = _attempt(kind, [entry_id], [payload])
+        delivering.set(entry_id=entry_id, success=success)
+        return success
+
+
+def batch_key(payload: dict):
+    """Entries of one kind are batched together when these fields match"""
+    return payload.get("sheet_id"), payload.get("sheet_name")
+
+
+def replay(batch_size: int = 50, rate: float = 5.0, kinds=None, limit=None) -> dict:
+    """
+    Retry due failed (and interrupted) entries, oldest first. Entries sharing a
+    kind and batch_key are sent through the kind's batch_handler in groups of
+    batch_size; at most `rate` handler calls are made per second.
+    """
+    from modules.admission_control import TokenBucket
+
+    stats = {"done": 0, "failed": 0}
+    bucket = TokenBucket(rate, max(1, int(rate)))
+
+    with file_lock("outbox-replay"):
+        now = time.time()
+        query = """
+            SELECT id, kind, payload FROM outbox
+            WHERE (status = 'failed' AND next_attempt <= ?) OR (status = 'pending' AND updated < ?)
+        """
+        params = [now, now - STALE_PENDING_SECONDS]
+        if kinds:
+            query += f" AND kind IN ({','.join('?' * len(kinds))})"
+            params += list(kinds)
+        query += " ORDER BY id"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        rows = _db().execute(query, params).fetchall()
+
+        groups = {}
+        for row in rows:
+            payload = json.loads(row["payload"])
+            registered = _handlers.get(row["kind"], {})
+            key = (row["kind"], batch_key(payload)) if registered.get("batch_handler") else (row["kind"], row["id"])
+            groups.setdefault(key, []).append((row["id"], payload))
+
+        for (kind, _), entries in groups.items():
+            for i in range(0, len(entries), batch_size):
+                chunk = entries[i:i + batch_size]
+                wait = bucket.take()
+                while wait:
+                    time.sleep(wait)
+                    wait = bucket.take()
+                success = _attempt(kind, [entry_id for entry_id, _ in chunk], [payload for _, payload in chunk])
+                stats["done" if success else "failed"] += len(chunk)
+
+    return stats
+
+
+def retry(entry_ids) -> dict:
+    """Attempt the given entries now, whatever their status"""
+    stats = {"done": 0, "failed": 0}
+    for entry_id in entry_ids:
+        row = _db().execute("SELECT kind, payload FROM outbox WHERE id = ?", (entry_id,)).fetchone()
+        if not row:
+            print(f"Entry {entry_id} not found")
+            continue
+        success = _attempt(row["kind"], [entry_id], [json.loads(row["payload"])])
+        stats["done" if success else "failed"] += 1
+    return stats
+
+
+def purge(days: int) -> int:
+    cursor = _db().execute("DELETE FROM outbox WHERE status = 'done' AND updated < ?", (time.time() - days * 86400,))
+    return cursor.rowcount
+
+
+def counts() -> dict:
+    rows = _db().execute("SELECT status, COUNT(*) AS n FROM outbox GROUP BY status").fetchall()
+    return {row["status"]: row["n"] for row in rows}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and replay the integration outbox")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    list_cmd = sub.add_parser("list", help="List entries")
+    list_cmd.add_argument("--status", choices=["pending", "failed", "dead", "done"])
+    list_cmd.add_argument("--kind")
+    list_cmd.add_argument("--limit", type=int, default=50)
+
+    show_cmd = sub.add_parser("show", help="Show one entry with its payload")
+    show_cmd.add_argument("id", type=int)
+
+    retry_cmd = sub.add_parser("retry", help="Attempt entries now")
+    retry_cmd.add_argument("ids", type=int, nargs="+")
+
+    replay_cmd = sub.add_parser("replay", help="Drain due failed entries")
+    replay_cmd.add_argument("--batch-size", type=int, default=50)
+    replay_cmd.add_argument("--rate", type=float, default=5.0, help="Handler calls per second")
+    replay_cmd.add_argument("--kind", action="append")
+    replay_cmd.add_argument("--limit", type=int)
+    replay_cmd.add_argument("--all", action="store_true", help="Ignore backoff, including dead entries")
+
+    purge_cmd = sub.add_parser("purge", help="Delete done entries")
+    purge_cmd.add_argument("--days", type=int, default=30)
+
+    args = parser.parse_args(argv)
+
+    if args.command in ("retry", "replay"):
+        import app  # noqa: F401 - registers the handlers
+
+    if args.command == "list":
+        query, params = "SELECT id, kind, status, attempts, last_error, created FROM outbox WHERE 1 = 1", []
+        if args.status:
+            query += " AND status = ?"
+            params.append(args.status)
+        if args.kind:
+            query += " AND kind = ?"
+            params.append(args.kind)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(args.limit)
+        print(f"Totals: {counts()}")
+        for row in _db().execute(query, params).fetchall():
+            created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row["created"]))
+            print(f"{row['id']:>6}  {created}  {row['kind']:<18} {row['status']:<8} attempts={row['attempts']}  {row['last_error'] or ''}")
+
+    elif args.command == "show":
+        row = _db().execute("SELECT * FROM outbox WHERE id = ?", (args.id,)).fetchone()
+        if not row:
+            print(f"Entry {args.id} not found")
+            return 1
+        entry = dict(row)
+        entry["payload"] = json.loads(entry["payload"])
+        print(json.dumps(entry, indent=2, ensure_ascii=False))
+
+    elif args.command == "retry":
+        print(retry(args.ids))
+
+    elif args.command == "replay":
+        if args.all:
+            _db().execute("UPDATE outbox SET status = 'failed', next_attempt = 0 WHERE status IN ('failed', 'dead')")
+        print(replay(batch_size=args.batch_size, rate=args.rate, kinds=args.kind, limit=args.limit))
+
+    elif args.command == "purge":
+        print(f"Deleted {purge(args.days)} entries")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
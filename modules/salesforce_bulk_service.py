@@ -0,0 +1,208 @@
+import os, threading
+from typing import Dict, List, Optional
+
+from modules.lazy_imports import lazy_import
+from modules.salesforce_service import SalesforceWebToLeadService
+from modules.circuit_breaker import breaker, remaining
+from modules.tracing import span
+
+
+requests = lazy_import("requests")
+
+
+class _PendingLead:
+    def __init__(self, record: Dict):
+        self.record = record
+        self.done = threading.Event()
+        self.result = None
+
+
+class SalesforceBulkLeadService(SalesforceWebToLeadService):
+    """
+    Same insert_* interface as SalesforceWebToLeadService, but leads are buffered
+    and created in bulk through the REST sObject Collections API (up to 200
+    records per call) instead of one Web-to-Lead POST each. That avoids the
+    Web-to-Lead daily cap and the per-request overhead.
+
+    The buffer is flushed every flush_interval seconds or as soon as batch_size
+    leads are waiting. Each insert_* call blocks until its batch is flushed and
+    returns its own record's result ({"success", "id"} or {"success": False,
+    "errors"}), so callers such as the outbox keep per-lead outcomes. Pass
+    wait=False to return immediately with {"success": True, "queued": True}.
+    A caller that stops waiting (timeout, deadline) takes its lead back out of
+    the buffer and gets a failure to retry; a lead already being sent by then
+    is reported as queued, so it is never sent twice.
+
+    The flusher thread is started on first use in each process: the app may be
+    imported by the gunicorn master and forked into the workers.
+
+    Configured from the environment:
+        SF_INSTANCE_URL                      e.g. https://bigtree.my.salesforce.com (or a local mock server)
+        SF_ACCESS_TOKEN                      static token, or
+        SF_CLIENT_ID / SF_CLIENT_SECRET      OAuth client-credentials flow
+        SF_FIELD_PROJECT, SF_FIELD_NOTES, SF_FIELD_QUANTITY, SF_FIELD_OTHER_PRODUCTS
+                                             API names of the Lead custom fields
+    """
+    API_VERSION = "v60.0"
+    MAX_BATCH = 200  # sObject Collections limit
+
+    # Web-to-Lead form names -> Lead API field names
+    STANDARD_FIELDS = {
+        "first_name": "FirstName",
+        "last_name": "LastName",
+        "email": "Email",
+        "mobile": "MobilePhone",
+        "company": "Company",
+        "country_code": "CountryCode",
+    }
+
+    def __init__(self, instance_url: str = None, access_token: str = None, client_id: str = None, client_secret: str = None,
+                 flush_interval: float = 5.0, batch_size: int = 200, wait: bool = True, timeout: int = 30, lead_source: Optional[str] = "Website"):
+        super().__init__()
+        self.instance_url = (instance_url or os.getenv("SF_INSTANCE_URL", "")).rstrip("/")
+        self.access_token = access_token or os.getenv("SF_ACCESS_TOKEN")
+        self.client_id = client_id or os.getenv("SF_CLIENT_ID")
+        self.client_secret = client_secret or os.getenv("SF_CLIENT_SECRET")
+        self.flush_interval = flush_interval
+        self.batch_size = min(batch_size, self.MAX_BATCH)
+        self.wait = wait
+        self.timeout = timeout
+        self.lead_source = lead_source
+
+        # Custom fields, keyed by their Web-to-Lead ids
+        self.custom_fields = {
+            self.FIELD_PROJECT: os.getenv("SF_FIELD_PROJECT", "Project__c"),
+            self.FIELD_NOTES: os.getenv("SF_FIELD_NOTES", "General_Notes__c"),
+            "00NWS000006nIef": os.getenv("SF_FIELD_QUANTITY", "Quantity__c"),
+            "00N4I00000EzMsr": os.getenv("SF_FIELD_OTHER_PRODUCTS", "Other_Product_Interest__c"),
+        }
+
+        self._buffer: List[_PendingLead] = []
+        self._lock = threading.Condition()
+        self._session = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_flusher(self):
+        # Started lazily, and again in each forked worker (threads do not survive fork)
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._buffer, self._lock, self._session = [], threading.Condition(), None
+                    threading.Thread(target=self._flush_loop, name="salesforce-bulk-flush", daemon=True).start()
+
+    # ------------------------------------------------------------------
+    # Buffering
+    # ------------------------------------------------------------------
+    def to_lead_record(self, data: Dict) -> Dict:
+        record = {"attributes": {"type": "Lead"}}
+        if self.lead_source:
+            record["LeadSource"] = self.lead_source
+        for key, value in data.items():
+            if value is None:
+                continue
+            field = self.STANDARD_FIELDS.get(key) or self.custom_fields.get(key)
+            if field:
+                record[field] = value
+            else:
+                print(f"Salesforce bulk: no Lead field mapped for '{key}', skipped")
+        return record
+
+    def _submit(self, data: Dict) -> Dict:
+        self._ensure_flusher()
+        pending = _PendingLead(self.to_lead_record(data))
+        with self._lock:
+            self._buffer.append(pending)
+            if len(self._buffer) >= self.batch_size:
+                self._lock.notify()
+
+        if not self.wait:
+            return {"success": True, "queued": True}
+
+        # Flush interval + one API call, or what is left of the caller's deadline
+        wait = self.flush_interval + self.timeout * 2 + 5
+        left = remaining()
+        with span("salesforce.bulk_wait") as waiting:
+            done = pending.done.wait(wait if left is None else max(0, min(wait, left)))
+            waiting.set(success=bool(done and pending.result.get("success")))
+        if not done:
+            with self._lock:
+                if pending in self._buffer:
+                    self._buffer.remove(pending)
+                    return {"success": False, "error": "Timed out waiting for the bulk flush (not sent)"}
+            return {"success": True, "queued": True}  # In the batch being sent: its outcome is only logged
+        return pending.result
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                self._lock.wait_for(lambda: len(self._buffer) >= self.batch_size, timeout=self.flush_interval)
+                batch, self._buffer = self._buffer[:self.batch_size], self._buffer[self.batch_size:]
+            if batch:
+                self._send_batch(batch)
+
+    def flush(self):
+        """Send everything buffered right now (e.g. on shutdown)"""
+        while True:
+            with self._lock:
+                batch, self._buffer = self._buffer[:self.batch_size], self._buffer[self.batch_size:]
+            if not batch:
+                return
+            self._send_batch(batch)
+
+    # ------------------------------------------------------------------
+    # REST API
+    # ------------------------------------------------------------------
+    def _authenticate(self):
+        if self.client_id and self.client_secret:
+            response = requests.post(f"{self.instance_url}/services/oauth2/token", data={
+                "grant_type": "client_credentials",
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+            }, timeout=self.timeout)
+            response.raise_for_status()
+            self.access_token = response.json()["access_token"]
+        if not self.access_token:
+            raise RuntimeError("No Salesforce credentials: set SF_ACCESS_TOKEN or SF_CLIENT_ID/SF_CLIENT_SECRET")
+
+    def _post_records(self, records: List[Dict]):
+        if self._session is None:
+            self._session = requests.Session()
+        if not self.access_token:
+            self._authenticate()
+
+        url = f"{self.instance_url}/services/data/{self.API_VERSION}/composite/sobjects"
+        body = {"allOrNone": False, "records": records}
+        for attempt in range(2):
+            response = self._session.post(url, json=body, headers={"Authorization": f"Bearer {self.access_token}"}, timeout=self.timeout)
+            if response.status_code == 401 and attempt == 0 and self.client_id:
+                self._authenticate()  # Expired token
+                continue
+            return response
+
+    def _send_batch(self, batch: List[_PendingLead]):
+        try:
+            with breaker("salesforce").guard() as call:
+                response = self._post_records([pending.record for pending in batch])
+                if response.status_code >= 500:
+                    call.failed(f"HTTP {response.status_code}")
+            if response.status_code != 200:
+                results = [{"success": False, "status_code": response.status_code, "error": response.text[:1000]}] * len(batch)
+            else:
+                # One result per record, in request order
+                results = []
+                for item in response.json():
+                    if item.get("success"):
+                        results.append({"success": True, "id": item.get("id")})
+                    else:
+                        results.append({"success": False, "errors": item.get("errors", [])})
+
+        except Exception as e:
+            results = [{"success": False, "error": str(e)}] * len(batch)
+
+        failed = sum(1 for result in results if not result["success"])
+        print(f"Salesforce bulk flush: {len(batch) - failed} leads created, {failed} failed")
+        for pending, result in zip(batch, results):
+            pending.result = dict(result)
+            pending.done.set()
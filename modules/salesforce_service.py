@@ -1,6 +1,15 @@
-import requests
+import os
 from typing import Dict, Optional, List, Union
 
+from modules.lazy_imports import lazy_import
+from modules.circuit_breaker import breaker, timeout_for
+from modules.tracing import span
+
+
+requests = lazy_import("requests")
+
+SALESFORCE_TIMEOUT = float(os.getenv("SALESFORCE_TIMEOUT", "10"))  # seconds per call, further bounded by the job deadline
+
 class SalesforceWebToLeadService:
     # Constants based on your HTML Form
     ORG_ID = "00D58000000YppW"
@@ -38,7 +47,12 @@ class SalesforceWebToLeadService:
         payload.update(data)
 
         try:
-            response = requests.post(self.ENDPOINT, data=payload)
+            timeout = timeout_for(SALESFORCE_TIMEOUT)
+            with span("salesforce.web_to_lead") as submitting, breaker("salesforce").guard() as call:
+                response = requests.post(self.ENDPOINT, data=payload, timeout=timeout)
+                submitting.set(http_status_code=response.status_code)
+                if response.status_code >= 500:
+                    call.failed(f"HTTP {response.status_code}")
             
             # Web-to-Lead usually returns 200 OK (and creates a redirect) even on some failures.
             # Real validation errors are only visible via email in Debug Mode.
@@ -0,0 +1,122 @@
+"""
+State shared between the worker processes of a multi-worker deployment.
+
+Everything in here lives on the local disk under STATE_DIR, so it is safe to
+use from several forked workers (and from threads inside each worker):
+
+- connect(name): SQLite connection (WAL mode) to STATE_DIR/<name>.db, one per
+  thread and re-opened automatically after a fork.
+- file_lock(name): exclusive inter-process lock.
+- SharedSemaphore(name, slots): N inter-process slots, e.g. to bound the number
+  of LibreOffice conversions machine-wide regardless of the worker count.
+"""
+import os, sqlite3, threading, time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: locks only cover the current process
+    fcntl = None
+
+
+STATE_DIR = os.getenv("STATE_DIR", "files/state")
+
+_local = threading.local()
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+def state_path(*parts):
+    path = os.path.join(STATE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def connect(name: str) -> sqlite3.Connection:
+    """Per-thread, per-process connection to STATE_DIR/<name>.db"""
+    connections = getattr(_local, "connections", None)
+    if connections is None or _local.pid != os.getpid():
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+
+    conn = connections.get(name)
+    if conn is None:
+        conn = sqlite3.connect(state_path(f"{name}.db"), timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        connections[name] = conn
+    return conn
+
+
+def _thread_lock(path):
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(path, threading.Lock())
+
+
+@contextmanager
+def file_lock(name: str):
+    """Exclusive lock across threads and worker processes"""
+    path = state_path("locks", f"{name}.lock")
+    with _thread_lock(path):
+        with open(path, "a") as handle:
+            if fcntl:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+class SharedSemaphore:
+    """
+    Counting semaphore across worker processes, built from one lock file per slot.
+    Entering returns the slot number, so callers can keep per-slot resources
+    (such as a LibreOffice profile directory) that are never used concurrently.
+    """
+
+    def __init__(self, name: str, slots: int, poll_interval: float = 0.2):
+        self.name = name
+        self.slots = slots
+        self.poll_interval = poll_interval
+        self._held = threading.local()
+
+    def _try_slot(self, slot):
+        path = state_path("locks", f"{self.name}.{slot}.lock")
+        thread_lock = _thread_lock(path)
+        if not thread_lock.acquire(blocking=False):
+            return None
+        handle = open(path, "a")
+        if fcntl:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                thread_lock.release()
+                return None
+        return handle, thread_lock
+
+    def acquire(self) -> int:
+        while True:
+            for slot in range(self.slots):
+                held = self._try_slot(slot)
+                if held:
+                    self._held.slot = (slot,) + held
+                    return slot
+            time.sleep(self.poll_interval)
+
+    def release(self):
+        slot, handle, thread_lock = self._held.slot
+        if fcntl:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+        handle.close()
+        thread_lock.release()
+        self._held.slot = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
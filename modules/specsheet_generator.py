@@ -1,42 +1,70 @@
-from docxtpl import DocxTemplate, InlineImage
-from docx.shared import Inches, Mm
-import subprocess, re, os, requests, platform
-from io import BytesIO
-from PIL import Image
-from woocommerce import API
+import subprocess, re, os, platform, html, shutil, signal, tempfile, threading, time
+from functools import lru_cache
 
+from modules.lazy_imports import lazy_import
+from modules.shared_state import SharedSemaphore, state_path
+from modules.image_pipeline import prepare_image, ImageTooLarge
+from modules.specsheet_templates import resolve_template
+from modules.circuit_breaker import breaker, timeout_for, CircuitOpen, DeadlineExceeded
+from modules.tracing import span, traced, annotate
 
 
+# Heavy dependencies, imported on first use
+docxtpl = lazy_import("docxtpl")
+docx = lazy_import("docx")
+docx_shared = lazy_import("docx.shared")
+docxcompose = lazy_import("docxcompose.composer")
+requests = lazy_import("requests")
+
+
+# LibreOffice conversions allowed at once across all worker processes
+MAX_CONCURRENT_CONVERSIONS = int(os.getenv("MAX_CONCURRENT_CONVERSIONS", "2"))
+conversion_slots = SharedSemaphore("libreoffice", MAX_CONCURRENT_CONVERSIONS)
+# Bulk exports convert from a pool of their own, so a running export never takes the slots of live requests
+MAX_CONCURRENT_EXPORT_CONVERSIONS = int(os.getenv("MAX_CONCURRENT_EXPORT_CONVERSIONS", "2"))
+export_conversion_slots = SharedSemaphore("libreoffice-export", MAX_CONCURRENT_EXPORT_CONVERSIONS)
+
+IMAGE_TIMEOUT = float(os.getenv("IMAGE_TIMEOUT", "10"))  # seconds per product image download attempt
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(25 * 1024 * 1024)))  # larger product images are skipped
+
+
+
+BR_TAG = re.compile(r'<br\s*/?>')
+PARAGRAPH_BREAK = re.compile(r'</p>\s*<p>')
+HTML_TAG = re.compile(r'<[^>]+>')
+HTML_ENTITY = re.compile(r'&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[A-Za-z][A-Za-z0-9]*);')
+SPACES = re.compile(r'  +')  # Runs only: single spaces are left alone
+ENTITY_TEXT = {'&nbsp;': ' '}  # Decoded entities, filled as they are seen
+
+
+def _decode_entity(match):
+    entity = match.group()
+    text = ENTITY_TEXT.get(entity)
+    if text is None:
+        text = ENTITY_TEXT[entity] = html.unescape(entity).replace('\xa0', ' ')
+    return text
+
+
+@lru_cache(maxsize=1024)
 def strip_html_tags(text):
     """Remove HTML tags from text and clean up formatting"""
     if not text:
         return ''
-    # Remove HTML tags but preserve line breaks
-    clean = re.sub(r'<br\s*/?>', '\n', text)  # Convert <br> to newlines
-    clean = re.sub(r'</p>\s*<p>', '\n\n', clean)  # Convert paragraph breaks to double newlines
-    clean = re.sub(r'<[^>]+>', '', clean)  # Remove all other HTML tags
-    # Replace HTML entities
-    clean = clean.replace('&nbsp;', ' ')
-    clean = clean.replace('&amp;', '&')
-    clean = clean.replace('&lt;', '<')
-    clean = clean.replace('&gt;', '>')
-    # Clean up \r\n to just \n
-    clean = clean.replace('\\r\\n', '\n')
-    clean = clean.replace('\r\n', '\n')
-    clean = clean.replace('\\n', '\n')
-    # Clean up multiple spaces but preserve newlines
-    clean = re.sub(r' +', ' ', clean)
-    # Remove excessive newlines (more than 2 consecutive newlines)
-    clean = re.sub(r'\n{3,}', '\n\n', clean)
-    # Remove trailing newlines at the end of each line
-    clean = re.sub(r'\n\s*\n', '\n\n', clean)
-    # Remove leading/trailing whitespace on each line
-    lines = clean.split('\n')
-    lines = [line.strip() for line in lines]
-    # Remove empty lines at the start and end, keep max 1 blank line between content
+    clean = text
+    if '<' in clean:
+        clean = BR_TAG.sub('\n', clean)
+        clean = PARAGRAPH_BREAK.sub('\n\n', clean)
+        clean = HTML_TAG.sub('', clean)
+    clean = clean.replace('\\r\\n', '\n').replace('\r\n', '\n').replace('\\n', '\n')
+    if '&' in clean:
+        clean = HTML_ENTITY.sub(_decode_entity, clean)
+    clean = SPACES.sub(' ', clean)
+
+    # Strip each line, keep max 1 blank line between content
     cleaned_lines = []
     prev_empty = False
-    for line in lines:
+    for line in clean.split('\n'):
+        line = line.strip()
         if not line:
             if not prev_empty and cleaned_lines:  # Allow one blank line
                 cleaned_lines.append(line)
@@ -44,286 +72,142 @@ def strip_html_tags(text):
         else:
             cleaned_lines.append(line)
             prev_empty = False
-    
+
     # Join and strip final result
     return '\n'.join(cleaned_lines).strip()
 
 
-# Global WooCommerce API instance
-wcapi = None
+def get_template_by_category(product, wc_url=None, wc_key=None, wc_secret=None):
+    """
+    Template file path for the product, from the category table compiled from
+    SPECSHEET_TEMPLATES_FILE (see modules/specsheet_templates).
+    """
+    with span("template.resolve", product_id=product.get('id')) as resolving:
+        template, fallback = resolve_template(product, wc_url, wc_key, wc_secret)
+        resolving.set(template=os.path.basename(template), fallback=fallback)
+    categories_info = [(cat.get('name'), cat.get('id')) for cat in product.get('categories', [])]
+    if fallback:
+        print(f"⚠️ No template mapped for product {product.get('id', 'N/A')} (categories: {categories_info}) - using {template}")
+    else:
+        print(f"✓ Template for product {product.get('id', 'N/A')}: {template}")
+    return template
+
+
+def get_meta_value(meta_data, key, clean_html=False):
+    """Extract a meta_data value by key, optionally stripping HTML"""
+    for item in meta_data:
+        if item.get('key') == key:
+            value = item.get('value', '')
+            # Return the value as-is, even if it's "n/a"
+            result = value if value else 'N/A'
+            # Clean HTML if requested
+            if clean_html and result != 'N/A':
+                result = strip_html_tags(result)
+            return result
+    return 'N/A'
+
+
+def get_attribute_options(attributes, attr_name):
+    """Extract attribute options as a comma separated string"""
+    for attr in attributes:
+        if attr.get('name') == attr_name or attr.get('slug') == attr_name:
+            options = attr.get('options', [])
+            return ', '.join(options) if options else 'n/a'
+    return 'n/a'
 
-def init_woocommerce_api(url, consumer_key, consumer_secret):
-    """Initialize WooCommerce API with provided credentials"""
-    global wcapi
-    if wcapi is None:
-        wcapi = API(
-            url=url,
-            consumer_key=consumer_key,
-            consumer_secret=consumer_secret,
-            version="wc/v3",
-            timeout=10
-        )
-    return wcapi
 
-def get_root_parent_category(category_id):
+@traced("docx.load")
+def load_template(template_path):
+    """Load the DOCX template (needed before an InlineImage can be created)"""
+    print(f"\nLoading template: {template_path}")
+    doc = docxtpl.DocxTemplate(template_path)
+    print("✓ Template loaded successfully")
+    return doc
+
+
+def fetch_image(image_url, verify=True):
     """
-    Recursively find the root parent category by querying the WooCommerce API.
-    Returns the root category object.
+    One GET through the images circuit breaker, bounded by IMAGE_TIMEOUT and the
+    current deadline. The body is read in chunks and abandoned past IMAGE_MAX_BYTES.
     """
-    global wcapi
-    
-    if wcapi is None:
-        print("  ⚠️ WooCommerce API not initialized, cannot fetch parent category")
+    timeout = timeout_for(IMAGE_TIMEOUT)
+    with span("image.download", url=image_url, verify=verify) as downloading:
+        with breaker("images").guard() as call:
+            response = requests.get(image_url, timeout=timeout, verify=verify, stream=True)
+            try:
+                if response.status_code >= 500:
+                    call.failed(f"HTTP {response.status_code}")
+                content = _read_limited(response, IMAGE_MAX_BYTES) if response.ok else b""
+            finally:
+                response.close()
+        downloading.set(http_status_code=response.status_code, bytes=len(content) if content is not None else None)
+        response.raise_for_status()
+        if content is None:
+            raise ImageTooLarge(f"Image is over IMAGE_MAX_BYTES ({IMAGE_MAX_BYTES // 1024} KB), skipped")
+        return content
+
+
+def _read_limited(response, max_bytes):
+    """The streamed body, or None as soon as it is known to be over max_bytes"""
+    if int(response.headers.get("Content-Length") or 0) > max_bytes:
         return None
-    
-    try:
-        # Get category details from API
-        response = wcapi.get(f"products/categories/{category_id}")
-        
-        if response.status_code != 200:
-            print(f"  ❌ API error fetching category {category_id}: {response.status_code}")
+    chunks, size = [], 0
+    for chunk in response.iter_content(256 * 1024):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > max_bytes:
             return None
-            
-        category = response.json()
-        parent_id = category.get('parent', 0)
-        
-        # If no parent, this IS the root category
-        if parent_id == 0:
-            print(f"  ✓ Found root category: {category.get('name')} (ID: {category_id})")
-            return category
-        
-        # Otherwise, recursively check the parent
-        print(f"  → Category '{category.get('name')}' has parent ID {parent_id}, checking parent...")
-        return get_root_parent_category(parent_id)
-        
+    return b"".join(chunks)
+
+
+def download_image(image_url):
+    """Download the product image, retrying without SSL verification on failure"""
+    print(f"Downloading image from: {image_url}")
+    try:
+        return fetch_image(image_url)
+
+    except (CircuitOpen, DeadlineExceeded, ImageTooLarge):
+        raise  # Skip the image rather than wait for a second attempt
     except Exception as e:
-        print(f"  ❌ Error fetching category {category_id}: {e}")
-        return None
+        print(f"❌ Error downloading image (attempt 1): {e}")
+        print("Retrying without SSL verification...")
+        return fetch_image(image_url, verify=False)
 
 
-def get_template_by_category(product, wc_url=None, wc_key=None, wc_secret=None):
-    """
-    Determine which template to use based on product category.
-    Traverses the category hierarchy to find the root parent category.
-    Returns the template file path.
-    """
-    # Initialize WooCommerce API if credentials provided
-    if wc_url and wc_key and wc_secret:
-        init_woocommerce_api(wc_url, wc_key, wc_secret)
-    
-    print("\n=== TEMPLATE SELECTION DEBUG ===")
-    print(f"Product ID: {product.get('id', 'N/A')}")
-    print(f"Product Name: {product.get('name', 'N/A')}")
-    
-    categories = product.get('categories', [])
-    print(f"Categories found: {len(categories)}")
-    
-    if not categories:
-        print("⚠️ No categories found - using ALL template")
-        return 'files/specsheet-template__ALL.docx'
-    
-    # Display all categories
-    categories_info = [(cat.get('name'), cat.get('id')) for cat in categories]
-    print(f"All categories: {categories_info}")
-    
-    # Map of known parent category names to template files
-    known_parent_categories = {
-        'fabric': 'files/specsheet-template__FABRIC.docx',
-        'leather': 'files/specsheet-template__LEATHER.docx',
-        'floor covering': 'files/specsheet-template__FLOOR_COVERING.docx',
-        'wallcovering': 'files/specsheet-template__WALL_COVERING.docx',
-        'wall covering': 'files/specsheet-template__WALL_COVERING.docx',
-        'fine art': 'files/specsheet-template__FINE_ART.docx',
-        'lighting': 'files/specsheet-template__LIGHTING.docx',
-        'objects': 'files/specsheet-template__OBJECTS.docx',
-        'furniture': None,  # Special handling below
-    }
-    
-    # Use API to find the root parent category
-    print("\nFinding root parent category via API...")
-    first_category_id = categories[0].get('id')
-    print(f"Starting with category ID: {first_category_id} ({categories[0].get('name')})")
-    
-    root_category = get_root_parent_category(first_category_id)
-    
-    if not root_category:
-        print("⚠️ Could not determine root category via API - using ALL template")
-        return 'files/specsheet-template__ALL.docx'
-    
-    root_name = root_category.get('name', '').lower()
-    print(f"\n✓ Root parent category: {root_category.get('name')}")
-    
-    # Check for Furniture (needs special subcategory handling)
-    if root_name == 'furniture':
-        print("✓ Furniture category detected, checking subcategories...")
-        # Check all product categories for seating-related ones
-        for cat in categories:
-            cat_name = cat.get('name', '').lower()
-            cat_slug = cat.get('slug', '').lower()
-            if any(keyword in cat_name or keyword in cat_slug for keyword in ['seating', 'chair', 'sofa']):
-                print(f"  ✓ Found seating subcategory: {cat.get('name')}")
-                print("✓ Using FURNITURE_SEATING template")
-                return 'files/specsheet-template__FURNITURE_SEATING.docx'
-        print("✓ Using FURNITURE_OTHERS template")
-        return 'files/specsheet-template__FURNITURE_OTHERS.docx'
-    
-    # Check if root category matches known categories
-    if root_name in known_parent_categories and known_parent_categories[root_name]:
-        template = known_parent_categories[root_name]
-        print(f"✓ Match found! {root_category.get('name')} → {template}")
-        return template
-    
-    # Default template if no match found
-    print("⚠️ No matching template found - using ALL template")
-    return 'files/specsheet-template__ALL.docx'
+@traced("image.prepare")
+def process_image(doc, image_bytes):
+    """Turn raw image bytes into an InlineImage limited to the template image box"""
+    # Downscaled to the box at SPECSHEET_IMAGE_DPI and re-encoded (see modules/image_pipeline)
+    converted_stream, height_inches = prepare_image(image_bytes)
+    return docxtpl.InlineImage(doc, converted_stream, height=docx_shared.Inches(height_inches))
 
 
-def generate_specsheet_pdf(product, wc_url=None, wc_key=None, wc_secret=None):
-    print("\n" + "="*50)
-    print("STARTING SPECSHEET PDF GENERATION")
-    print("="*50)
-    
-    # Select template based on product category
-    template_path = get_template_by_category(product, wc_url, wc_key, wc_secret)
-    output_docx = f'files/temp/{product["id"]}_specsheet.docx'
-    output_pdf = f'files/temp/{product["id"]}_specsheet.pdf'
-    
-    print(f"\nSelected template: {template_path}")
-    print(f"Output DOCX: {output_docx}")
-    print(f"Output PDF: {output_pdf}")
-
-    # Helper function to extract meta data by key
-    def get_meta_value(meta_data, key, clean_html=False):
-        for item in meta_data:
-            if item.get('key') == key:
-                value = item.get('value', '')
-                # Return the value as-is, even if it's "n/a"
-                result = value if value else 'N/A'
-                # Clean HTML if requested
-                if clean_html and result != 'N/A':
-                    result = strip_html_tags(result)
-                return result
-        return 'N/A'
-    
-    # Helper function to extract attribute options
-    def get_attribute_options(attributes, attr_name):
-        for attr in attributes:
-            if attr.get('name') == attr_name or attr.get('slug') == attr_name:
-                options = attr.get('options', [])
-                return ', '.join(options) if options else 'n/a'
-        return 'n/a'
-
-    # Extract meta data
+def prepare_product_image(doc, images):
+    """Download and process the first product image; returns "" when unavailable"""
+    print(f"\n=== IMAGE PROCESSING ===")
+    if not images or not images[0].get('src'):
+        print("⚠️ No images found for product")
+        return ""  # Empty string if no image
+
+    try:
+        image_bytes = download_image(images[0].get('src'))
+        image_placeholder = process_image(doc, image_bytes)
+        print("✓ Image downloaded and processed successfully")
+        return image_placeholder
+
+    except Exception as e:
+        print(f"❌ Image processing failed completely: {e}")
+        return ""  # Empty string instead of text
+
+
+def build_context(product, image_placeholder):
+    """Build the template context from the WooCommerce product"""
     meta_data = product.get('meta_data', [])
-    attributes = product.get('attributes', [])
     categories = product.get('categories', [])
     brands = product.get('brands', [])
     images = product.get('images', [])
-    
-    print(f"\n=== PRODUCT DATA EXTRACTION ===")
-    print(f"Meta data items: {len(meta_data)}")
-    print(f"Attributes: {len(attributes)}")
-    print(f"Categories: {len(categories)}")
-    print(f"Brands: {len(brands)}")
-    print(f"Images: {len(images)}")
-    
-    # Load the template to create InlineImage
-    print(f"\nLoading template: {template_path}")
-    doc = DocxTemplate(template_path)
-    print("✓ Template loaded successfully")
-    
-    # Download and prepare image
-    print(f"\n=== IMAGE PROCESSING ===")
-    image_placeholder = None
-    if images and images[0].get('src'):
-        try:
-            image_url = images[0].get('src')
-            print(f"Downloading image from: {image_url}")
-            response = requests.get(image_url, timeout=10, verify=True)
-            response.raise_for_status()
-            
-            # Create InlineImage from downloaded image with height limit
-            image_stream = BytesIO(response.content)
-            
-            # Open image to get dimensions and validate format
-            img = Image.open(image_stream)
-            img_width, img_height = img.size
-            print(f"Image dimensions: {img_width}x{img_height} pixels")
-            print(f"Image mode: {img.mode}")
-            
-            # Convert image to RGB if necessary (handles RGBA, P, L, etc.)
-            if img.mode not in ('RGB', 'L'):
-                print(f"Converting image from {img.mode} to RGB")
-                img = img.convert('RGB')
-            
-            # Calculate dimensions to limit height to 300px while maintaining aspect ratio
-            max_height_px = 342.42519685
-            if img_height > max_height_px:
-                # Scale down proportionally
-                scale_factor = max_height_px / img_height
-                new_height_px = max_height_px
-                print(f"Scaling image down: {img_height}px → {new_height_px}px (scale: {scale_factor:.2f})")
-            else:
-                # Use original size if already smaller than 300px
-                new_height_px = img_height
-                print(f"Image size OK: {img_height}px (no scaling needed)")
-            
-            # Convert pixels to inches (96 DPI standard)
-            new_height_inches = new_height_px / 96
-            print(f"Final image height: {new_height_inches:.2f} inches")
-            
-            # Convert image to a format supported by docx (JPEG)
-            converted_stream = BytesIO()
-            img.save(converted_stream, format='JPEG', quality=95)
-            converted_stream.seek(0)
-            
-            # Create InlineImage with calculated height (using height parameter maintains aspect ratio)
-            image_placeholder = InlineImage(doc, converted_stream, height=Inches(new_height_inches))
-            print("✓ Image downloaded and processed successfully")
-
-        except Exception as e:
-            print(f"❌ Error processing image (attempt 1): {e}")
-            # Try without SSL verification as fallback
-            print("Retrying without SSL verification...")
-            try:
-                response = requests.get(image_url, timeout=10, verify=False)
-                response.raise_for_status()
-                image_stream = BytesIO(response.content)
-                
-                # Open image to get dimensions and validate format
-                img = Image.open(image_stream)
-                img_width, img_height = img.size
-                
-                # Convert image to RGB if necessary
-                if img.mode not in ('RGB', 'L'):
-                    img = img.convert('RGB')
-                
-                # Calculate dimensions to limit height to 342.42519685px while maintaining aspect ratio
-                max_height_px = 342.42519685
-                if img_height > max_height_px:
-                    new_height_px = max_height_px
-                else:
-                    new_height_px = img_height
-                
-                # Convert pixels to inches
-                new_height_inches = new_height_px / 96
-                
-                # Convert image to JPEG format
-                converted_stream = BytesIO()
-                img.save(converted_stream, format='JPEG', quality=95)
-                converted_stream.seek(0)
-                
-                image_placeholder = InlineImage(doc, converted_stream, height=Inches(new_height_inches))
-                print("✓ Image processed successfully (without SSL verification)")
-            except Exception as e2:
-                print(f"❌ Image processing failed completely: {e2}")
-                image_placeholder = ""  # Empty string instead of text
-    else:
-        print("⚠️ No images found for product")
-        image_placeholder = ""  # Empty string if no image
-    
-    # Build comprehensive context data
-    context_data = {
+
+    return {
         # Basic Information (matching template placeholders)
         'prdct_name': product.get('name', 'N/A'),
         'product_name': product.get('name', 'N/A'),
@@ -390,40 +274,99 @@ def generate_specsheet_pdf(product, wc_url=None, wc_key=None, wc_secret=None):
         'date_created': product.get('date_created', 'N/A'),
     }
 
-    # Render and save the document
-    print(f"\n=== DOCUMENT RENDERING ===")
-    print("Rendering template with context data...")
-    doc.render(context_data)
-    print(f"Saving DOCX to: {output_docx}")
-    doc.save(output_docx)
-    print("✓ DOCX file saved successfully")
-    
-    # Convert DOCX to PDF using LibreOffice
-    print(f"\n=== PDF CONVERSION ===")
-    # Detect OS and set appropriate LibreOffice path
+
+def get_soffice_path():
+    """Detect OS and return the appropriate LibreOffice binary"""
     system = platform.system()
     print(f"Detected OS: {system}")
-    
+
     if system == 'Darwin':  # macOS
-        soffice_path = '/Applications/LibreOffice.app/Contents/MacOS/soffice'
+        return '/Applications/LibreOffice.app/Contents/MacOS/soffice'
     elif system == 'Linux':  # Ubuntu/Linux
-        soffice_path = 'libreoffice'
+        return 'libreoffice'
     elif system == 'Windows':
-        soffice_path = 'soffice'
-    else:
-        soffice_path = 'libreoffice'
-    
+        return 'soffice'
+    return 'libreoffice'
+
+
+_converters = set()
+_converters_lock = threading.Lock()
+
+
+def run_converter(command):
+    """
+    subprocess.run(command, check=True, capture_output=True), but the process is
+    tracked so terminate_conversions() can stop it on shutdown. It gets its own
+    process group because soffice is a wrapper that starts soffice.bin.
+    """
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=(os.name == 'posix'))
+    with _converters_lock:
+        _converters.add(process)
+    try:
+        stdout, stderr = process.communicate()
+    finally:
+        with _converters_lock:
+            _converters.discard(process)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+
+def _signal_converter(process, sig):
+    try:
+        if os.name == 'posix':
+            os.killpg(process.pid, sig)
+        elif sig == signal.SIGTERM:
+            process.terminate()
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def terminate_conversions(timeout=5):
+    """Stop running LibreOffice conversions: SIGTERM, then SIGKILL after `timeout` seconds"""
+    with _converters_lock:
+        processes = list(_converters)
+    for process in processes:
+        print(f"Terminating LibreOffice conversion (pid {process.pid})")
+        _signal_converter(process, signal.SIGTERM)
+    for process in processes:
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            _signal_converter(process, signal.SIGKILL if os.name == 'posix' else signal.SIGTERM)
+    return len(processes)
+
+
+@traced("libreoffice.convert")
+def convert_docx_to_pdf(docx_path, outdir, profile_dir=None, slots=None):
+    """
+    Convert a DOCX file to PDF using LibreOffice; returns the PDF path.
+    Conversions are bounded machine-wide by the slots (default conversion_slots,
+    MAX_CONCURRENT_CONVERSIONS); each slot uses its own LibreOffice user profile
+    unless profile_dir is given, since LibreOffice refuses to run twice against
+    the same profile.
+    """
+    print(f"\n=== PDF CONVERSION ===")
+    soffice_path = get_soffice_path()
     print(f"LibreOffice path: {soffice_path}")
     print("Converting DOCX to PDF...")
     
+    waiting = time.monotonic()
     try:
-        result = subprocess.run([
-            soffice_path,
-            '--headless',
-            '--convert-to', 'pdf',
-            '--outdir', os.path.dirname(output_pdf),
-            output_docx
-        ], check=True, capture_output=True)
+        with slots or conversion_slots as slot:
+            annotate(slot=slot, slot_wait_ms=round((time.monotonic() - waiting) * 1000, 1))
+            profile = profile_dir or state_path("libreoffice", f"profile-{slot}")
+            command = [
+                soffice_path,
+                '--headless',
+                f'-env:UserInstallation=file://{os.path.abspath(profile)}',
+                '--convert-to', 'pdf',
+                '--outdir', outdir,
+                docx_path
+            ]
+            result = run_converter(command)
         
         print("✓ PDF conversion successful")
         if result.stdout:
@@ -439,14 +382,180 @@ def generate_specsheet_pdf(product, wc_url=None, wc_key=None, wc_secret=None):
         if e.stderr:
             print(f"Error details: {e.stderr.decode()}")
         raise
+
+    return os.path.join(outdir, os.path.splitext(os.path.basename(docx_path))[0] + '.pdf')
+
+
+@traced("specsheet.render_docx")
+def render_specsheet_docx(product, wc_url=None, wc_key=None, wc_secret=None, output_dir='files/temp'):
+    """Select the template, fill it with the product data and save the DOCX; returns its path"""
+    annotate(product_id=product.get("id"))
+    # Select template based on product category
+    template_path = get_template_by_category(product, wc_url, wc_key, wc_secret)
+    output_docx = os.path.join(output_dir, f'{product["id"]}_specsheet.docx')
     
+    print(f"\nSelected template: {template_path}")
+    print(f"Output DOCX: {output_docx}")
+
+    print(f"\n=== PRODUCT DATA EXTRACTION ===")
+    print(f"Meta data items: {len(product.get('meta_data', []))}")
+    print(f"Attributes: {len(product.get('attributes', []))}")
+    print(f"Categories: {len(product.get('categories', []))}")
+    print(f"Brands: {len(product.get('brands', []))}")
+    print(f"Images: {len(product.get('images', []))}")
+    
+    # Load the template to create InlineImage
+    doc = load_template(template_path)
+    
+    # Download and prepare image
+    image_placeholder = prepare_product_image(doc, product.get('images', []))
+    
+    # Build comprehensive context data
+    context_data = build_context(product, image_placeholder)
+
+    # Render and save the document
+    print(f"\n=== DOCUMENT RENDERING ===")
+    print("Rendering template with context data...")
+    with span("docx.render"):
+        doc.render(context_data)
+    print(f"Saving DOCX to: {output_docx}")
+    with span("docx.save"):
+        doc.save(output_docx)
+    print("✓ DOCX file saved successfully")
+    return output_docx
+
+
+def remove_files(paths):
+    for path in paths:
+        if os.path.exists(path):
+            print(f"Removing temporary file: {path}")
+            os.remove(path)
+
+
+OUTPUT_DIR_PREFIX = "specsheet-"
+
+
+def make_output_dir(output_dir):
+    """
+    A directory of its own under output_dir for one render: file names are per
+    product, so concurrent renders of the same product (jobs, workers, exports)
+    would otherwise overwrite or delete each other's files.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    return tempfile.mkdtemp(prefix=OUTPUT_DIR_PREFIX, dir=output_dir)
+
+
+def remove_output(path):
+    """Remove a generated PDF and the per-render directory it was written to"""
+    if os.path.exists(path):
+        print(f"Removing temporary file: {path}")
+        os.remove(path)
+    directory = os.path.dirname(path)
+    if os.path.basename(directory).startswith(OUTPUT_DIR_PREFIX):
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+@traced("specsheet.generate")
+def generate_specsheet_pdf(product, wc_url=None, wc_key=None, wc_secret=None, output_dir='files/temp', profile_dir=None, slots=None):
+    annotate(product_id=product.get("id"))
+    print("\n" + "="*50)
+    print("STARTING SPECSHEET PDF GENERATION")
+    print("="*50)
+
+    output_dir = make_output_dir(output_dir)
+    try:
+        output_docx = render_specsheet_docx(product, wc_url, wc_key, wc_secret, output_dir=output_dir)
+
+        # Convert DOCX to PDF using LibreOffice
+        output_pdf = convert_docx_to_pdf(output_docx, output_dir, profile_dir=profile_dir, slots=slots)
+    except BaseException:
+        shutil.rmtree(output_dir, ignore_errors=True)
+        raise
+
     # Clean up the temporary DOCX file
     print(f"\n=== CLEANUP ===")
-    if os.path.exists(output_docx):
-        print(f"Removing temporary DOCX: {output_docx}")
-        os.remove(output_docx)
-        print("✓ Cleanup complete")
+    remove_files([output_docx])
+    print("✓ Cleanup complete")
     
     print(f"\n✅ PDF generated successfully: {output_pdf}")
     print("="*50 + "\n")
     return output_pdf
+
+
+def build_cover_page(base_docx, items, title):
+    """
+    Build the cover page of a combined specsheet on top of a rendered specsheet,
+    so page size, margins, header and footer match the template. Lists one row
+    per product with its SKU and requested quantity; items is a list of (product, quantity).
+    """
+    cover = docx.Document(base_docx)
+    body = cover.element.body
+    for element in list(body):
+        if not element.tag.endswith('}sectPr'):
+            body.remove(element)
+
+    heading = cover.add_paragraph().add_run(title)
+    heading.bold = True
+    heading.font.size = docx_shared.Pt(18)
+    cover.add_paragraph(f"{len(items)} product(s)")
+
+    table = cover.add_table(rows=1, cols=4)
+    try:
+        table.style = 'Table Grid'
+    except KeyError:
+        pass  # Template has no grid style, keep the default
+    for cell, label in zip(table.rows[0].cells, ['#', 'Product', 'SKU', 'Quantity']):
+        cell.text = label
+    for index, (product, quantity) in enumerate(items, start=1):
+        row = table.add_row().cells
+        row[0].text = str(index)
+        row[1].text = product.get('name', 'N/A')
+        row[2].text = product.get('sku') or 'N/A'
+        row[3].text = str(quantity)
+
+    return cover
+
+
+@traced("specsheet.generate_combined")
+def generate_combined_specsheet_pdf(items, name, wc_url=None, wc_key=None, wc_secret=None, title='Product Specsheets', output_dir='files/temp', profile_dir=None):
+    """
+    Render several products into a single PDF: a cover page listing quantities,
+    followed by each product's specsheet. Every DOCX is merged before one single
+    LibreOffice conversion. items is a list of (product, quantity); returns the PDF path.
+    """
+    print("\n" + "="*50)
+    print(f"STARTING COMBINED SPECSHEET PDF GENERATION ({len(items)} products)")
+    annotate(products=len(items))
+    print("="*50)
+
+    output_dir = make_output_dir(output_dir)
+    combined_docx = os.path.join(output_dir, f'{name}.docx')
+    product_docx_files = []
+    try:
+        for product, quantity in items:
+            product_docx_files.append(render_specsheet_docx(product, wc_url, wc_key, wc_secret, output_dir=output_dir))
+
+        print(f"\n=== MERGING {len(product_docx_files)} DOCUMENTS ===")
+        with span("docx.merge", documents=len(product_docx_files)):
+            composer = docxcompose.Composer(build_cover_page(product_docx_files[0], items, title))
+            for docx_path in product_docx_files:
+                # Each specsheet starts on its own page; the break goes into the composed document,
+                # since a template body may start with a table rather than a paragraph
+                composer.doc.add_page_break()
+                composer.append(docx.Document(docx_path))
+
+            composer.save(combined_docx)
+        print(f"✓ Combined DOCX saved: {combined_docx}")
+        output_pdf = convert_docx_to_pdf(combined_docx, output_dir, profile_dir=profile_dir)
+
+    except BaseException:
+        shutil.rmtree(output_dir, ignore_errors=True)
+        raise
+
+    finally:
+        print(f"\n=== CLEANUP ===")
+        remove_files([combined_docx] + product_docx_files)
+
+    print(f"\n✅ Combined PDF generated successfully: {output_pdf}")
+    print("="*50 + "\n")
+    return output_pdf
@@ -0,0 +1,204 @@
+"""
+Specsheet template resolution.
+
+Which template a product gets is declared in SPECSHEET_TEMPLATES_FILE:
+
+    {
+      "default": "files/specsheet-template__ALL.docx",
+      "roots": {"fabric": "files/specsheet-template__FABRIC.docx", ...},
+      "subcategories": [
+        {"root": "furniture", "keywords": ["seating", "chair", "sofa"], "template": "files/specsheet-template__FURNITURE_SEATING.docx"}
+      ],
+      "categories": {"812": "files/specsheet-template__OBJECTS.docx"}
+    }
+
+    roots          template per root category name (lowercase)
+    subcategories  keyword rules for products whose primary category is under
+                   `root`: when any of the product's categories has a keyword in
+                   its name or slug, the rule's template wins over the root's
+    categories     explicit category ids, winning over everything else
+
+A product is resolved from its first (primary) category: the root that
+category belongs to picks the template, refined by that root's subcategory
+rules. Its other categories only matter for pins and keyword rules, so a
+product cross-listed under another root keeps its primary root's template.
+
+At startup the WooCommerce category tree is fetched once and compiled into
+{category id: root category name}, so resolving a product is a dict lookup
+per category. The compiled table is kept in STATE_DIR for starts without
+network, and rebuilt (at most every SPECSHEET_TEMPLATES_REFRESH seconds) when a
+product carries a category it does not know.
+
+    python -m modules.specsheet_templates table
+    python -m modules.specsheet_templates fallbacks [--category 42] [--json]
+"""
+import argparse, json, os, sys, threading, time
+
+from modules.shared_state import state_path
+
+
+SPECSHEET_TEMPLATES_FILE = os.getenv("SPECSHEET_TEMPLATES_FILE", "files/specsheet_templates.json")
+SPECSHEET_TEMPLATES_REFRESH = int(os.getenv("SPECSHEET_TEMPLATES_REFRESH", "300"))
+DEFAULT_TEMPLATE = "files/specsheet-template__ALL.docx"
+
+
+def load_mapping(path=SPECSHEET_TEMPLATES_FILE):
+    with open(path, "r") as f:
+        mapping = json.load(f)
+    mapping.setdefault("default", DEFAULT_TEMPLATE)
+    for template in {mapping["default"], *mapping.get("roots", {}).values(), *mapping.get("categories", {}).values(), *(rule["template"] for rule in mapping.get("subcategories", []))}:
+        if template and not os.path.exists(template):
+            print(f"⚠️ Template {template} in {path} does not exist")
+    return mapping
+
+
+def compile_table(categories):
+    """{category id: lowercase name of its root category} for every category"""
+    by_id = {category["id"]: category for category in categories}
+
+    def root_of(category):
+        seen = set()
+        while category.get("parent") and category["parent"] in by_id and category["id"] not in seen:
+            seen.add(category["id"])
+            category = by_id[category["parent"]]
+        return category
+
+    return {category_id: root_of(category).get("name", "").lower() for category_id, category in by_id.items()}
+
+
+def template_for(categories, roots, mapping):
+    """Template for a product's categories (the first one is the primary), or None when nothing matches"""
+    pinned = mapping.get("categories", {})
+    template = next((pinned[str(category.get("id"))] for category in categories if str(category.get("id")) in pinned), None)
+    if template or not categories or categories[0].get("id") not in roots:
+        return template
+
+    root_name = roots[categories[0].get("id")]
+    texts = [f"{category.get('name', '')} {category.get('slug', '')}".lower() for category in categories]
+    for rule in mapping.get("subcategories", []):
+        if rule["root"].lower() == root_name and any(keyword.lower() in text for keyword in rule["keywords"] for text in texts):
+            return rule["template"]
+    return {name.lower(): template for name, template in mapping.get("roots", {}).items()}.get(root_name)
+
+
+class TemplateTable:
+
+    def __init__(self, mapping_path=SPECSHEET_TEMPLATES_FILE):
+        self.mapping_path = mapping_path
+        self.cache_path = state_path("specsheet_templates.compiled.json")
+        self.mapping = None
+        self.table = None
+        self.built = 0.0
+        self._lock = threading.Lock()
+
+    def build(self, wc_url, wc_key, wc_secret):
+        """Fetch the category tree and compile the mapping; returns the number of categories"""
+        from modules.woocommerce_service import WooCommerceProductAPI
+
+        mapping = load_mapping(self.mapping_path)
+        categories = list(WooCommerceProductAPI(wc_url, wc_key, wc_secret).iter_categories())
+        table = compile_table(categories)
+        with open(self.cache_path, "w") as f:
+            json.dump({"mapping": mapping, "roots": {str(category_id): root for category_id, root in table.items()}}, f)
+        self.mapping, self.table, self.built = mapping, table, time.monotonic()
+        print(f"✓ Compiled specsheet templates for {len(table)} categories")
+        return len(table)
+
+    def _load_cached(self):
+        try:
+            with open(self.cache_path, "r") as f:
+                cached = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        if "roots" not in cached:
+            return False  # Written by an older version
+        self.mapping = cached["mapping"]
+        self.table = {int(category_id): root for category_id, root in cached["roots"].items()}
+        print(f"Using the cached specsheet template table ({len(self.table)} categories)")
+        return True
+
+    def ensure(self, wc_url=None, wc_key=None, wc_secret=None, unknown=False):
+        """Build the table on first use, or again when a category is unknown (rate limited)"""
+        if self.table is not None and not (unknown and time.monotonic() - self.built > SPECSHEET_TEMPLATES_REFRESH):
+            return
+        with self._lock:
+            if self.table is not None and not (unknown and time.monotonic() - self.built > SPECSHEET_TEMPLATES_REFRESH):
+                return
+            try:
+                if not (wc_url and wc_key and wc_secret):
+                    raise RuntimeError("no WooCommerce credentials")
+                self.build(wc_url, wc_key, wc_secret)
+            except Exception as e:
+                print(f"⚠️ Could not compile specsheet templates: {e}")
+                self.built = time.monotonic()  # Do not retry on every product
+                if self.table is None and not self._load_cached():
+                    self.mapping, self.table = load_mapping(self.mapping_path), {}
+
+    def resolve(self, product, wc_url=None, wc_key=None, wc_secret=None):
+        """(template path, fallback) for a product; fallback is True when the default template was used"""
+        self.ensure(wc_url, wc_key, wc_secret)
+        category_ids = [category.get("id") for category in product.get("categories", [])]
+        if any(category_id not in self.table for category_id in category_ids):
+            self.ensure(wc_url, wc_key, wc_secret, unknown=True)
+
+        template = template_for(product.get("categories", []), self.table, self.mapping)
+        if template:
+            return template, False
+        return self.mapping["default"], True
+
+
+templates = TemplateTable()
+
+
+def resolve_template(product, wc_url=None, wc_key=None, wc_secret=None):
+    return templates.resolve(product, wc_url, wc_key, wc_secret)
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+    from modules.woocommerce_service import WooCommerceProductAPI
+
+    parser = argparse.ArgumentParser(description="Inspect the compiled specsheet template table")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("table", help="Print the template of every category")
+    fallbacks_cmd = sub.add_parser("fallbacks", help="List products that get the default template")
+    fallbacks_cmd.add_argument("--category", type=int, help="Only products in this category")
+    fallbacks_cmd.add_argument("--json", action="store_true", help="One JSON object per product")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    credentials = os.getenv("WC_STORE_URL"), os.getenv("WC_CONSUMER_KEY"), os.getenv("WC_CONSUMER_SECRET")
+    templates.build(*credentials)
+
+    if args.command == "table":
+        categories = {category["id"]: category for category in WooCommerceProductAPI(*credentials).iter_categories()}
+        for category_id, root in sorted(templates.table.items()):
+            category = categories.get(category_id, {"id": category_id})
+            template = template_for([category], templates.table, templates.mapping)
+            print(f"{category_id:>6}  {category.get('name', '?'):<40} {root:<20} {template or '(default)'}")
+        return 0
+
+    total, fallbacks, by_category = 0, 0, {}
+    for product in WooCommerceProductAPI(*credentials).iter_products(category=args.category):
+        total += 1
+        template, fallback = templates.resolve(product)
+        if not fallback:
+            continue
+        fallbacks += 1
+        categories = [f"{category.get('name')} ({category.get('id')})" for category in product.get("categories", [])]
+        key = categories[0] if categories else "(no category)"
+        by_category[key] = by_category.get(key, 0) + 1
+        if args.json:
+            print(json.dumps({"id": product["id"], "name": product.get("name"), "categories": product.get("categories", [])}))
+        else:
+            print(f"{product['id']:>6}  {product.get('name', '')[:50]:<50} {', '.join(categories) or '(no category)'}")
+
+    if not args.json:
+        print(f"\n{fallbacks} of {total} products fall back to {templates.mapping['default']}")
+        for key, count in sorted(by_category.items(), key=lambda item: -item[1]):
+            print(f"  {count:>5}  {key}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
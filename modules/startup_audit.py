@@ -0,0 +1,72 @@
+"""
+Startup-time audit: what does importing the app cost, module by module?
+
+Runs `python -X importtime -c "import app"` in a fresh interpreter and reports
+the modules with the highest cumulative import time, then the cost of warming
+up the lazily imported dependencies (see modules/lazy_imports).
+
+Usage:
+    python -m modules.startup_audit
+    python -m modules.startup_audit --top 40 --module app --no-warm-up
+"""
+import argparse, subprocess, sys, time
+
+
+def measure_imports(module: str):
+    """Returns (wall seconds, [(cumulative_us, self_us, name)]) for importing module"""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        entries.append((int(cumulative_us), int(self_us), name.rstrip()))
+    return wall, entries
+
+
+def measure_warm_up(module: str):
+    """Returns {lazy module: seconds} measured in a fresh interpreter"""
+    code = (
+        f"import json, {module}\n"
+        "from modules.lazy_imports import warm_up\n"
+        "print(json.dumps(warm_up()))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Warm-up failed:\n{result.stderr[-2000:]}")
+    import json
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report per-module import cost of the webhook service")
+    parser.add_argument("--module", default="app", help="Module to import (default: app)")
+    parser.add_argument("--top", type=int, default=25, help="Number of modules to list")
+    parser.add_argument("--no-warm-up", action="store_true", help="Skip measuring the lazy dependencies")
+    args = parser.parse_args(argv)
+
+    wall, entries = measure_imports(args.module)
+    total_us = next((cumulative for cumulative, _, name in entries if name.strip() == args.module), 0)
+
+    print(f"\nImporting '{args.module}': {total_us / 1000:.1f} ms of imports, {wall * 1000:.0f} ms interpreter wall time")
+    print(f"\n{'cumulative ms':>14}{'self ms':>10}  module")
+    print("-" * 60)
+    for cumulative, self_us, name in sorted(entries, reverse=True)[:args.top]:
+        print(f"{cumulative / 1000:>14.1f}{self_us / 1000:>10.1f}  {name}")
+
+    if not args.no_warm_up:
+        timings = measure_warm_up(args.module)
+        print(f"\nDeferred (lazy) dependencies, loaded on first use or by warm-up: {sum(timings.values()) * 1000:.0f} ms total")
+        for name, seconds in sorted(timings.items(), key=lambda item: item[1], reverse=True):
+            print(f"{seconds * 1000:>14.1f}  {name}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+Newsletter subscriber store.
+
+Subscribers are kept in STATE_DIR/subscribers.db, one row per normalized email
+(set semantics), so a repeated sign-up is a primary-key lookup and never
+reaches Google Sheets again. New sign-ups are appended to the "subscribers"
+sheet in bulk by sync(), which app.py runs every NEWSLETTER_SYNC_INTERVAL
+seconds; rows that fail to append stay unsynced and go with the next batch.
+Unsubscribing only marks the row here.
+
+Each subscriber also has an opaque id (for unsubscribe links that do not
+expose the address); /unsubscribe/{email_id} only accepts the id. The id is an HMAC
+of the address keyed with SUBSCRIBER_ID_SECRET, so it cannot be computed from
+an address; without the variable a random secret is generated once and kept in
+STATE_DIR. Ids are stored with the row, so changing the secret only affects new
+subscribers.
+
+    python -m modules.subscribers stats
+    python -m modules.subscribers sync
+    python -m modules.subscribers export --status subscribed > subscribers.csv
+"""
+import argparse, csv, hashlib, hmac, os, secrets, sys, time
+from datetime import datetime, timezone, timedelta
+
+from modules.shared_state import connect, file_lock, state_path
+
+
+NEWSLETTER_SHEET = "subscribers"
+SYNC_BATCH_SIZE = int(os.getenv("NEWSLETTER_SYNC_BATCH_SIZE", "500"))
+TIMEZONE = timezone(timedelta(hours=4))
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+_id_secret = None
+
+
+def _subscriber_id_secret() -> bytes:
+    global _id_secret
+    if _id_secret is None:
+        configured = os.getenv("SUBSCRIBER_ID_SECRET")
+        if configured:
+            _id_secret = configured.encode()
+        else:
+            path = state_path("subscriber_id.secret")
+            with file_lock("subscriber-id-secret"):
+                if not os.path.exists(path):
+                    with open(path, "w") as f:
+                        f.write(secrets.token_hex(32))
+                    os.chmod(path, 0o600)
+                with open(path, "r") as f:
+                    _id_secret = f.read().strip().encode()
+    return _id_secret
+
+
+def subscriber_id(email: str) -> str:
+    return hmac.new(_subscriber_id_secret(), normalize_email(email).encode(), hashlib.sha256).hexdigest()[:24]
+
+
+def _db():
+    conn = connect("subscribers")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS subscribers (
+            email TEXT PRIMARY KEY,
+            id TEXT NOT NULL UNIQUE,
+            name TEXT,
+            status TEXT NOT NULL DEFAULT 'subscribed',
+            synced INTEGER NOT NULL DEFAULT 0,
+            created REAL NOT NULL,
+            updated REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS subscribers_unsynced ON subscribers (synced) WHERE synced = 0")
+    return conn
+
+
+def add(email: str, name: str = "") -> bool:
+    """Record a sign-up; returns False when the address is already subscribed"""
+    email, now = normalize_email(email), time.time()
+    conn = _db()
+    cursor = conn.execute(
+        "INSERT OR IGNORE INTO subscribers (email, id, name, created, updated) VALUES (?, ?, ?, ?, ?)",
+        (email, subscriber_id(email), name, now, now)
+    )
+    if cursor.rowcount:
+        return True
+
+    # Signing up again after unsubscribing is a new opt-in: appended to the sheet again
+    cursor = conn.execute(
+        "UPDATE subscribers SET status = 'subscribed', synced = 0, name = COALESCE(NULLIF(?, ''), name), created = ?, updated = ? WHERE email = ? AND status = 'unsubscribed'",
+        (name, now, now, email)
+    )
+    return cursor.rowcount > 0
+
+
+def unsubscribe(subscriber_id: str) -> bool:
+    """Mark a subscriber (by id, never by address) as unsubscribed; False when unknown or already done"""
+    cursor = _db().execute("UPDATE subscribers SET status = 'unsubscribed', updated = ? WHERE id = ? AND status = 'subscribed'", (time.time(), subscriber_id.strip().lower()))
+    return cursor.rowcount > 0
+
+
+def is_subscribed(email: str) -> bool:
+    row = _db().execute("SELECT status FROM subscribers WHERE email = ?", (normalize_email(email),)).fetchone()
+    return bool(row) and row["status"] == "subscribed"
+
+
+def sync(write_rows, batch_size: int = SYNC_BATCH_SIZE) -> int:
+    """
+    Append unsynced subscribers with write_rows(rows) -> bool, one call per batch,
+    and mark them synced; returns how many were written. Serialized across workers.
+    """
+    written = 0
+    with file_lock("subscribers-sync"):
+        conn = _db()
+        while True:
+            rows = conn.execute(
+                "SELECT email, name, created FROM subscribers WHERE synced = 0 AND status = 'subscribed' ORDER BY created LIMIT ?",
+                (batch_size,)
+            ).fetchall()
+            if not rows:
+                break
+            values = [[row["name"] or "", row["email"], datetime.fromtimestamp(row["created"], TIMEZONE).strftime("%Y-%m-%d %H:%M:%S")] for row in rows]
+            if not write_rows(values):
+                print(f"⚠️ Subscriber sync failed, {len(rows)} subscribers left for the next run")
+                break
+            conn.execute(f"UPDATE subscribers SET synced = 1 WHERE email IN ({','.join('?' * len(rows))})", [row["email"] for row in rows])
+            written += len(rows)
+    if written:
+        print(f"✓ Synced {written} new subscribers to Sheets")
+    return written
+
+
+def stats() -> dict:
+    counts = {row["status"]: row["count"] for row in _db().execute("SELECT status, COUNT(*) AS count FROM subscribers GROUP BY status")}
+    counts["unsynced"] = _db().execute("SELECT COUNT(*) FROM subscribers WHERE synced = 0 AND status = 'subscribed'").fetchone()[0]
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and sync the newsletter subscriber store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="Subscriber counts by status")
+    sub.add_parser("sync", help="Append unsynced subscribers to the sheet now")
+    export_cmd = sub.add_parser("export", help="Write subscribers as CSV to stdout")
+    export_cmd.add_argument("--status", choices=["subscribed", "unsubscribed"])
+    args = parser.parse_args(argv)
+
+    if args.command == "stats":
+        print(stats())
+    elif args.command == "sync":
+        from dotenv import load_dotenv
+        from modules.google_sheet_service import append_rows
+
+        load_dotenv()
+        sheet_id = os.getenv("SHEET_ID")
+        sync(lambda rows: append_rows(sheet_id, NEWSLETTER_SHEET, rows))
+    else:
+        query, params = "SELECT email, id, name, status, created FROM subscribers", ()
+        if args.status:
+            query, params = query + " WHERE status = ?", (args.status,)
+        writer = csv.writer(sys.stdout)
+        writer.writerow(["email", "id", "name", "status", "created"])
+        for row in _db().execute(query + " ORDER BY created", params):
+            writer.writerow([row["email"], row["id"], row["name"], row["status"], datetime.fromtimestamp(row["created"], TIMEZONE).isoformat()])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
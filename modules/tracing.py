@@ -0,0 +1,359 @@
+"""
+Lightweight tracing: spans per request, job and pipeline stage, exported as
+OTLP/JSON without the OpenTelemetry SDK.
+
+    with span("specsheet.generate", product_id=product["id"]) as s:
+        ...
+        s.set(template=template_path)
+
+    annotate(cache="stale")          # attributes on the current span
+
+Spans nest through a context variable; work handed to another thread carries
+its parent explicitly (span(..., parent=current())). Whether a trace is
+recorded is decided once at its root (TRACE_SAMPLE_RATE), so an unsampled
+request costs one random() and no-op spans below it.
+
+TRACE_EXPORT:
+    ""      tracing off (default)
+    file    one ExportTraceServiceRequest JSON document per line in
+            TRACE_FILE, readable by the collector's otlpjsonfile receiver
+    otlp    POST to an OTLP/HTTP collector at TRACE_OTLP_ENDPOINT
+
+Spans are queued and written in batches by a background thread; when the
+queue is full they are dropped rather than slowing requests down.
+
+    python -m modules.tracing summary                  per-stage timings from TRACE_FILE
+    python -m modules.tracing slowest --limit 5        slowest traces as span trees
+"""
+import argparse, atexit, contextvars, json, os, queue, random, sys, threading, time
+
+from modules.lazy_imports import lazy_import
+from modules.shared_state import STATE_DIR
+
+
+requests = lazy_import("requests")
+
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "").lower()
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+TRACE_FILE = os.getenv("TRACE_FILE") or os.path.join(STATE_DIR, "traces", "spans.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces")
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "bt-webhooks")
+QUEUE_SIZE = 10000
+BATCH_SIZE = 512
+BATCH_SECONDS = 2.0
+
+_current = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "end", "attributes", "error", "_token")
+
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.error = None
+        self.start = self.end = 0
+
+    sampled = True
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        self.start = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.time_ns()
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"[:500]
+        _current.reset(self._token)
+        exporter.add(self)
+        return False
+
+
+class _Unsampled:
+    """Marks a trace that is not recorded, so the spans below it are no-ops too"""
+    __slots__ = ("_token",)
+    sampled = False
+
+    def set(self, **attributes):
+        return self
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        return False
+
+
+class _Noop:
+    sampled = False
+
+    def set(self, **attributes):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP = _Noop()
+
+
+def current():
+    """The current span (pass it as parent= to continue the trace in another thread)"""
+    return _current.get()
+
+
+def span(name: str, parent=None, **attributes):
+    """A span under `parent` (default: the current span); starts a sampled-or-not trace at the root"""
+    if not TRACE_EXPORT:
+        return NOOP
+    if parent is None:
+        parent = _current.get()
+    if parent is None:
+        if random.random() >= TRACE_SAMPLE_RATE:
+            return _Unsampled()
+        return Span(name, os.urandom(16).hex(), None, attributes)
+    if not parent.sampled:
+        return NOOP
+    return Span(name, parent.trace_id, parent.span_id, attributes)
+
+
+def annotate(**attributes):
+    """Add attributes to the current span, if it is recorded"""
+    found = _current.get()
+    if found is not None:
+        found.set(**attributes)
+
+
+def traced(name: str):
+    """Decorator: run the function inside a span"""
+    def decorate(fn):
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        wrapper.__name__, wrapper.__doc__, wrapper.__wrapped__ = fn.__name__, fn.__doc__, fn
+        return wrapper
+    return decorate
+
+
+# ----------------------------------------------------------------------
+# Export
+# ----------------------------------------------------------------------
+
+def _value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans) -> dict:
+    """ExportTraceServiceRequest (OTLP/JSON) for a batch of finished spans"""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}, {"key": "process.pid", "value": _value(os.getpid())}]},
+        "scopeSpans": [{
+            "scope": {"name": "modules.tracing"},
+            "spans": [{
+                "traceId": s.trace_id,
+                "spanId": s.span_id,
+                **({"parentSpanId": s.parent_id} if s.parent_id else {}),
+                "name": s.name,
+                "kind": 1,
+                "startTimeUnixNano": str(s.start),
+                "endTimeUnixNano": str(s.end),
+                "attributes": [{"key": key, "value": _value(value)} for key, value in s.attributes.items() if value is not None],
+                "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+            } for s in spans],
+        }],
+    }]}
+
+
+class Exporter:
+
+    def __init__(self):
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.dropped = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        # Started lazily, and again in each forked worker
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self.queue = queue.Queue(QUEUE_SIZE)
+                    threading.Thread(target=self._run, name="trace-exporter", daemon=True).start()
+
+    def add(self, finished: Span):
+        self._ensure_thread()
+        try:
+            self.queue.put_nowait(finished)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self, wait: float):
+        batch = []
+        deadline = time.monotonic() + wait
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._drain(BATCH_SECONDS)
+            flushed = [item for item in batch if isinstance(item, threading.Event)]
+            batch = [item for item in batch if not isinstance(item, threading.Event)]
+            if batch:
+                self.export(batch)
+            for done in flushed:
+                done.set()
+
+    def export(self, batch):
+        try:
+            document = to_otlp(batch)
+            if TRACE_EXPORT == "otlp":
+                requests.post(TRACE_OTLP_ENDPOINT, json=document, timeout=5)
+            else:
+                os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+                with open(TRACE_FILE, "a") as f:
+                    f.write(json.dumps(document, separators=(",", ":")) + "\n")
+        except Exception as e:
+            self.dropped += len(batch)
+            print(f"⚠️ Trace export failed ({len(batch)} spans dropped): {e}")
+
+    def flush(self, timeout: float = 5.0):
+        """Export everything finished so far, including the batch being collected (e.g. on shutdown)"""
+        if self._pid != os.getpid():
+            return  # Nothing recorded in this process
+        done = threading.Event()
+        try:
+            self.queue.put(done, timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(timeout)
+
+
+exporter = Exporter()
+
+
+def flush():
+    if TRACE_EXPORT:
+        exporter.flush()
+
+
+atexit.register(flush)  # CLI runs (bulk export, benchmarks) too
+
+
+class TracingMiddleware:
+    """
+    Pure ASGI middleware: one root span per HTTP request. The span is named after
+    the matched route template (/jobs/{job_id}), never the raw path, which can
+    carry ids and email addresses.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TRACE_EXPORT:
+            return await self.app(scope, receive, send)
+
+        with span(f"{scope['method']} (unmatched)", http_method=scope["method"]) as request_span:
+            def name_after_route():
+                # The router stores the matched route in the scope it was given
+                route = getattr(scope.get("route"), "path", None)
+                if route and request_span.sampled:
+                    request_span.name = f"{scope['method']} {route}"
+                    request_span.set(http_route=route)
+
+            async def send_traced(message):
+                if message["type"] == "http.response.start":
+                    name_after_route()
+                    request_span.set(http_status_code=message["status"])
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_traced)
+            finally:
+                name_after_route()
+
+
+# ----------------------------------------------------------------------
+# Reading exported files
+# ----------------------------------------------------------------------
+
+def read_spans(path=TRACE_FILE):
+    with open(path, "r") as f:
+        for line in f:
+            for resource in json.loads(line)["resourceSpans"]:
+                for scope in resource["scopeSpans"]:
+                    for item in scope["spans"]:
+                        attributes = {a["key"]: next(iter(a["value"].values())) for a in item.get("attributes", [])}
+                        yield {
+                            "trace_id": item["traceId"], "span_id": item["spanId"], "parent_id": item.get("parentSpanId"),
+                            "name": item["name"], "ms": (int(item["endTimeUnixNano"]) - int(item["startTimeUnixNano"])) / 1e6,
+                            "start": int(item["startTimeUnixNano"]), "attributes": attributes, "error": item.get("status", {}).get("message"),
+                        }
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize exported trace files")
+    parser.add_argument("command", choices=["summary", "slowest"])
+    parser.add_argument("--file", default=TRACE_FILE)
+    parser.add_argument("--limit", type=int, default=5, help="Traces shown by slowest")
+    parser.add_argument("--name", help="Only traces whose root span has this name")
+    args = parser.parse_args(argv)
+
+    spans = list(read_spans(args.file))
+    if args.command == "summary":
+        by_name = {}
+        for item in spans:
+            by_name.setdefault(item["name"], []).append(item["ms"])
+        print(f"{'span':<48}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+        for name, values in sorted(by_name.items(), key=lambda entry: -sum(entry[1])):
+            print(f"{name[:47]:<48}{len(values):>7}{_percentile(values, 0.5):>10.1f}{_percentile(values, 0.95):>10.1f}{max(values):>10.1f}")
+        return 0
+
+    children = {}
+    for item in spans:
+        children.setdefault(item["parent_id"], []).append(item)
+    roots = [item for item in children.get(None, []) if not args.name or item["name"] == args.name]
+
+    def show(item, depth):
+        attributes = " ".join(f"{key}={value}" for key, value in item["attributes"].items())
+        print(f"{'  ' * depth}{item['name']}  {item['ms']:.1f} ms  {attributes}{'  ERROR ' + item['error'] if item['error'] else ''}")
+        for child in sorted(children.get(item["span_id"], []), key=lambda child: child["start"]):
+            show(child, depth + 1)
+
+    for root in sorted(roots, key=lambda item: -item["ms"])[:args.limit]:
+        print(f"\ntrace {root['trace_id']}")
+        show(root, 0)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
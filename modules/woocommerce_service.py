@@ -1,16 +1,51 @@
-from woocommerce import API
-import json
-from typing import Optional, Dict
+import json, os, threading, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Iterator, List
+
+from modules.lazy_imports import lazy_import
+from modules.circuit_breaker import breaker, timeout_for
+from modules.shared_state import connect
+from modules.tracing import span, annotate
+
+
+woocommerce = lazy_import("woocommerce")
+
+WC_TIMEOUT = float(os.getenv("WC_TIMEOUT", "10"))  # seconds per call, further bounded by the request/job deadline
+
+# Product cache: fresh for PRODUCT_CACHE_TTL, then served stale (and refreshed in the background) up to
+# PRODUCT_CACHE_STALE_TTL; 404s are remembered for PRODUCT_CACHE_NEGATIVE_TTL. 0 disables the cache.
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", "300"))
+PRODUCT_CACHE_STALE_TTL = float(os.getenv("PRODUCT_CACHE_STALE_TTL", "86400"))
+PRODUCT_CACHE_NEGATIVE_TTL = float(os.getenv("PRODUCT_CACHE_NEGATIVE_TTL", "60"))
+PRODUCT_CACHE_MAX_BYTES = int(os.getenv("PRODUCT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))  # in-process, per worker
+PRUNE_EVERY = 200
 
 
 class WooCommerceProductAPI:
     
     def __init__(self, url: str, consumer_key: str, consumer_secret: str):
-        self.wcapi = API(url=url, consumer_key=consumer_key, consumer_secret=consumer_secret, version="wc/v3", timeout=15)
-    
+        self.wcapi = woocommerce.API(url=url, consumer_key=consumer_key, consumer_secret=consumer_secret, version="wc/v3", timeout=WC_TIMEOUT)
+
+    def _get(self, endpoint: str, params: Optional[Dict] = None):
+        """GET through the woocommerce circuit breaker; 5xx responses count as failures"""
+        self.wcapi.timeout = timeout_for(WC_TIMEOUT)
+        with span("woocommerce.get", endpoint=endpoint) as requesting:
+            with breaker("woocommerce").guard() as call:
+                response = self.wcapi.get(endpoint, params=params)
+                if response.status_code >= 500:
+                    call.failed(f"HTTP {response.status_code}")
+            requesting.set(http_status_code=response.status_code)
+        return response
+
+    def fetch_product(self, product_id: int):
+        """(status code, raw JSON body) of one product; raises on network errors and open circuits"""
+        response = self._get(f"products/{product_id}")
+        return response.status_code, response.content
+
     def get_product_by_id(self, product_id: int) -> Optional[Dict]:
         try:
-            response = self.wcapi.get(f"products/{product_id}")
+            response = self._get(f"products/{product_id}")
             
             if response.status_code == 200:
                 return response.json()
@@ -23,10 +58,230 @@ class WooCommerceProductAPI:
             print(f"Exception occurred: {str(e)}")
             return None
 
+    def iter_products(self, category: Optional[int] = None, brand: Optional[int] = None, product_ids: Optional[List[int]] = None, per_page: int = 50) -> Iterator[Dict]:
+        """Yield published products one page at a time, so callers never hold the whole catalog"""
+        params = {"per_page": per_page, "status": "publish", "orderby": "id", "order": "asc"}
+        if category:
+            params["category"] = category
+        if brand:
+            params["brand"] = brand
+
+        # Explicit ids are requested in chunks of one page through "include"
+        id_chunks = [product_ids[i:i + per_page] for i in range(0, len(product_ids), per_page)] if product_ids else [None]
+        for chunk in id_chunks:
+            page = 1
+            while True:
+                page_params = dict(params, page=page)
+                if chunk:
+                    page_params["include"] = ",".join(str(pid) for pid in chunk)
+
+                response = self._get("products", params=page_params)
+                if response.status_code != 200:
+                    raise RuntimeError(f"Error listing products (page {page}): {response.status_code} - {response.text}")
+
+                products = response.json()
+                yield from products
+
+                total_pages = int(response.headers.get("X-WP-TotalPages", page))
+                if not products or page >= total_pages:
+                    break
+                page += 1
+
+    def iter_categories(self, per_page: int = 100) -> Iterator[Dict]:
+        """Yield every product category (id, name, slug, parent, ...)"""
+        page = 1
+        while True:
+            response = self._get("products/categories", params={"per_page": per_page, "page": page, "orderby": "id"})
+            if response.status_code != 200:
+                raise RuntimeError(f"Error listing categories (page {page}): {response.status_code} - {response.text}")
+
+            categories = response.json()
+            yield from categories
+
+            total_pages = int(response.headers.get("X-WP-TotalPages", page))
+            if not categories or page >= total_pages:
+                break
+            page += 1
+
+
+class _Entry:
+    __slots__ = ("status", "body", "fetched_at")
+
+    def __init__(self, status, body, fetched_at):
+        self.status = status  # 200 or 404
+        self.body = body  # raw JSON bytes (None for 404)
+        self.fetched_at = fetched_at
+
+    @property
+    def size(self):
+        return len(self.body or b"") + 200  # body + rough per-entry overhead
+
+    def ttl(self):
+        return PRODUCT_CACHE_TTL if self.status == 200 else PRODUCT_CACHE_NEGATIVE_TTL
+
+
+class ProductCache:
+    """
+    Product JSON cache, stale-while-revalidate, in two tiers:
+        - in-process LRU of raw JSON bodies, bounded by their total size (PRODUCT_CACHE_MAX_BYTES)
+        - STATE_DIR/product_cache.db, shared by the workers and kept across restarts
+    A fresh entry is returned as-is; a stale one is returned at once and refreshed in
+    the background; a miss is fetched once however many callers ask for it at the same
+    time. When WooCommerce fails, the last known copy is served whatever its age.
+    Entries hold the raw body, so every caller gets its own parsed dict.
+    """
+
+    def __init__(self, max_bytes=PRODUCT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> _Entry, least recently used first
+        self.bytes = 0
+        self.counts = {"fresh": 0, "stale": 0, "miss": 0, "negative": 0, "error": 0}
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> Event, one fetch per key at a time
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="product-refresh")
+
+    def _db(self):
+        conn = connect("product_cache")
+        conn.execute("CREATE TABLE IF NOT EXISTS products (key TEXT PRIMARY KEY, status INTEGER NOT NULL, body BLOB, fetched_at REAL NOT NULL)")
+        return conn
+
+    def _remember(self, key, entry, persist=True):
+        with self._lock:
+            old = self.entries.pop(key, None)
+            if old:
+                self.bytes -= old.size
+            self.entries[key] = entry
+            self.bytes += entry.size
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.size
+        if persist:
+            self._db().execute("INSERT OR REPLACE INTO products (key, status, body, fetched_at) VALUES (?, ?, ?, ?)", (key, entry.status, entry.body, entry.fetched_at))
+            self.writes += 1
+            if self.writes % PRUNE_EVERY == 0:
+                self.prune()
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry:
+                self.entries.move_to_end(key)
+                return entry
+        row = self._db().execute("SELECT status, body, fetched_at FROM products WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        entry = _Entry(row["status"], row["body"], row["fetched_at"])
+        self._remember(key, entry, persist=False)
+        return entry
+
+    def _claim(self, key):
+        """(event, owner): owner is True when the caller must fetch key and then release it"""
+        with self._lock:
+            running = self._inflight.get(key)
+            if running is None:
+                running = self._inflight[key] = threading.Event()
+                return running, True
+            return running, False
+
+    def _fresh(self, key):
+        """The entry for key if it is still fresh here or in the shared table (another worker may have refreshed it)"""
+        with self._lock:
+            entry = self.entries.get(key)
+        if entry is None or time.time() - entry.fetched_at >= entry.ttl():
+            row = self._db().execute("SELECT status, body, fetched_at FROM products WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            entry = _Entry(row["status"], row["body"], row["fetched_at"])
+            if time.time() - entry.fetched_at >= entry.ttl():
+                return None
+            self._remember(key, entry, persist=False)
+        return entry
+
+    def _fetch(self, key, fetch, claimed=None):
+        """
+        Fetch (or wait for the fetch already running for this key); returns the new entry or None on error.
+        claimed is the event of a claim the caller already holds.
+        """
+        if claimed is None:
+            running, owner = self._claim(key)
+            if not owner:
+                running.wait(WC_TIMEOUT * 2)
+                with self._lock:
+                    return self.entries.get(key)
+        else:
+            running = claimed
+
+        try:
+            entry = self._fresh(key)
+            if entry:
+                return entry
+            status, body = fetch()
+            if status not in (200, 404):
+                raise RuntimeError(f"HTTP {status}")
+            entry = _Entry(status, body if status == 200 else None, time.time())
+            self._remember(key, entry)
+            return entry
+        except Exception as e:
+            self.counts["error"] += 1
+            print(f"Product fetch failed ({key}): {e}")
+            return None
+        finally:
+            self._release(key, running)
+
+    def _release(self, key, running):
+        with self._lock:
+            del self._inflight[key]
+        running.set()
+
+    def get(self, key, fetch) -> Optional[Dict]:
+        """The product for key (None when it does not exist or cannot be fetched); fetch() -> (status, body)"""
+        entry = self._lookup(key)
+        age = time.time() - entry.fetched_at if entry else None
+
+        if entry and age < entry.ttl():
+            result = "fresh" if entry.status == 200 else "negative"
+        elif entry and entry.status == 200 and age < PRODUCT_CACHE_STALE_TTL:
+            result = "stale"
+            # Claimed here, so a key is queued for refresh at most once
+            running, owner = self._claim(key)
+            if owner:
+                try:
+                    self._refresher.submit(self._fetch, key, fetch, running)
+                except RuntimeError:  # refresher shut down
+                    self._release(key, running)
+        else:
+            result = "miss"
+            entry = self._fetch(key, fetch) or entry  # On error, the expired copy is better than nothing
+        self.counts[result] += 1
+        annotate(cache=result)
+
+        return json.loads(entry.body) if entry and entry.status == 200 else None
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self.entries.pop(key, None)
+            if entry:
+                self.bytes -= entry.size
+        self._db().execute("DELETE FROM products WHERE key = ?", (key,))
+
+    def prune(self):
+        """Drop shared entries too old to be served"""
+        cursor = self._db().execute("DELETE FROM products WHERE fetched_at < ?", (time.time() - max(PRODUCT_CACHE_STALE_TTL, PRODUCT_CACHE_NEGATIVE_TTL),))
+        return cursor.rowcount
+
+    def stats(self):
+        return {"entries": len(self.entries), "bytes": self.bytes, **self.counts}
+
+
+product_cache = ProductCache()
+
 
 def get_product(store_url: str, consumer_key: str, consumer_secret: str, product_id: int) -> Optional[Dict]:
-    wc_api = WooCommerceProductAPI(store_url, consumer_key, consumer_secret)  # Initialize API
-    product = wc_api.get_product_by_id(product_id)
-    return product
+    with span("product.get", product_id=product_id):
+        if not PRODUCT_CACHE_TTL:
+            return WooCommerceProductAPI(store_url, consumer_key, consumer_secret).get_product_by_id(product_id)
+        fetch = lambda: WooCommerceProductAPI(store_url, consumer_key, consumer_secret).fetch_product(product_id)
+        return product_cache.get(f"{store_url}|{product_id}", fetch)
 
 
@@ -0,0 +1,59 @@
+"""
+Minimal local stand-in for the Salesforce REST endpoints used by
+modules/salesforce_bulk_service.py, for trying the bulk backend without an org.
+
+    python other/mock_salesforce_server.py --port 8765
+
+    SALESFORCE_BACKEND=bulk SF_INSTANCE_URL=http://127.0.0.1:8765 SF_ACCESS_TOKEN=test python app.py
+
+Records without LastName or Company fail with REQUIRED_FIELD_MISSING, like the
+real API; every other record gets a fake Lead id. Each request is printed.
+"""
+import argparse, itertools, json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+lead_ids = itertools.count(1)
+
+
+class MockSalesforceHandler(BaseHTTPRequestHandler):
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if self.path == "/services/oauth2/token":
+            return self._reply(200, {"access_token": "mock-token", "instance_url": f"http://{self.headers['Host']}", "token_type": "Bearer"})
+
+        if not self.path.endswith("/composite/sobjects"):
+            return self._reply(404, [{"errorCode": "NOT_FOUND", "message": self.path}])
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            return self._reply(401, [{"errorCode": "INVALID_SESSION_ID", "message": "Session expired or invalid"}])
+
+        records = json.loads(body).get("records", [])
+        if len(records) > 200:
+            return self._reply(400, [{"errorCode": "EXCEEDED_ID_LIMIT", "message": "record limit reached. cannot submit more than 200 records into this call"}])
+
+        results = []
+        for record in records:
+            missing = [field for field in ("LastName", "Company") if not record.get(field)]
+            if missing:
+                results.append({"success": False, "errors": [{"statusCode": "REQUIRED_FIELD_MISSING", "message": f"Required fields are missing: {missing}", "fields": missing}]})
+            else:
+                results.append({"id": f"00Q{next(lead_ids):015d}", "success": True, "errors": []})
+        print(f"Composite sobjects: {len(records)} records, {sum(r['success'] for r in results)} created")
+        self._reply(200, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Salesforce REST API for the bulk lead backend")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    print(f"Mock Salesforce listening on http://127.0.0.1:{args.port}")
+    ThreadingHTTPServer(("127.0.0.1", args.port), MockSalesforceHandler).serve_forever()